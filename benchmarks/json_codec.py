@@ -0,0 +1,74 @@
+"""
+Compares the jsonb codec backends on payloads the bot actually sends.
+
+Run from the repository root with ``python -m benchmarks.json_codec``.
+Backends which aren't installed are skipped.
+"""
+
+import argparse
+import datetime
+import random
+import timeit
+
+from cogs.utils import jsonb
+
+
+def timer_payload():
+    # What a punishment timer stores in reminders.extra.
+    roles = [random.getrandbits(63) for _ in range(12)]
+    args = [random.getrandbits(63), random.getrandbits(63), random.getrandbits(63), roles, 1]
+    return {'args': args, 'kwargs': {}}
+
+
+def command_batch(rows=1000):
+    # What a batch of command usage looked like when sent through jsonb_to_recordset.
+    now = datetime.datetime.utcnow()
+    return [{
+        'guild': random.getrandbits(63),
+        'channel': random.getrandbits(63),
+        'author': random.getrandbits(63),
+        'used': (now - datetime.timedelta(seconds=i)).isoformat(),
+        'prefix': '.',
+        'command': random.choice(('help', 'reminder', 'warn', 'quote random', 'stats')),
+        'failed': random.random() < 0.05,
+    } for i in range(rows)]
+
+
+def available_backends():
+    for name in ('json', 'ujson', 'orjson'):
+        try:
+            yield jsonb.get_backend(name)
+        except ImportError:
+            print(f'{name} is not installed, skipping it.')
+
+
+def bench(codec, payload, number):
+    encoded = codec.encode(payload)
+    encode = timeit.timeit(lambda: codec.encode(payload), number=number) / number
+    decode = timeit.timeit(lambda: codec.decode(encoded), number=number) / number
+    return encode, decode
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=200, help='iterations for the 1k row batch')
+    parser.add_argument('--rows', type=int, default=1000, help='rows in the command batch')
+    args = parser.parse_args()
+
+    payloads = [
+        ('timer creation', timer_payload(), args.number * 100),
+        (f'command batch ({args.rows} rows)', command_batch(args.rows), args.number),
+    ]
+
+    print(f'{"payload":<28} {"backend":<8} {"format":<7} {"encode":>12} {"decode":>12}')
+    for backend in available_backends():
+        for binary in (False, True):
+            codec = jsonb.JSONBCodec(backend, binary=binary)
+            for label, payload, number in payloads:
+                encode, decode = bench(codec, payload, number)
+                print(f'{label:<28} {backend.name:<8} {codec.format:<7} '
+                      f'{encode * 1e6:>10.2f}us {decode * 1e6:>10.2f}us')
+
+
+if __name__ == '__main__':
+    main()
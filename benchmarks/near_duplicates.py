@@ -0,0 +1,128 @@
+"""
+Measures the near-duplicate spam detector on a synthetic raid.
+
+Run from the repository root with ``python -m benchmarks.near_duplicates``.
+Raiders post a few templates with random junk added, in between regular
+chatter. Each raider after the first few should be caught, nobody chatting should be.
+The exact duplicate check is shown for comparison.
+"""
+
+import argparse
+import random
+import string
+import time
+
+from cogs.utils.spam import NearDuplicateDetector, normalise, simhash
+
+TEMPLATES = [
+    'JOIN discord.gg/freenitro FOR FREE NITRO GIVEAWAY',
+    'this server is dead, come to discord.gg/abcdef instead',
+    '@everyone check out this amazing crypto opportunity https://example.com/invest',
+    'lmao imagine being a mod here, raided by the best',
+]
+
+WORDS = ('the a to and of i you it is that in was for on are with as be this have not but at what so we can '
+         'do my if just about like get all they will one from an up out there or your when me was no know '
+         'think time good people how some would go see make well could now way want really thing game play '
+         'new last first work day love back need still look even right going because something any other '
+         'anyone lunch today movie stream match patch update tonight weekend music song server bot').split()
+
+
+def junk(length):
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
+
+
+def raid_message(template):
+    text = template
+    if random.random() < 0.5:
+        text = f'{text} {junk(random.randint(3, 12))}'
+    if random.random() < 0.3:
+        text = f'{junk(random.randint(2, 6))} {text}'
+    if random.random() < 0.3:
+        text = text.upper()
+    if random.random() < 0.3:
+        text = text.replace(' ', '   ')
+    return text
+
+
+def chatter():
+    return ' '.join(random.choices(WORDS, k=random.randint(3, 25)))
+
+
+def corpus(raiders, chatters, messages):
+    """Returns ``(timestamp, author_id, content, is_raider)`` sorted by time, spread over a minute."""
+    events = []
+    for raider in range(raiders):
+        template = random.choice(TEMPLATES)
+        for _ in range(random.randint(1, 3)):
+            events.append((random.uniform(0, 60), raider, raid_message(template), True))
+
+    for _ in range(messages):
+        events.append((random.uniform(0, 60), raiders + random.randrange(chatters), chatter(), False))
+
+    events.sort()
+    return events
+
+
+class ExactDuplicates:
+    """What the per-content bucket amounts to, across users."""
+
+    def __init__(self, threshold, window):
+        self.threshold = threshold
+        self.window = window
+        self.seen = {}
+
+    def check(self, author_id, content, now):
+        authors = self.seen.setdefault(content, {})
+        flagged = sum(now - ts <= self.window for a, ts in authors.items() if a != author_id) >= self.threshold
+        authors[author_id] = now
+        return flagged
+
+
+def run(detector, events):
+    caught, false_positives = set(), set()
+    start = time.perf_counter()
+    for timestamp, author_id, content, is_raider in events:
+        if detector.check(author_id, content, timestamp):
+            (caught if is_raider else false_positives).add(author_id)
+    elapsed = time.perf_counter() - start
+
+    raiders = {author_id for _, author_id, _, is_raider in events if is_raider}
+    missed = raiders - caught
+    return elapsed, len(caught), len(missed), len(false_positives)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--raiders', type=int, default=300)
+    parser.add_argument('--chatters', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=1000, help='regular messages')
+    parser.add_argument('--capacity', type=int, default=1024, help='fingerprints kept by the detector')
+    parser.add_argument('--threshold', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    events = corpus(args.raiders, args.chatters, args.messages)
+    print(f'{len(events)} messages, {args.raiders} raiders, threshold {args.threshold}\n')
+
+    texts = [normalise(content) for _, _, content, _ in events]
+    start = time.perf_counter()
+    for text in texts:
+        simhash(text)
+    per_message = (time.perf_counter() - start) / len(texts)
+    print(f'simhash: {per_message * 1e6:.1f}us per message\n')
+
+    detectors = [('exact', ExactDuplicates(args.threshold, 30.0))]
+    detectors.extend((f'simhash d={distance}', NearDuplicateDetector(threshold=args.threshold, capacity=args.capacity,
+                                                                      max_distance=distance))
+                     for distance in (4, 6, 8, 10))
+
+    print(f'{"Detector":<16} {"us/msg":>8} {"Caught":>8} {"Missed":>8} {"False +":>8}')
+    for name, detector in detectors:
+        elapsed, caught, missed, false_positives = run(detector, events)
+        print(f'{name:<16} {elapsed / len(events) * 1e6:>8.1f} {caught:>8} {missed:>8} {false_positives:>8}')
+
+
+if __name__ == '__main__':
+    main()
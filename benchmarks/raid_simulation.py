@@ -0,0 +1,521 @@
+"""
+Simulates raids against the raid and spam handling, with Discord stubbed out.
+
+Run from the repository root with ``python -m benchmarks.raid_simulation``.
+The cogs are imported, so the bot's dependencies and a config.py are needed.
+Every scenario has regular members chatting while raiders join in quick
+succession and start spamming. Joins and messages are fed to RaidControl
+and Filtering like the gateway would, in simulated time. Bans, deletions
+and whatever the bot sends are only recorded. Raid mode starts off and is
+switched on by the join analysis, unless ``--raid-mode`` says otherwise.
+
+Raiders who got banned count as caught, banned members as false positives.
+Latency is the simulated time from a raider's first message to their ban.
+SpamChecker.is_spamming is also run on its own, as if strict raid mode had
+been on all along, which is what ``--checker`` swaps out to compare detectors.
+"""
+
+import argparse
+import asyncio
+import datetime
+import importlib
+import random
+import time
+import tracemalloc
+from collections import defaultdict, namedtuple
+from types import SimpleNamespace
+
+import discord
+import logbook
+
+from benchmarks.near_duplicates import TEMPLATES, WORDS, chatter, raid_message
+from cogs import raids
+from cogs.filtering import ActionEnum, Filtering
+from cogs.raids import RaidControl, RaidMode
+from cogs.utils import db
+from cogs.utils.executor import ModerationExecutor
+
+SCENARIOS = ('join_flood', 'copy_paste', 'mention_spam', 'random_suffix')
+
+DAY = 86400.0
+GUILD_ID = 100
+MOD_CHANNEL_ID = 200
+CHANNEL_BASE = 300
+BOT_ID = 1
+MEMBER_BASE = 10 ** 6
+JOINER_BASE = 2 * 10 ** 6
+RAIDER_BASE = 3 * 10 ** 6
+RAIDER_NAMES = ('raider', 'freenitro', 'xX_sh4dow_Xx', 'spammer')
+INVITE_FILTER = r'discord\.gg/\w+'
+
+# joined_at and created_at are POSIX timestamps.
+Person = namedtuple('Person', 'id name created_at joined_at has_avatar raider')
+Join = namedtuple('Join', 'timestamp person')
+Post = namedtuple('Post', 'timestamp person channel content mentions')
+
+
+def _utc(timestamp):
+    return datetime.datetime.utcfromtimestamp(timestamp)
+
+
+def _arrivals(start, end, rate):
+    t = start
+    while True:
+        t += random.expovariate(rate)
+        if t >= end:
+            return
+        yield t
+
+
+def build_events(scenario, args, now):
+    """Returns the scenario's people and their joins and posts, sorted by time."""
+    members = [Person(MEMBER_BASE + i, f'{random.choice(WORDS)}{random.choice(WORDS)}{i}',
+                      now - random.uniform(90, 2000) * DAY, now - random.uniform(30, 700) * DAY,
+                      random.random() < 0.9, False)
+               for i in range(args.members)]
+    people = list(members)
+    events = []
+
+    def post(t, person, content, *, channel=None, mentions=()):
+        if channel is None:
+            channel = 0 if random.random() < 0.5 else random.randrange(args.channels)
+        events.append(Post(now + t, person, channel, content, tuple(mentions)))
+
+    for t in _arrivals(0.0, args.duration, args.rate):
+        mentions = random.sample(members, random.randint(1, 2)) if random.random() < 0.05 else ()
+        post(t, random.choice(members), chatter(), mentions=mentions)
+
+    # Regular joins, some with brand new accounts.
+    for i, t in enumerate(_arrivals(0.0, args.duration, 1 / 30)):
+        person = Person(JOINER_BASE + i, f'{random.choice(WORDS)}{random.randint(0, 99)}',
+                        now + t - random.uniform(0, 400) * DAY, now + t, random.random() < 0.7, False)
+        people.append(person)
+        events.append(Join(now + t, person))
+        for _ in range(random.randint(0, 2)):
+            post(t + random.uniform(5, 60), person, chatter())
+
+    start = args.raid_start
+    for i in range(args.raiders):
+        t = random.uniform(start, start + args.join_window)
+        person = Person(RAIDER_BASE + i, f'{random.choice(RAIDER_NAMES)}{random.randint(0, 9999)}',
+                        now + t - random.uniform(0, 3) * DAY, now + t, random.random() < 0.2, True)
+        people.append(person)
+        events.append(Join(now + t, person))
+
+        template = random.choice(TEMPLATES)
+        t += random.uniform(1, 5)
+        if scenario == 'join_flood':
+            count = 1
+        elif scenario == 'mention_spam':
+            count = random.randint(1, 3)
+        else:
+            count = random.randint(3, 6)
+
+        for _ in range(count):
+            channel = 0 if random.random() < 0.7 else None
+            if scenario == 'join_flood':
+                post(t, person, random.choice(('hi', 'hello', 'yo', chatter())), channel=channel)
+            elif scenario == 'copy_paste':
+                post(t, person, template, channel=channel)
+            elif scenario == 'mention_spam':
+                mentioned = random.sample(members, random.randint(6, 12))
+                content = f'{chatter()} {" ".join(f"<@{m.id}>" for m in mentioned)}'
+                post(t, person, content, channel=channel, mentions=mentioned)
+            else:
+                post(t, person, raid_message(template), channel=channel)
+            t += random.uniform(0.5, 2)
+
+    events.sort(key=lambda e: e.timestamp)
+    return people, events
+
+
+class Clock:
+    """Stands in for the time module where the cogs use wall clock time."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeUser:
+    __slots__ = ('id', 'name', 'discriminator', 'avatar', 'bot', 'created_at')
+
+    def __init__(self, user_id, name, *, created_at=None, avatar=None, bot=False):
+        self.id = user_id
+        self.name = name
+        self.discriminator = '0001'
+        self.avatar = avatar
+        self.bot = bot
+        self.created_at = created_at
+
+    @property
+    def avatar_url(self):
+        return ''
+
+    def __hash__(self):
+        return self.id >> 22
+
+    def __str__(self):
+        return f'{self.name}#{self.discriminator}'
+
+
+class FakeMember(discord.Member):
+    """A member without connection state. Everything user related comes from a :class:`FakeUser`."""
+
+    __slots__ = ('raider',)
+
+    def __init__(self, guild, person):
+        self._user = FakeUser(person.id, person.name, created_at=_utc(person.created_at),
+                              avatar='a' if person.has_avatar else None)
+        self.guild = guild
+        self.joined_at = _utc(person.joined_at)
+        self.nick = None
+        self.raider = person.raider
+
+    @property
+    def guild_permissions(self):
+        return discord.Permissions.none()
+
+
+class FakeMessage:
+    __slots__ = ('id', 'channel', 'guild', 'author', 'content', 'mentions', 'created_at', 'reactions')
+
+    def __init__(self, message_id, channel, author, content, created_at, mentions=()):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.mentions = list(mentions)
+        self.created_at = created_at
+        self.reactions = []
+
+    @property
+    def clean_content(self):
+        return self.content
+
+    @property
+    def jump_url(self):
+        return f'https://discord.com/channels/{self.guild.id}/{self.channel.id}/{self.id}'
+
+    async def delete(self):
+        self.guild.deleted.append(self)
+
+    async def edit(self, **fields):
+        pass
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, guild, channel_id, name):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.slowmode_delay = 0
+
+    @property
+    def mention(self):
+        return f'<#{self.id}>'
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, content=None, *, embed=None, delete_after=None):
+        self.guild.sent += 1
+        return FakeMessage(0, self, self.guild.me, content, _utc(self.guild.clock.now))
+
+    async def edit(self, **fields):
+        self.slowmode_delay = fields.get('slowmode_delay', self.slowmode_delay)
+
+
+class FakeGuild:
+    """Records what would've been done to the guild instead of doing it."""
+
+    def __init__(self, clock, channels):
+        self.id = GUILD_ID
+        self.name = 'Simulated Guild'
+        self.clock = clock
+        self.me = SimpleNamespace(id=BOT_ID, name='FiresideBot', bot=True, guild_permissions=discord.Permissions.all())
+        self.verification_level = discord.VerificationLevel.low
+        self.mod_channel = FakeChannel(self, MOD_CHANNEL_ID, 'mods')
+        self.channels = [FakeChannel(self, CHANNEL_BASE + i, f'channel-{i}') for i in range(channels)]
+        self._channels = {c.id: c for c in (self.mod_channel, *self.channels)}
+        self._members = {}
+        # user_id -> when they were banned
+        self.bans = {}
+        self.deleted = []
+        self.sent = 0
+        self.raid_mode_at = None
+        self._message_id = 0
+
+    def __str__(self):
+        return self.name
+
+    def get_channel(self, channel_id):
+        return self._channels.get(channel_id)
+
+    def member(self, person):
+        try:
+            return self._members[person.id]
+        except KeyError:
+            member = self._members[person.id] = FakeMember(self, person)
+            return member
+
+    def message(self, post):
+        self._message_id += 1
+        return FakeMessage(self._message_id, self.channels[post.channel], self.member(post.person), post.content,
+                           _utc(post.timestamp), [self.member(p) for p in post.mentions])
+
+    async def ban(self, user, *, reason=None, delete_message_days=1):
+        self.bans.setdefault(user.id, self.clock.now)
+
+    async def kick(self, user, *, reason=None):
+        pass
+
+    async def edit(self, **fields):
+        self.verification_level = fields.get('verification_level', self.verification_level)
+
+
+class FakeDatabase:
+    """Answers the queries RaidControl and Filtering make while handling events."""
+
+    def __init__(self, guild, raid_config, filters):
+        self.guild = guild
+        self.raid_config = raid_config
+        self.filters = filters
+
+    async def acquire(self):
+        return self
+
+    async def release(self, connection):
+        pass
+
+    async def fetchrow(self, query, *args):
+        if 'FROM guild_raid_config' in query:
+            return dict(self.raid_config)
+
+    async def fetch(self, query, *args):
+        if 'FROM spamfilter' in query:
+            return self.filters
+        return []
+
+    async def execute(self, query, *args):
+        query = query.lstrip()
+        if query.startswith('UPDATE guild_raid_config'):
+            # Switched on by unusual joins.
+            self.raid_config.update(raid_mode=args[1], broadcast_channel=self.raid_config['auto_channel'],
+                                    auto_escalated=True)
+            if self.guild.raid_mode_at is None:
+                self.guild.raid_mode_at = self.guild.clock.now
+        elif query.startswith('INSERT INTO guild_raid_config'):
+            self.raid_config.update(raid_mode=args[1], broadcast_channel=None, auto_escalated=False)
+
+
+class FakeBot:
+    def __init__(self, guild, loop):
+        self.guild = guild
+        self.loop = loop
+        self.logger = logbook.Logger('RaidSimulation', level=logbook.WARNING)
+        self.user = guild.me
+        self.owner_id = 2
+        self.pool = None
+        self.moderation = ModerationExecutor(loop=loop)
+        # The only process, so it's always the leader.
+        self.leader = SimpleNamespace(is_leader=True, wait=self._leader_wait)
+        self.mod_config = SimpleNamespace(bot=self, modlog=guild.mod_channel, mod_channel=guild.mod_channel)
+        # Never set, so background loops waiting for it stay out of the way.
+        self._ready = asyncio.Event()
+
+    def get_guild(self, guild_id):
+        return self.guild if guild_id == self.guild.id else None
+
+    def get_cog(self, name):
+        if name == 'Event':
+            return self
+
+    async def get_guild_config(self, guild_id):
+        return self.mod_config
+
+    async def wait_until_ready(self):
+        await self._ready.wait()
+
+    async def _leader_wait(self):
+        pass
+
+    def dispatch(self, event, *args, **kwargs):
+        pass
+
+
+SimulationResult = namedtuple('SimulationResult', 'guild elapsed handlers')
+
+
+async def simulate(events, args, checker_class, now):
+    loop = asyncio.get_event_loop()
+    clock = Clock(now)
+    guild = FakeGuild(clock, args.channels)
+    bot = FakeBot(guild, loop)
+
+    raid_config = {
+        'id': GUILD_ID, 'raid_mode': RaidMode[args.raid_mode].value, 'broadcast_channel': None,
+        'mention_count': args.mention_count, 'safe_mention_channel_ids': [],
+        'auto_raid_mode': RaidMode.strict.value, 'auto_channel': MOD_CHANNEL_ID, 'auto_escalated': False,
+        'alert_channel': None, 'alert_slowmode': None,
+    }
+    filters = [{
+        'id': 1, 'guild_id': GUILD_ID, 'entity_id': GUILD_ID, 'entity_type': 'guild', 'regex': INVITE_FILTER,
+        'created': _utc(now), 'action': ActionEnum.DELETE.value, 'extra': {},
+    }]
+    bot.pool = db.Table._pool = FakeDatabase(guild, raid_config, filters)
+
+    raid_control = RaidControl(bot)
+    raid_control._spam_checker = defaultdict(checker_class)
+    filtering = Filtering(bot)
+    # The caches are keyed by the cog's repr, which earlier runs share.
+    RaidControl.get_raid_config.invalidate(raid_control, GUILD_ID)
+    Filtering.get_active_filters.invalidate(filtering, GUILD_ID)
+
+    handlers = defaultdict(float)
+    perf_counter = time.perf_counter
+    # Join analysis uses the wall clock.
+    raids.time = clock
+    start = perf_counter()
+    try:
+        for event in events:
+            clock.now = event.timestamp
+            if isinstance(event, Join):
+                member = guild.member(event.person)
+                t0 = perf_counter()
+                await raid_control.on_member_join(member)
+                handlers['RaidControl.on_member_join'] += perf_counter() - t0
+            else:
+                if event.person.id in guild.bans:
+                    continue
+
+                message = guild.message(event)
+                t0 = perf_counter()
+                await raid_control.on_message(message)
+                t1 = perf_counter()
+                await filtering.on_message(message)
+                handlers['RaidControl.on_message'] += t1 - t0
+                handlers['Filtering.on_message'] += perf_counter() - t1
+
+            # Let queued bans go through before the next event.
+            await asyncio.sleep(0)
+            while bot.moderation.pending:
+                await asyncio.sleep(0)
+        elapsed = perf_counter() - start
+    finally:
+        raids.time = time
+        raid_control.cog_unload()
+        await bot.moderation.close()
+        db.Table._pool = None
+
+    return SimulationResult(guild, elapsed, handlers)
+
+
+def run_checker(events, args, checker_class, now):
+    """Feeds every message to a single checker. Returns the seconds taken and who got flagged."""
+    guild = FakeGuild(Clock(now), args.channels)
+    checker = checker_class()
+    items = [(guild.member(e.person), None) if isinstance(e, Join) else (None, guild.message(e)) for e in events]
+
+    flagged = set()
+    start = time.perf_counter()
+    for member, message in items:
+        if member is not None:
+            checker.is_fast_join(member)
+        elif checker.is_spamming(message):
+            flagged.add(message.author.id)
+    return time.perf_counter() - start, sum(m is not None for _, m in items), flagged
+
+
+def _percentile(values, fraction):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_checker(path):
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('scenarios', nargs='*', metavar='scenario', default=SCENARIOS,
+                        help=f'any of {", ".join(SCENARIOS)}, all of them by default')
+    parser.add_argument('--members', type=int, default=300, help='established members chatting')
+    parser.add_argument('--raiders', type=int, default=150)
+    parser.add_argument('--channels', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=3.0, help='regular messages per second')
+    parser.add_argument('--duration', type=float, default=240.0, help='seconds of regular traffic')
+    parser.add_argument('--raid-start', type=float, default=90.0, help='when raiders start joining')
+    parser.add_argument('--join-window', type=float, default=30.0, help='seconds over which raiders join')
+    parser.add_argument('--raid-mode', choices=[m.name for m in RaidMode], default='off',
+                        help='raid mode to start in, unusual joins switch on strict mode either way')
+    parser.add_argument('--mention-count', type=int, default=5)
+    parser.add_argument('--checker', default='cogs.raids:SpamChecker', help='spam checker class, as module:name')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if unknown := set(args.scenarios) - set(SCENARIOS):
+        parser.error(f'unknown scenarios: {", ".join(sorted(unknown))}')
+
+    checker_class = load_checker(args.checker)
+    loop = asyncio.get_event_loop()
+    rows = []
+    for scenario in args.scenarios:
+        random.seed(args.seed)
+        now = time.time()
+        people, events = build_events(scenario, args, now)
+        raiders = {p.id for p in people if p.raider}
+        first_post = {}
+        for e in events:
+            if isinstance(e, Post):
+                first_post.setdefault(e.person.id, e.timestamp)
+
+        result = loop.run_until_complete(simulate(events, args, checker_class, now))
+        tracemalloc.start()
+        loop.run_until_complete(simulate(events, args, checker_class, now))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        guild = result.guild
+        banned = set(guild.bans)
+        latencies = [guild.bans[i] - first_post[i] for i in banned & raiders if i in first_post]
+        raid_mode = guild.raid_mode_at and guild.raid_mode_at - (now + args.raid_start)
+        deleted = sum(m.author.raider for m in guild.deleted)
+        checked = run_checker(events, args, checker_class, now)
+        rows.append((scenario, len(events), result, len(banned & raiders), len(raiders - banned),
+                     len(banned - raiders), latencies, raid_mode, deleted, len(guild.deleted) - deleted, peak,
+                     checked, raiders))
+
+    print(f'{args.raiders} raiders, {args.members} members, {args.rate} messages/s over {args.duration:.0f}s, '
+          f'raid mode {args.raid_mode}\n')
+    print(f'{"Scenario":<14} {"Events":>7} {"Events/s":>9} {"Caught":>7} {"Missed":>7} {"False +":>8} '
+          f'{"p50 s":>6} {"p95 s":>6} {"Raid s":>7} {"Deleted":>8} {"Del. FP":>8} {"Peak KiB":>9}')
+    for scenario, count, result, caught, missed, false_positives, latencies, raid_mode, deleted, deleted_fp, \
+            peak, _, _ in rows:
+        raid_mode = '-' if raid_mode is None else f'{raid_mode:.1f}'
+        print(f'{scenario:<14} {count:>7} {count / result.elapsed:>9.0f} {caught:>7} {missed:>7} '
+              f'{false_positives:>8} {_percentile(latencies, 0.5):>6.1f} {_percentile(latencies, 0.95):>6.1f} '
+              f'{raid_mode:>7} {deleted:>8} {deleted_fp:>8} {peak / 1024:>9.0f}')
+
+    print(f'\n{"Scenario":<14} {"Handler":<28} {"us/event":>9}')
+    for scenario, count, result, *_ in rows:
+        for name, elapsed in sorted(result.handlers.items()):
+            print(f'{scenario:<14} {name:<28} {elapsed / count * 1e6:>9.1f}')
+
+    print(f'\n{args.checker}.is_spamming, strict raid mode all along:')
+    print(f'{"Scenario":<14} {"us/msg":>7} {"Caught":>7} {"Missed":>7} {"False +":>8}')
+    for scenario, *_, (elapsed, messages, flagged), raiders in rows:
+        print(f'{scenario:<14} {elapsed / messages * 1e6:>7.1f} {len(flagged & raiders):>7} '
+              f'{len(raiders - flagged):>7} {len(flagged - raiders):>8}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,8 @@
-import json
 import logging
+import signal
 import sys
+import time
 import traceback
-from collections import deque
 from datetime import datetime
 
 import aiohttp
@@ -14,11 +14,22 @@ from logbook.compat import redirect_logging
 from sentry_sdk import init as sen_init, push_scope as sen_configure_scope, capture_exception
 
 import config
+from cogs.utils import metrics, tracing
+from cogs.utils.cache import all_caches
 from cogs.utils.context import Context
+from cogs.utils.executor import ModerationExecutor
+from cogs.utils.flight_recorder import FlightRecorder
+from cogs.utils.leader import LeaderElection
+from cogs.utils.loop_monitor import LoopMonitor
+from cogs.utils.notifications import Notifications
+from cogs.utils.writer import WriteBehind
 
 redirect_logging()
 StreamHandler(sys.stderr).push_application()
 
+LISTENER_LATENCY = metrics.histogram('bot_listener_duration_seconds', 'How long event listeners took to run.',
+                                     ('event',))
+
 
 class FiresideBot(commands.Bot):
     def __init__(self, command_prefix, **options):
@@ -31,8 +42,24 @@ class FiresideBot(commands.Bot):
 
         self.session = aiohttp.ClientSession(loop=self.loop)
         self.pool = None
+        # Buffered bulk inserts, started once the pool exists.
+        self.writer = WriteBehind(loop=self.loop)
+        # Bulk bans, kicks and the like. Lives here so queued actions survive cog reloads.
+        self.moderation = ModerationExecutor(loop=self.loop)
+        # Decides which process runs background jobs that must only run once, started along with the pool.
+        self.leader = LeaderElection("background jobs", loop=self.loop)
+        # LISTENs for notifications from the database, e.g. timers created by other processes.
+        self.notifications = Notifications(loop=self.loop)
+        # Only started if a port is configured.
+        self.metrics = None
+        self.loop_monitor = LoopMonitor(self.loop, threshold=getattr(config, "loop_stall_threshold", 0.25))
+        metrics.registry.register_collector('bot', self.collect_metrics)
+        self._trace_http()
 
-        self._prev_events = deque(maxlen=10)
+        # The most recent gateway payloads, dumped on crashes, SIGUSR1 and through a command.
+        self.flight_recorder = FlightRecorder(max_events=getattr(config, "flight_recorder_events", 5000),
+                                              max_bytes=getattr(config, "flight_recorder_bytes", 8 * 1024 ** 2),
+                                              json_backend=getattr(config, "json_backend", None))
         self.uptime = None
         # Hard-code 0x1 and bot owner.
         self.maintainers = {189462608334553089, self.owner_id}
@@ -62,8 +89,83 @@ class FiresideBot(commands.Bot):
     def config(self):
         return __import__("config")
 
-    async def on_socket_response(self, data):
-        self._prev_events.append(data)
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # Attribute database work done by listeners to them, commands override this later on.
+        tracing.set_owner(tracing.Trace(getattr(coro, '__qualname__', event_name)))
+        start = time.perf_counter()
+        try:
+            await super()._run_event(coro, event_name, *args, **kwargs)
+        finally:
+            LISTENER_LATENCY.labels(event_name).observe(time.perf_counter() - start)
+
+    def _trace_http(self):
+        # Attribute time spent on Discord's API, including rate limits, to whoever made the request.
+        request = self.http.request
+
+        async def traced_request(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await request(*args, **kwargs)
+            finally:
+                tracing.add_http_time(time.perf_counter() - start)
+
+        self.http.request = traced_request
+
+    def collect_metrics(self):
+        """Pool and cache numbers for the metrics endpoint, read when it's scraped."""
+        yield 'discord_cached_objects', 'gauge', 'Objects in the discord.py cache.', [
+            ({'kind': 'guilds'}, len(self.guilds)),
+            ({'kind': 'users'}, len(self.users)),
+            ({'kind': 'messages'}, len(self.cached_messages)),
+        ]
+
+        caches = all_caches()
+        yield 'bot_cache_entries', 'gauge', 'Entries in cached functions.', [
+            ({'cache': name}, len(func.cache)) for name, func in caches.items()
+        ]
+        stats = [(name, *func.get_stats()) for name, func in caches.items()]
+        yield 'bot_cache_hits_total', 'counter', 'Hits of LRU cached functions.', [
+            ({'cache': name}, hits) for name, hits, _ in stats
+        ]
+        yield 'bot_cache_misses_total', 'counter', 'Misses of LRU cached functions.', [
+            ({'cache': name}, misses) for name, _, misses in stats
+        ]
+
+        yield 'moderation_actions_pending', 'gauge', 'Moderation actions queued or running.', [
+            ({}, self.moderation.pending)
+        ]
+        yield 'moderation_concurrency', 'gauge', 'Moderation actions allowed to run at once.', [
+            ({}, self.moderation.limit)
+        ]
+
+        pool = self.pool
+        if pool is None:
+            return
+
+        yield 'db_pool_connections', 'gauge', 'Database connections by state.', [
+            ({'state': 'size'}, pool.size),
+            ({'state': 'max'}, pool.max_size),
+            ({'state': 'in_use'}, len(pool.checkouts())),
+        ]
+        yield 'db_pool_waiters', 'gauge', 'Tasks waiting for a database connection.', [({}, pool.waiters)]
+        yield 'db_pool_acquires_total', 'counter', 'Connections acquired from the pool.', [
+            ({}, pool.telemetry.total_acquires)
+        ]
+        yield 'db_pool_acquire_wait_seconds_total', 'counter', 'Time spent waiting for connections.', [
+            ({}, pool.telemetry.total_wait)
+        ]
+        yield 'db_writer_pending_rows', 'gauge', 'Rows buffered for bulk inserts.', [
+            ({'table': s.table}, s.pending) for s in self.writer.stats()
+        ]
+
+    def dispatch(self, event_name, *args, **kwargs):
+        # Recorded right away, a listener would cost a task per payload.
+        if event_name == "socket_response":
+            self.flight_recorder.record(args[0])
+        super().dispatch(event_name, *args, **kwargs)
+
+    def _dump_flight_recorder(self):
+        self.loop.create_task(self.flight_recorder.save("signal"))
 
     async def on_ready(self):
         if self.uptime is None:
@@ -80,8 +182,13 @@ class FiresideBot(commands.Bot):
         if ctx.command is None:
             return
 
-        async with ctx.acquire():
-            await self.invoke(ctx)
+        # Attribute all database work done by this command to its context.
+        token = tracing.set_owner(ctx)
+        try:
+            async with ctx.acquire():
+                await self.invoke(ctx)
+        finally:
+            tracing.reset_owner(token)
 
     async def on_message(self, message):
         if message.author.bot:
@@ -134,15 +241,34 @@ class FiresideBot(commands.Bot):
             # sys.exc_info() is used under the hood.
             capture_exception()
 
+    async def start(self, *args, **kwargs):
+        self.loop_monitor.start()
+        try:
+            self.loop.add_signal_handler(signal.SIGUSR1, self._dump_flight_recorder)
+        except (AttributeError, NotImplementedError):
+            # No SIGUSR1 on Windows.
+            pass
+
+        if port := getattr(config, "metrics_port", None):
+            self.metrics = metrics.MetricsServer(port=port)
+            await self.metrics.start()
+
+        await super().start(*args, **kwargs)
+
+    async def close(self):
+        # Write whatever is still buffered while we still can.
+        await self.writer.close()
+        await self.moderation.close()
+        await self.leader.close()
+        await self.notifications.close()
+        self.loop_monitor.stop()
+        if self.metrics is not None:
+            await self.metrics.close()
+        await super().close()
+
     def run(self):
         try:
             super().run(config.token, reconnect=True)
-        finally:
-            with open("prev_events.log", "w", encoding="utf-8") as fp:
-                for data in self._prev_events:
-                    try:
-                        x = json.dumps(data, ensure_ascii=True, indent=4)
-                    except:
-                        fp.write(f"{data}\n")
-                    else:
-                        fp.write(f"{x}\n")
+        except BaseException:
+            self.flight_recorder.dump("crash")
+            raise
@@ -5,6 +5,7 @@ import discord
 from discord.ext import commands
 
 from cogs.utils import is_mod
+from cogs.utils.executor import ClearReactions
 from cogs.utils.meta_cog import Cog
 
 
@@ -146,10 +147,17 @@ class Cleaner(Cog):
             return await ctx.send(f'Too many messages to search for ({search}/2000)')
 
         total_reactions = 0
+        clears = []
         async for message in ctx.history(limit=search, before=ctx.message):
             if len(message.reactions):
                 total_reactions += sum(r.count for r in message.reactions)
-                await message.clear_reactions()
+                clears.append(ClearReactions(message))
+
+        job = self.bot.moderation.submit(clears, title=f'Clearing reactions from {len(clears)} messages',
+                                         channel=ctx.channel if len(clears) > 10 else None)
+        results = await job.wait()
+        if any(error is not None for _, error in results):
+            return await ctx.send(f'Removed reactions from {job.succeeded}/{job.total} messages.')
 
         await ctx.send(f'Successfully removed {total_reactions} reactions.')
 
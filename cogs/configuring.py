@@ -70,6 +70,9 @@ class Ignores(db.Table):
     # Either a channel or an author.
     entity_id = db.Column(db.Integer(big=True), index=True, unique=True)
 
+    is_ignored = db.Statement("SELECT 1 FROM ignores WHERE guild_id=$1 AND entity_id=$2;")
+    is_ignored_in = db.Statement("SELECT 1 FROM ignores WHERE guild_id=$1 AND entity_id IN ($2, $3);")
+
 
 class CommandConfig(db.Table, table_name='command_config'):
     id = db.PrimaryKeyColumn()
@@ -386,14 +389,10 @@ class Config(Cog):
                 if member is not None and member.guild_permissions.manage_guild:
                     return False
 
-        connection = connection or self.bot.pool
-
         if channel_id is None:
-            query = "SELECT 1 FROM ignores WHERE guild_id=$1 AND entity_id=$2;"
-            row = await connection.fetchrow(query, guild_id, member_id)
+            row = await Ignores.is_ignored.fetchrow(guild_id, member_id, connection=connection)
         else:
-            query = "SELECT 1 FROM ignores WHERE guild_id=$1 AND entity_id IN ($2, $3);"
-            row = await connection.fetchrow(query, guild_id, member_id, channel_id)
+            row = await Ignores.is_ignored_in.fetchrow(guild_id, member_id, channel_id, connection=connection)
 
         return row is not None
 
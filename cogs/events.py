@@ -9,7 +9,7 @@ from difflib import Differ
 import discord
 from discord import Message, Member
 
-from cogs.utils import human_timedelta, Plural, embed_paginate
+from cogs.utils import human_timedelta, Plural, embed_paginate, db
 from cogs.utils.cache import cache, ExpiringCache
 from cogs.utils.meta_cog import Cog
 from cogs.utils.paginators import BulkDeletePaginator
@@ -91,6 +91,17 @@ class EventConfig:
         return self._resolve_channel(self.verification_channel_id)
 
 
+guild_config_statement = db.Statement(
+    "SELECT * FROM guild_config gc JOIN punishment_config pc ON gc.id = pc.id WHERE pc.id = $1",
+    name='guild_config.event_config'
+)
+
+vc_mapping_statement = db.Statement(
+    "SELECT vc_channel_id, channel_id FROM vc_channel_config WHERE id = $1",
+    name='vc_channel_config.mappings'
+)
+
+
 class Event(Cog):
     """
     Event cog for message handling.
@@ -105,16 +116,13 @@ class Event(Cog):
 
     @cache()
     async def get_guild_config(self, guild_id) -> typing.Optional[EventConfig]:
-        query = """SELECT * FROM guild_config gc JOIN punishment_config pc ON gc.id = pc.id WHERE pc.id = $1"""
-
         async with self.bot.pool.acquire() as con:
-            record = await con.fetchrow(query, guild_id)
+            record = await guild_config_statement.fetchrow(guild_id, connection=con)
             if not record:
                 return
 
             # Also fetch vc mappings.
-            vc_mapping_query = "SELECT vc_channel_id, channel_id FROM vc_channel_config WHERE id = $1"
-            mappings = await con.fetch(vc_mapping_query, guild_id)
+            mappings = await vc_mapping_statement.fetch(guild_id, connection=con)
             return record and await EventConfig.from_record(record, self.bot, mappings)
 
     @Cog.listener()
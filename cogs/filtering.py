@@ -77,6 +77,8 @@ class SpamFilter(db.Table):
     # Extra information pertaining an action
     extra = db.Column(db.JSON, default="'{}'::jsonb")
 
+    active_filters = db.Statement("SELECT * FROM spamfilter WHERE guild_id = $1 ORDER BY id")
+
 
 def wrap_exception(func):
     async def wrap(*args, **kwargs):
@@ -415,10 +417,8 @@ class Scope(commands.Converter):
 class Filtering(Cog):
     @cache()
     async def get_active_filters(self, guild_id):
-        query = "SELECT * FROM spamfilter WHERE guild_id = $1 ORDER BY id"
-        async with self.bot.pool.acquire() as con:
-            records = await con.fetch(query, guild_id)
-            return records and GuildFilter(records, guild_id, self.bot)
+        records = await SpamFilter.active_filters.fetch(guild_id)
+        return records and GuildFilter(records, guild_id, self.bot)
 
     async def filter_message(self, message):
         if isinstance(message.author, discord.User):
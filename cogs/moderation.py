@@ -55,6 +55,7 @@ class Moderation(Cog):
 
         timer = await reminder.create_timer(duration.dt, "tempblock", ctx.guild.id, ctx.author.id,
                                             ctx.channel.id, member.id,
+                                            guild_id=ctx.guild.id, author_id=ctx.author.id, target_id=member.id,
                                             connection=ctx.db,
                                             created=ctx.message.created_at)
 
@@ -67,7 +68,7 @@ class Moderation(Cog):
         else:
             await ctx.send(f"Blocked {member} for {time.human_timedelta(duration.dt, source=timer.created_at)}.")
 
-    @commands.Cog.listener()
+    @Cog.listener()
     async def on_tempblock_timer_complete(self, timer):
         guild_id, mod_id, channel_id, member_id = timer.args
 
@@ -55,8 +55,8 @@ class Punishments(Cog):
         # Check if they're already punished.
         # The bot doesn't differentiate between a shitpost and a jailed punishment
         # because that would lead to undefined behaviour (e.g role state clash, double punishment).
-        query = "SELECT 1 FROM reminders WHERE event = 'punish' AND extra #>> '{args, 2}' = $1"
-        record = await ctx.db.fetchrow(query, str(member.id))
+        query = "SELECT 1 FROM reminders WHERE event = 'punish' AND guild_id = $1 AND target_id = $2"
+        record = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
 
         if record:
             await ctx.send(f"{member} is already punished."
@@ -68,7 +68,8 @@ class Punishments(Cog):
         roles = list(set(r.id for r in member.roles) - managed_roles)
 
         await reminder.create_timer(duration.dt, 'punish', ctx.guild.id, ctx.author.id,
-                                    member.id, roles, type_, connection=ctx.db)
+                                    member.id, roles, type_, guild_id=ctx.guild.id, author_id=ctx.author.id,
+                                    target_id=member.id, connection=ctx.db)
 
         duration_delta = human_timedelta(duration.dt)
         # This is a work-around for discord's awful "nitrobooster" feature.
@@ -156,8 +157,8 @@ class Punishments(Cog):
         if not reminder:
             return await ctx.send("Sorry, this is currently unavailable. Load the `Reminder` cog.")
 
-        query = "SELECT * FROM reminders WHERE event ='punish' AND extra #>> '{args, 2}' = $1"
-        record = await ctx.db.fetchrow(query, str(member.id))
+        query = "SELECT * FROM reminders WHERE event = 'punish' AND guild_id = $1 AND target_id = $2"
+        record = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
 
         timer = Timer(record=record) if record else None
         if not timer:
@@ -165,10 +166,6 @@ class Punishments(Cog):
 
         # Dispatch timer.
         await reminder.call_timer(timer)
-        if reminder._current_timer and reminder._current_timer.id == timer.id:
-            # Cancel and re-run.
-            reminder._task.cancel()
-            reminder._task = self.bot.loop.create_task(reminder.dispatch_timers())
 
         await ctx.send(f"Punishment for {member} was successfully cancelled.")
 
@@ -180,10 +177,11 @@ class Punishments(Cog):
         query = """
                 SELECT expires FROM reminders
                 WHERE event = 'punish'
-                AND extra #>> '{args, 2}' = $1
+                AND guild_id = $1
+                AND target_id = $2
                 """
 
-        expires = await ctx.db.fetchval(query, str(member.id))
+        expires = await ctx.db.fetchval(query, ctx.guild.id, member.id)
         if not expires:
             return await ctx.send("This member is currently not punished.")
 
@@ -195,20 +193,20 @@ class Punishments(Cog):
         """Shows the 10 latest currently running punishments."""
 
         query = """
-                SELECT expires, extra #>> '{args,1}', extra #>> '{args,2}'
+                SELECT expires, author_id, target_id
                 FROM reminders
                 WHERE event = 'punish'
-                AND extra #>> '{args,0}' = $1
+                AND guild_id = $1
                 ORDER BY expires
                 LIMIT 10
                 """
 
-        records = await ctx.db.fetch(query, str(ctx.guild.id))
+        records = await ctx.db.fetch(query, ctx.guild.id)
         if not records:
             return await ctx.send(":x: No punishments are currently in place.")
 
         def get_member(id_):
-            return ctx.guild.get_member(int(id_)) or f"Member left (ID: {id_})"
+            return ctx.guild.get_member(id_) or f"Member left (ID: {id_})"
 
         entries = []
         for expires, mod_id, member_id in records:
@@ -75,7 +75,9 @@ class Quotes(Cog):
             args = (guild.id, member.id)
 
         query = f"SELECT id, quote, user_id FROM quotes WHERE guild_id = $1 {subcheck}"
-        records = await ctx.db.fetch(query, *args)
+        async with ctx.replica() as con:
+            records = await con.fetch(query, *args)
+
         if not records:
             await ctx.send("Could not find any quotes for this server...")
             return
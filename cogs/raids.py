@@ -1,5 +1,6 @@
 import asyncio
 import datetime
+import time
 from collections import defaultdict
 from enum import Enum
 from typing import Optional
@@ -8,8 +9,11 @@ import discord
 from discord.ext import commands, tasks
 
 from cogs.utils import human_timedelta, is_mod, db
+from cogs.utils.anomaly import ChannelBaseline, JoinAnalyzer
 from cogs.utils.cache import cache, ExpiringCache
+from cogs.utils.executor import Ban
 from cogs.utils.meta_cog import Cog
+from cogs.utils.spam import NearDuplicateDetector, SlidingWindowCounter
 
 
 class RaidMode(Enum):
@@ -31,11 +35,30 @@ class GuildRaidConfig(db.Table, table_name="guild_raid_config"):
     mention_count = db.Column(db.Integer(small=True))
     # Channels excluded from mention bans.
     safe_mention_channel_ids = db.Column(db.Array(db.Integer(big=True)))
-
-
-class CooldownByContent(commands.CooldownMapping):
-    def _bucket_key(self, message):
-        return message.channel.id, message.content
+    # The raid mode unusual joins switch on by themselves, if any.
+    auto_raid_mode = db.Column(db.Integer(small=True))
+    # Where automatic raid mode broadcasts to.
+    auto_channel = db.Column(db.Integer(big=True))
+    # Whether the current raid mode was switched on automatically, and is switched off again once it's quiet.
+    auto_escalated = db.Column(db.Boolean, default=False)
+    # Where unusual message rates are reported to, if anywhere.
+    alert_channel = db.Column(db.Integer(big=True))
+    # The slowmode, in seconds, set in channels with unusual message rates.
+    alert_slowmode = db.Column(db.Integer(small=True))
+
+    get_config = db.Statement("SELECT * FROM guild_raid_config WHERE id = $1")
+
+
+class ChannelBaselines(db.Table, table_name="channel_baselines"):
+    # The usual messages and unique authors per 10 seconds, see cogs.utils.anomaly.ChannelBaseline.
+    channel_id = db.Column(db.Integer(big=True), primary_key=True)
+    guild_id = db.Column(db.Integer(big=True), index=True)
+    rate_mean = db.Column(db.Double)
+    rate_var = db.Column(db.Double)
+    authors_mean = db.Column(db.Double)
+    authors_var = db.Column(db.Double)
+    # How many intervals the baseline is made up of.
+    samples = db.Column(db.Integer(big=True))
 
 
 def is_new(member):
@@ -46,14 +69,18 @@ def is_new(member):
 
 
 class SpamChecker:
+    # The counters take up a fixed amount of memory per guild, no matter how many
+    # different users or messages there are. Channels are few, so they need fewer counters.
     def __init__(self):
-        self.by_content = CooldownByContent.from_cooldown(15, 17.0, commands.BucketType.member)
-        self.by_user = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.user)
+        self.by_content = SlidingWindowCounter(15, 17.0)
+        self.by_user = SlidingWindowCounter(10, 12.0)
         self.last_join = None
-        self.new_user = commands.CooldownMapping.from_cooldown(30, 35.0, commands.BucketType.channel)
+        self.new_user = SlidingWindowCounter(30, 35.0, width=64)
 
         self.fast_joiners = ExpiringCache(seconds=1800.0)
-        self.hit_and_run = commands.CooldownMapping.from_cooldown(10, 12.0, commands.BucketType.channel)
+        self.hit_and_run = SlidingWindowCounter(10, 12.0, width=64)
+        # Catches raiders posting the same message with random junk added, across channels.
+        self.near_duplicates = NearDuplicateDetector(threshold=5, window=30.0)
 
     def is_spamming(self, message):
         if message.guild is None:
@@ -61,22 +88,22 @@ class SpamChecker:
 
         current = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
 
+        channel_id = message.channel.id
         if message.author.id in self.fast_joiners:
-            bucket = self.hit_and_run.get_bucket(message)
-            if bucket.update_rate_limit(current):
+            if self.hit_and_run.update(channel_id, current):
                 return True
 
         if is_new(message.author):
-            new_bucket = self.new_user.get_bucket(message)
-            if new_bucket.update_rate_limit(current):
+            if self.new_user.update(channel_id, current):
                 return True
 
-        user_bucket = self.by_user.get_bucket(message)
-        if user_bucket.update_rate_limit(current):
+        if self.by_user.update(message.author.id, current):
+            return True
+
+        if self.by_content.update((channel_id, message.content), current):
             return True
 
-        content_bucket = self.by_content.get_bucket(message)
-        if content_bucket.update_rate_limit(current):
+        if self.near_duplicates.check(message.author.id, message.content, current):
             return True
 
         return False
@@ -95,7 +122,8 @@ class SpamChecker:
 
 class RaidConfig:
     __slots__ = ("bot", "id", "raid_mode", "broadcast_channel_id",
-                 "mention_count", "safe_mention_channel_ids")
+                 "mention_count", "safe_mention_channel_ids", "auto_raid_mode", "auto_channel_id", "auto_escalated",
+                 "alert_channel_id", "alert_slowmode")
 
     @classmethod
     async def from_record(cls, record, bot):
@@ -107,6 +135,11 @@ class RaidConfig:
         self.broadcast_channel_id = record["broadcast_channel"]
         self.mention_count = record["mention_count"]
         self.safe_mention_channel_ids = set(record["safe_mention_channel_ids"] or [])
+        self.auto_raid_mode = record["auto_raid_mode"]
+        self.auto_channel_id = record["auto_channel"]
+        self.auto_escalated = record["auto_escalated"]
+        self.alert_channel_id = record["alert_channel"]
+        self.alert_slowmode = record["alert_slowmode"]
         return self
 
     @property
@@ -114,6 +147,24 @@ class RaidConfig:
         guild = self.bot.get_guild(self.id)
         return guild and guild.get_channel(self.broadcast_channel_id)
 
+    @property
+    def auto_channel(self):
+        guild = self.bot.get_guild(self.id)
+        return guild and guild.get_channel(self.auto_channel_id)
+
+    @property
+    def alert_channel(self):
+        guild = self.bot.get_guild(self.id)
+        return guild and guild.get_channel(self.alert_channel_id)
+
+
+# Join scores from which automatic raid mode goes strict.
+STRICT_SCORE = 2.0
+# How long automatic raid mode stays on after the last unusual join.
+QUIET_PERIOD = datetime.timedelta(minutes=15)
+# How often a channel's unusual message rate is reported at most.
+ALERT_COOLDOWN = 300.0
+
 
 # This is inspired by Danny's raid handling and
 # includes partial source code licenced under MIT.
@@ -123,25 +174,43 @@ class RaidControl(Cog):
     def __init__(self, bot):
         super().__init__(bot)
         self._spam_checker = defaultdict(SpamChecker)
+        # Outlives raid mode, the analyzers learn how fast members usually join.
+        self._join_analyzers = defaultdict(JoinAnalyzer)
+        # (guild_id, channel_id) -> ChannelBaseline for guilds with message rate alerts.
+        self._channel_baselines = {}
         self._disable_lock = asyncio.Lock(loop=bot.loop)
+        # guild_id -> the highest raid mode the guild is being switched to right now.
+        self._escalating = {}
+        self._escalation_locks = defaultdict(lambda: asyncio.Lock(loop=bot.loop))
         # Keep a (guild_id, channel_id) -> List[str] mapping for messages.
         self.message_batches = defaultdict(list)
         self._batch_message_lock = asyncio.Lock(loop=bot.loop)
         self.bulk_send_messages.start()
+        self.relax_raid_mode.start()
+        self.save_baselines.start()
+
+    def cog_unload(self):
+        self.bulk_send_messages.cancel()
+        self.relax_raid_mode.cancel()
+        self.save_baselines.cancel()
+        self.bot.loop.create_task(self.write_baselines())
 
     async def cog_check(self, ctx):
         return bool(ctx.guild)
 
     @cache()
     async def get_raid_config(self, guild_id):
-        query = """SELECT * FROM guild_raid_config WHERE id = $1"""
-        async with self.bot.pool.acquire() as con:
-            record = await con.fetchrow(query, guild_id)
-            return record and await RaidConfig.from_record(record, self.bot)
+        record = await GuildRaidConfig.get_config.fetchrow(guild_id)
+        return record and await RaidConfig.from_record(record, self.bot)
 
     @tasks.loop(seconds=10.0)
     async def bulk_send_messages(self):
         async with self._batch_message_lock:
+            if not self.bot.leader.is_leader:
+                # The leader saw the same events and sends these.
+                self.message_batches.clear()
+                return
+
             for (guild_id, channel_id), messages in self.message_batches.items():
                 guild = self.bot.get_guild(guild_id)
                 channel = guild and guild.get_channel(channel_id)
@@ -160,6 +229,89 @@ class RaidControl(Cog):
 
             self.message_batches.clear()
 
+    async def write_baselines(self):
+        dirty = [(key, baseline) for key, baseline in self._channel_baselines.items() if baseline.dirty]
+        if not dirty:
+            return
+
+        query = """INSERT INTO channel_baselines (guild_id, channel_id, rate_mean, rate_var, authors_mean, authors_var,
+                                                samples)
+                   SELECT * FROM unnest($1::bigint[], $2::bigint[], $3::double precision[], $4::double precision[],
+                                        $5::double precision[], $6::double precision[], $7::bigint[])
+                   ON CONFLICT (channel_id) DO UPDATE
+                   SET rate_mean = EXCLUDED.rate_mean,
+                       rate_var = EXCLUDED.rate_var,
+                       authors_mean = EXCLUDED.authors_mean,
+                       authors_var = EXCLUDED.authors_var,
+                       samples = EXCLUDED.samples;
+                """
+
+        await self.bot.pool.execute(query, *zip(*((*key, *baseline.state) for key, baseline in dirty)))
+        for _, baseline in dirty:
+            baseline.dirty = False
+
+    @tasks.loop(minutes=5.0)
+    async def save_baselines(self):
+        await self.write_baselines()
+
+    @save_baselines.before_loop
+    async def load_baselines(self):
+        await self.bot.wait_until_ready()
+        query = """SELECT guild_id, channel_id, rate_mean, rate_var, authors_mean, authors_var, samples
+                   FROM channel_baselines;
+                """
+
+        for guild_id, channel_id, *state in await self.bot.pool.fetch(query):
+            baseline = self._channel_baselines.get((guild_id, channel_id))
+            if baseline is None:
+                self._channel_baselines[(guild_id, channel_id)] = ChannelBaseline(state=state)
+            elif baseline.samples < state[-1]:
+                # Messages came in before loading finished, the saved baseline knows more.
+                baseline.restore(state)
+
+    async def check_message_rate(self, config, message):
+        key = (config.id, message.channel.id)
+        try:
+            baseline = self._channel_baselines[key]
+        except KeyError:
+            baseline = self._channel_baselines[key] = ChannelBaseline()
+
+        now = message.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        spike = baseline.add(now, message.author.id)
+        if spike is None:
+            return
+
+        if baseline.last_alert is not None and now - baseline.last_alert < ALERT_COOLDOWN:
+            return
+        baseline.last_alert = now
+
+        channel = message.channel
+        e = discord.Embed(title="Unusual Message Rate", colour=0xdda453)
+        e.description = (f"{spike.messages} messages from about {spike.authors:.0f} members in {channel.mention}"
+                         f" within {baseline.interval:.0f}s.\n"
+                         f"Usually {spike.rate_mean:.1f} messages from {spike.authors_mean:.1f} members "
+                         f"(z-scores {spike.rate_z:.1f} and {spike.authors_z:.1f}).")
+        e.timestamp = datetime.datetime.utcnow()
+
+        slowmode = config.alert_slowmode
+        if slowmode and channel.slowmode_delay < slowmode:
+            try:
+                await channel.edit(slowmode_delay=slowmode, reason="Unusual message rate")
+            except discord.HTTPException:
+                e.add_field(name="Slowmode", value="Could not set slowmode.")
+            else:
+                e.add_field(name="Slowmode", value=f"Set to {slowmode}s, remember to turn it off again.")
+
+        self.logger.info(f"[Raid Mode] Unusual message rate in #{channel} ({message.guild}): "
+                         f"{spike.messages} messages, z-score {max(spike.rate_z, spike.authors_z):.1f}.")
+
+        alert_channel = config.alert_channel
+        if alert_channel is not None:
+            try:
+                await alert_channel.send(embed=e)
+            except discord.HTTPException:
+                pass
+
     async def check_raid(self, config, guild_id, member, message):
         if config.raid_mode != RaidMode.strict.value:
             return
@@ -168,9 +320,14 @@ class RaidControl(Cog):
         if not checker.is_spamming(message):
             return
 
-        try:
-            await member.ban(reason="Auto-ban from spam (strict raid mode ban)")
-        except discord.HTTPException:
+        # Banned in the background, the next message shouldn't have to wait for it.
+        ban = Ban(member.guild, member, reason="Auto-ban from spam (strict raid mode ban)")
+        if ban not in self.bot.moderation:
+            self.bot.loop.create_task(self.strict_ban(ban))
+
+    async def strict_ban(self, ban):
+        member = ban.user
+        if await self.bot.moderation.run(ban) is not None:
             self.logger.info(
                 f"[Raid Mode] Failed to ban {member} (ID: {member.id}) "
                 f"from server {member.guild} via strict mode.")
@@ -197,6 +354,9 @@ class RaidControl(Cog):
         if (config := await self.get_raid_config(guild_id)) is None:
             return
 
+        if config.alert_channel_id is not None:
+            await self.check_message_rate(config, message)
+
         if not config.raid_mode:
             return
 
@@ -216,22 +376,152 @@ class RaidControl(Cog):
         if message.channel.id in config.safe_mention_channel_ids:
             return
 
-        try:
-            await author.ban(reason=f"Spamming mentions ({mention_count} mentions)")
-        except Exception:
+        ban = Ban(message.guild, author, reason=f"Spamming mentions ({mention_count} mentions)")
+        if ban not in self.bot.moderation:
+            self.bot.loop.create_task(self.mention_ban(ban, message.channel, mention_count))
+
+    async def mention_ban(self, ban, channel, mention_count):
+        author, guild_id = ban.user, ban.guild_id
+        if await self.bot.moderation.run(ban) is not None:
             self.logger.info(f"Failed to autoban member {author} (ID: {author.id}) in guild ID {guild_id}")
         else:
             to_send = f"Banned {author} (ID: {author.id}) for spamming {mention_count} mentions."
             async with self._batch_message_lock:
-                self.message_batches[(guild_id, message.channel.id)].append(to_send)
+                self.message_batches[(guild_id, channel.id)].append(to_send)
             self.logger.info(f"Member {author} (ID: {author.id}) has been autobanned from guild ID {guild_id}")
 
+    async def escalate_raid_mode(self, config, mode, summary):
+        guild = self.bot.get_guild(config.id)
+        try:
+            await guild.edit(verification_level=discord.VerificationLevel.double_table_flip)
+        except discord.HTTPException:
+            pass
+
+        query = """UPDATE guild_raid_config
+                   SET raid_mode = $2, broadcast_channel = auto_channel, auto_escalated = TRUE
+                   WHERE id = $1;
+                """
+
+        await self.bot.pool.execute(query, guild.id, mode.value)
+        self.get_raid_config.invalidate(self, guild.id)
+        self.logger.info(f"[Raid Mode] Switched {guild} (ID: {guild.id}) to {mode} raid mode, "
+                         f"score {summary.score:.2f}.")
+
+        window = self._join_analyzers[guild.id].window
+        e = discord.Embed(title=f"Unusual Joins: Switched to {mode} raid mode", colour=0xdd5f53)
+        e.description = (f"{summary.joins} members joined within the last {window:.0f}s, "
+                         f"{summary.velocity:.1f}x as fast as usual.\n"
+                         f"New accounts: {summary.new_accounts:.0%}\n"
+                         f"Without avatar: {summary.no_avatar:.0%}\n"
+                         f"Similar names: {summary.similar_names:.0%}\n\n"
+                         f"Raid mode is switched off again after {QUIET_PERIOD.total_seconds() / 60:.0f} minutes"
+                         f" without unusual joins, or use `raid off`.")
+        e.set_footer(text=f"Score: {summary.score:.2f}").timestamp = datetime.datetime.utcnow()
+
+        channel = config.auto_channel
+        if channel is not None:
+            try:
+                await channel.send(embed=e)
+            except discord.HTTPException:
+                pass
+
+    @tasks.loop(minutes=1.0)
+    async def relax_raid_mode(self):
+        if not self.bot.leader.is_leader:
+            return
+
+        query = "SELECT id FROM guild_raid_config WHERE auto_escalated AND raid_mode <> $1;"
+        records = await self.bot.pool.fetch(query, RaidMode.off.value)
+
+        now = time.time()
+        for guild_id, in records:
+            analyzer = self._join_analyzers[guild_id]
+            quiet_for = analyzer.quiet_for(now)
+            if quiet_for is None:
+                # Nothing is known from before a restart, so the quiet period starts over.
+                analyzer.last_alarm = now
+                continue
+
+            if quiet_for < QUIET_PERIOD.total_seconds():
+                continue
+
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+
+            try:
+                await guild.edit(verification_level=discord.VerificationLevel.low)
+            except discord.HTTPException:
+                pass
+
+            config = await self.get_raid_config(guild_id)
+            channel = config.auto_channel
+            async with self._disable_lock:
+                await self.disable_raid_mode(guild_id)
+            self.logger.info(f"[Raid Mode] Switched off automatic raid mode in {guild} (ID: {guild_id}).")
+
+            if channel is not None:
+                try:
+                    await channel.send("Joins are back to normal, switched raid mode off.")
+                except discord.HTTPException:
+                    pass
+
+    @relax_raid_mode.before_loop
+    async def before_relax_raid_mode(self):
+        await self.bot.wait_until_ready()
+
+    async def analyze_join(self, config, member):
+        if not (config.raid_mode or config.auto_raid_mode):
+            return config
+
+        created_at = member.created_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+        summary = self._join_analyzers[config.id].add(time.time(), created_at=created_at, name=member.name,
+                                                      has_avatar=member.avatar is not None)
+        if not config.auto_raid_mode:
+            return config
+
+        limit = config.auto_raid_mode
+        if limit == RaidMode.strict.value:
+            perms = member.guild.me.guild_permissions
+            if not (perms.kick_members and perms.ban_members):
+                limit = RaidMode.on.value
+
+        if summary.score >= STRICT_SCORE:
+            mode = RaidMode(min(RaidMode.strict.value, limit))
+        elif summary.score >= 1.0:
+            mode = RaidMode(min(RaidMode.on.value, limit))
+        else:
+            return config
+
+        if mode.value <= (config.raid_mode or 0):
+            return config
+
+        # Joins coming in while this one escalates still see the old config, they'd escalate again.
+        # Marked before the first await so they skip it, unless they'd go even higher.
+        guild_id = config.id
+        if mode.value <= self._escalating.get(guild_id, 0):
+            return config
+
+        self._escalating[guild_id] = mode.value
+        try:
+            async with self._escalation_locks[guild_id]:
+                # The config might be from before another join's escalation finished.
+                config = await self.get_raid_config(guild_id)
+                if mode.value > (config.raid_mode or 0):
+                    await self.escalate_raid_mode(config, mode, summary)
+        finally:
+            if self._escalating.get(guild_id) == mode.value:
+                del self._escalating[guild_id]
+        return await self.get_raid_config(guild_id)
+
+    @Cog.listener()
     async def on_member_join(self, member):
         guild_id = member.guild.id
         config = await self.get_raid_config(guild_id)
         if config is None:
             return
 
+        config = await self.analyze_join(config, member)
         if not config.raid_mode:
             return
 
@@ -278,14 +568,18 @@ class RaidControl(Cog):
         mode information.
         """
 
-        query = "SELECT raid_mode, broadcast_channel FROM guild_raid_config WHERE id = $1"
+        query = """SELECT raid_mode, broadcast_channel, auto_raid_mode, auto_escalated
+                   FROM guild_raid_config WHERE id = $1
+                """
         row = await ctx.db.fetchrow(query, ctx.guild.id)
         if row is None:
-            fmt = "Raid Mode: off\nBroadcast Channel: None"
+            fmt = "Raid Mode: off\nBroadcast Channel: None\nAutomatic Raid Mode: off"
         else:
             ch = f"<#{row[1]}>" if row[1] else None
             mode = RaidMode(row[0]) if row[0] is not None else RaidMode.off
-            fmt = f"Raid Mode: {mode}\nBroadcast Channel: {ch}"
+            auto_mode = RaidMode(row[2]) if row[2] is not None else RaidMode.off
+            automatic = " (switched on automatically)" if row[3] else ""
+            fmt = f"Raid Mode: {mode}{automatic}\nBroadcast Channel: {ch}\nAutomatic Raid Mode: up to {auto_mode}"
 
         await ctx.send(fmt)
 
@@ -327,6 +621,72 @@ class RaidControl(Cog):
 
         await self.enable_raid_mode(ctx, channel, RaidMode.strict)
 
+    @raid.command(name="auto")
+    @is_mod()
+    async def raid_auto(self, ctx, mode: str, *, channel: discord.TextChannel = None):
+        """Switches raid mode on by itself when members join unusually fast.
+        The mode is the highest raid mode that is switched to, either `on`,
+        `strict` or `off` to disable this. Raid mode is switched off again
+        once joins have been back to normal for a while.
+        A summary of the joins is posted in the given channel, or this one.
+        """
+        try:
+            mode = RaidMode[mode.lower()]
+        except KeyError:
+            return await ctx.send("The mode has to be either `on`, `strict` or `off`.")
+
+        channel = channel or ctx.channel
+        query = """INSERT INTO guild_raid_config (id, auto_raid_mode, auto_channel)
+                   VALUES ($1, $2, $3) ON CONFLICT (id)
+                   DO UPDATE SET
+                        auto_raid_mode = EXCLUDED.auto_raid_mode,
+                        auto_channel = EXCLUDED.auto_channel;
+                """
+
+        auto_mode = mode.value if mode is not RaidMode.off else None
+        await ctx.db.execute(query, ctx.guild.id, auto_mode, channel.id)
+        self.get_raid_config.invalidate(self, ctx.guild.id)
+
+        if auto_mode is None:
+            return await ctx.send("No longer switching raid mode on automatically.")
+        await ctx.send(f"Switching to {mode} raid mode automatically when members join unusually fast. "
+                       f"Broadcasting to {channel.mention}.")
+
+    @raid.group(name="alerts", invoke_without_command=True)
+    @is_mod()
+    async def raid_alerts(self, ctx, channel: Optional[discord.TextChannel] = None, slowmode: int = None):
+        """Reports channels with unusually many messages or authors.
+        What's unusual is learned per channel, so it takes a couple
+        of hours after enabling this until anything is reported.
+        Optionally, slowmode is set in those channels for the given amount of seconds.
+        Reports are sent to the given channel, or this one.
+        """
+        if slowmode is not None and not 0 < slowmode <= 21600:
+            return await ctx.send("Slowmode has to be between 1 and 21600 seconds.")
+
+        channel = channel or ctx.channel
+        query = """INSERT INTO guild_raid_config (id, alert_channel, alert_slowmode)
+                   VALUES ($1, $2, $3) ON CONFLICT (id)
+                   DO UPDATE SET
+                        alert_channel = EXCLUDED.alert_channel,
+                        alert_slowmode = EXCLUDED.alert_slowmode;
+                """
+
+        await ctx.db.execute(query, ctx.guild.id, channel.id, slowmode)
+        self.get_raid_config.invalidate(self, ctx.guild.id)
+
+        fmt = f" and setting slowmode to {slowmode}s" if slowmode else ""
+        await ctx.send(f"Reporting unusual message rates to {channel.mention}{fmt}.")
+
+    @raid_alerts.command(name="off", aliases=["disable"])
+    @is_mod()
+    async def raid_alerts_off(self, ctx):
+        """Stops reporting unusual message rates."""
+        query = "UPDATE guild_raid_config SET alert_channel = NULL, alert_slowmode = NULL WHERE id = $1"
+        await ctx.db.execute(query, ctx.guild.id)
+        self.get_raid_config.invalidate(self, ctx.guild.id)
+        await ctx.send("No longer reporting unusual message rates.")
+
     async def enable_raid_mode(self, ctx, channel, mode: RaidMode):
         try:
             await ctx.guild.edit(verification_level=discord.VerificationLevel.double_table_flip)
@@ -337,7 +697,8 @@ class RaidControl(Cog):
                        VALUES ($1, $2, $3) ON CONFLICT (id)
                        DO UPDATE SET
                             raid_mode = EXCLUDED.raid_mode,
-                            broadcast_channel = EXCLUDED.broadcast_channel;
+                            broadcast_channel = EXCLUDED.broadcast_channel,
+                            auto_escalated = FALSE;
                     """
 
         await ctx.db.execute(query, ctx.guild.id, mode.value, channel.id)
@@ -349,7 +710,8 @@ class RaidControl(Cog):
                    VALUES ($1, $2, NULL) ON CONFLICT (id)
                    DO UPDATE SET
                         raid_mode = EXCLUDED.raid_mode,
-                        broadcast_channel = NULL;
+                        broadcast_channel = NULL,
+                        auto_escalated = FALSE;
                 """
 
         await self.bot.pool.execute(query, guild_id, RaidMode.off.value)
@@ -1,13 +1,33 @@
 import asyncio
 import datetime
+import heapq
 
 import asyncpg
 import discord
 from discord.ext import commands
 
 from cogs.utils import db, time, Plural
+from cogs.utils.leader import lock_key
 from cogs.utils.meta_cog import Cog
 
+# Tells every process about created and deleted timers, so they can wake up for timers they didn't create.
+# Payloads are "insert <id> <expires as a UTC timestamp>" or "delete <id>".
+NOTIFY_TRIGGER = """
+CREATE OR REPLACE FUNCTION reminders_notify() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('reminders', 'delete ' || OLD.id);
+        RETURN OLD;
+    END IF;
+    PERFORM pg_notify('reminders', 'insert ' || NEW.id || ' ' || extract(epoch FROM NEW.expires));
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+DROP TRIGGER IF EXISTS reminders_notify ON reminders;
+CREATE TRIGGER reminders_notify AFTER INSERT OR DELETE OR UPDATE OF expires ON reminders
+FOR EACH ROW EXECUTE PROCEDURE reminders_notify();
+"""
+
 
 class Reminders(db.Table):
     id = db.PrimaryKeyColumn()
@@ -16,6 +36,46 @@ class Reminders(db.Table):
     created = db.Column(db.Datetime, default="now() at time zone 'utc'")
     event = db.Column(db.String)
     extra = db.Column(db.JSON, default="'{}'::jsonb")
+    # Who and what the timer is about, if anyone. Older timers only had these in extra.
+    guild_id = db.Column(db.Integer(big=True),
+                         backfill="CASE WHEN event IN ('punish', 'tempblock') THEN (extra #>> '{args,0}')::bigint END")
+    author_id = db.Column(db.Integer(big=True),
+                          backfill="CASE event WHEN 'reminder' THEN (extra #>> '{args,0}')::bigint"
+                                   " WHEN 'punish' THEN (extra #>> '{args,1}')::bigint"
+                                   " WHEN 'tempblock' THEN (extra #>> '{args,1}')::bigint END")
+    target_id = db.Column(db.Integer(big=True),
+                          backfill="CASE event WHEN 'punish' THEN (extra #>> '{args,2}')::bigint"
+                                   " WHEN 'tempblock' THEN (extra #>> '{args,3}')::bigint END")
+
+    # Punishment lookups by member.
+    punished_member = db.Index('guild_id', 'target_id', where="event = 'punish'")
+    # Reminder lookups by author.
+    author_reminders = db.Index('author_id', 'expires', where="event = 'reminder'")
+
+    upcoming_timers = db.Statement("SELECT * FROM reminders WHERE expires < $1 ORDER BY expires LIMIT $2;")
+    next_expiry = db.Statement("SELECT min(expires) FROM reminders WHERE expires >= $1;")
+
+    @classmethod
+    def create_table(cls, *, exists_ok=True):
+        statement = super().create_table(exists_ok=exists_ok)
+        return statement + '\n' + NOTIFY_TRIGGER
+
+    @classmethod
+    async def ensure_notify_trigger(cls, *, connection=None):
+        """Creates the notification trigger in databases which were set up before it existed."""
+        async with db.MaybeAcquire(connection, pool=cls._pool) as con:
+            async with con.transaction():
+                # Several processes starting at once would trip over each other.
+                await con.execute('SELECT pg_advisory_xact_lock($1);', lock_key('reminders_notify'))
+                query = "SELECT 1 FROM pg_trigger WHERE tgname = 'reminders_notify';"
+                if await con.fetchval(query) is None:
+                    await con.execute(NOTIFY_TRIGGER)
+
+
+# Timers expiring within this long are kept in memory.
+LOOKAHEAD = datetime.timedelta(hours=1)
+# How many timers are loaded at once at most.
+BATCH_SIZE = 500
 
 
 class Timer:
@@ -64,12 +124,18 @@ class Reminder(Cog):
 
     def __init__(self, bot):
         super().__init__(bot)
-        self._have_data = asyncio.Event(loop=bot.loop)
-        self._current_timer = None
+        self._wakeup = asyncio.Event(loop=bot.loop)
+        # Every timer expiring before _loaded_until is in here, as (expires, id) in a heap and by ID.
+        # Timers removed from _timers, or whose expiry changed, are left in the heap until they come up.
+        self._heap = []
+        self._timers = {}
+        self._loaded_until = None
         self._task = bot.loop.create_task(self.dispatch_timers())
+        bot.loop.create_task(self.listen_for_timers())
 
     def cog_unload(self):
         self._task.cancel()
+        self.bot.loop.create_task(self.bot.notifications.unlisten('reminders', self.on_timer_notification))
 
     async def cog_check(self, ctx):
         if ctx.guild is None:
@@ -77,50 +143,138 @@ class Reminder(Cog):
 
         return True
 
-    async def get_active_timer(self, *, connection=None, days=7):
-        query = "SELECT * FROM reminders WHERE expires < (CURRENT_DATE + $1::interval) ORDER BY expires LIMIT 1;"
-        con = connection or self.bot.pool
+    def _push_timer(self, timer):
+        self._timers[timer.id] = timer
+        heapq.heappush(self._heap, (timer.expires, timer.id))
+
+    def discard_timer(self, timer_id):
+        """Forgets about a timer which was deleted from the database."""
+        self._timers.pop(timer_id, None)
+
+    async def load_timers(self, now):
+        # Notifications coming in while loading lower this again, the query might not see their timers.
+        self._loaded_until = datetime.datetime.max
+        until = now + LOOKAHEAD
+        records = await Reminders.upcoming_timers.fetch(until, BATCH_SIZE)
+        if len(records) == BATCH_SIZE:
+            # There are probably more, they're loaded once these are done.
+            until = records[-1]['expires']
+        else:
+            # Nothing else expires before the next timer, so that's when to load again.
+            # Timers created in the meantime are announced by notifications.
+            until = await Reminders.next_expiry.fetchval(until) or datetime.datetime.max
 
-        record = await con.fetchrow(query, datetime.timedelta(days=days))
-        return Timer(record=record) if record else None
+        for record in records:
+            timer = self._timers.get(record['id'])
+            if timer is None or timer.expires != record['expires']:
+                self._push_timer(Timer(record=record))
+        self._loaded_until = min(until, self._loaded_until)
 
-    async def wait_for_active_timers(self, *, connection=None, days=7):
-        async with db.MaybeAcquire(connection=connection, pool=self.bot.pool) as con:
-            timer = await self.get_active_timer(connection=con, days=days)
-            if timer is not None:
-                self._have_data.set()
-                return timer
+    async def listen_for_timers(self):
+        try:
+            await Reminders.ensure_notify_trigger()
+        except asyncpg.PostgresError as e:
+            self.logger.warning(f'Could not create the reminders trigger, timers from other processes'
+                                f' might fire late: {e}')
+        await self.bot.notifications.listen('reminders', self.on_timer_notification)
+
+    def on_timer_notification(self, payload):
+        if self._loaded_until is None:
+            # Not loaded yet, the first load picks it up.
+            return
 
-            self._have_data.clear()
-            self._current_timer = None
-            await self._have_data.wait()
-            return await self.get_active_timer(connection=con, days=days)
+        if payload is None:
+            # Notifications might have been missed, so load everything again.
+            self._loaded_until = datetime.datetime.min
+            self._wakeup.set()
+            return
 
-    async def call_timer(self, timer):
-        # Delete the timer
-        query = "DELETE FROM reminders WHERE id=$1;"
-        await self.bot.pool.execute(query, timer.id)
+        op, timer_id, *rest = payload.split()
+        timer_id = int(timer_id)
+        if op == 'delete':
+            self.discard_timer(timer_id)
+            return
 
-        # Dispatch it.
-        event_name = f'{timer.event}_timer_complete'
-        self.bot.dispatch(event_name, timer)
+        expires = datetime.datetime.utcfromtimestamp(float(rest[0]))
+        timer = self._timers.get(timer_id)
+        if timer is not None:
+            if abs((timer.expires - expires).total_seconds()) < 0.001:
+                # Created by us, or announced twice.
+                return
+            # Its expiry was changed.
+            self.discard_timer(timer_id)
+
+        if expires >= self._loaded_until:
+            # Loaded when its time comes.
+            return
+
+        # Rather than fetching it now, load it along with everything else once it expires.
+        self._loaded_until = expires
+        if not self._heap or expires < self._heap[0][0]:
+            # That's earlier than the current wait ends.
+            self._wakeup.set()
+
+    def _pop_expired(self, now):
+        heap = self._heap
+        expired = []
+        while heap and heap[0][0] <= now:
+            expires, timer_id = heapq.heappop(heap)
+            timer = self._timers.get(timer_id)
+            # Entries of timers whose expiry changed are left behind, the timer has another one.
+            if timer is not None and timer.expires == expires:
+                del self._timers[timer_id]
+                expired.append(timer)
+        return expired
+
+    async def call_timers(self, timers):
+        """Deletes the timers and dispatches those which weren't deleted already."""
+        for timer in timers:
+            self._timers.pop(timer.id, None)
+
+        # Every process loads the same timers, whichever claims a timer first dispatches it.
+        # The others skip the rows it has locked rather than waiting for them to be deleted.
+        query = """
+                DELETE FROM reminders
+                WHERE id IN (SELECT id FROM reminders WHERE id = ANY($1::int[]) FOR UPDATE SKIP LOCKED)
+                RETURNING id;
+                """
+        deleted = {record[0] for record in await self.bot.pool.fetch(query, [timer.id for timer in timers])}
+        for timer in timers:
+            if timer.id in deleted:
+                event_name = f'{timer.event}_timer_complete'
+                self.bot.dispatch(event_name, timer)
+
+    async def call_timer(self, timer):
+        await self.call_timers([timer])
 
     async def dispatch_timers(self):
         try:
             while not self.bot.is_closed():
-                # We're gonna cap this at 40 days.
-                # See: http://bugs.python.org/issue20493
-                timer = self._current_timer = await self.wait_for_active_timers(days=40)
                 now = datetime.datetime.utcnow()
-
-                if timer.expires >= now:
-                    to_sleep = (timer.expires - now).total_seconds()
-                    await asyncio.sleep(to_sleep)
-
-                await self.call_timer(timer)
+                if self._loaded_until is None or now >= self._loaded_until:
+                    await self.load_timers(now)
+
+                expired = self._pop_expired(now)
+                if expired:
+                    await self.call_timers(expired)
+                    continue
+
+                # Sleep until the next timer expires, the next batch is due
+                # or a timer is created which expires earlier.
+                wake_at = self._loaded_until
+                if self._heap:
+                    wake_at = min(wake_at, self._heap[0][0])
+
+                self._wakeup.clear()
+                timeout = None if wake_at == datetime.datetime.max else (wake_at - now).total_seconds()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
         except asyncio.CancelledError:
             pass
         except (OSError, discord.ConnectionClosed, asyncpg.PostgresConnectionError):
+            self._loaded_until = None
             self._task.cancel()
             self._task = self.bot.loop.create_task(self.dispatch_timers())
 
@@ -129,16 +283,13 @@ class Reminder(Cog):
         event_name = f'{timer.event}_timer_complete'
         self.bot.dispatch(event_name, timer)
 
-    async def create_timer(self, *args, **kwargs):
-        """Creates a timer."""
-
-        when, event, *args = args
-
-        try:
-            connection = kwargs.pop('connection')
-        except KeyError:
-            connection = self.bot.pool
+    async def create_timer(self, when, event, *args, guild_id=None, author_id=None, target_id=None, connection=None,
+                           **kwargs):
+        """Creates a timer.
+        ``guild_id``, ``author_id`` and ``target_id`` are stored in their own columns for lookups.
+        """
 
+        connection = connection or self.bot.pool
         now = datetime.datetime.utcnow()
         timer = Timer.temporary(event=event, args=args, kwargs=kwargs, expires=when, created=now)
         delta = (when - now).total_seconds()
@@ -147,23 +298,21 @@ class Reminder(Cog):
             self.bot.loop.create_task(self.short_timer_optimisation(delta, timer))
             return timer
 
-        query = """INSERT INTO reminders (event, extra, expires)
-                   VALUES ($1, $2::jsonb, $3)
+        query = """INSERT INTO reminders (event, extra, expires, guild_id, author_id, target_id)
+                   VALUES ($1, $2::jsonb, $3, $4, $5, $6)
                    RETURNING id;
                 """
 
-        row = await connection.fetchrow(query, event, {'args': args, 'kwargs': kwargs}, when)
+        row = await connection.fetchrow(query, event, {'args': args, 'kwargs': kwargs}, when, guild_id, author_id,
+                                        target_id)
         timer.id = row[0]
 
-        # See above (40 day cap)
-        if delta <= (86400 * 40):
-            self._have_data.set()
-
-        # Check if this timer is earlier than our currently run timer
-        if self._current_timer and when < self._current_timer.expires:
-            # Cancel the task and re-run it
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        # Later timers are loaded when their time comes.
+        if self._loaded_until is not None and when < self._loaded_until:
+            self._push_timer(timer)
+            if self._heap[0][1] == timer.id:
+                # It expires before anything else, so wake up earlier.
+                self._wakeup.set()
 
         return timer
 
@@ -180,8 +329,8 @@ class Reminder(Cog):
         Times are in UTC.
         """
 
-        await self.create_timer(when.dt, 'reminder', ctx.author.id, ctx.channel.id, when.arg, connection=ctx.db,
-                                message_id=ctx.message.id)
+        await self.create_timer(when.dt, 'reminder', ctx.author.id, ctx.channel.id, when.arg, guild_id=ctx.guild.id,
+                                author_id=ctx.author.id, connection=ctx.db, message_id=ctx.message.id)
 
         delta = time.human_timedelta(when.dt)
         await ctx.send(f"Alright {ctx.author.mention}, in {delta}: {when.arg}")
@@ -192,12 +341,12 @@ class Reminder(Cog):
         query = """SELECT expires, extra #>> '{args,2}', id
                    FROM reminders
                    WHERE event = 'reminder'
-                   AND extra #>> '{args,0}' = $1
+                   AND author_id = $1
                    ORDER BY expires
                    LIMIT 5;
                 """
 
-        records = await ctx.db.fetch(query, str(ctx.author.id))
+        records = await ctx.db.fetch(query, ctx.author.id)
 
         if not records:
             return await ctx.send(':x: No long-period timers are currently running')
@@ -237,17 +386,13 @@ class Reminder(Cog):
         query = """DELETE FROM reminders
                    WHERE id = $1
                    AND event = 'reminder'
-                   AND extra #>> '{args,0}' = $2
+                   AND author_id = $2
                 """
-        status = await ctx.db.execute(query, id, str(ctx.author.id))
+        status = await ctx.db.execute(query, id, ctx.author.id)
         if status == 'DELETE 0':
             return await ctx.send('Could not delete any reminders with that ID.')
 
-        # Check current reminders too.
-        if self._current_timer and self._current_timer.id == id:
-            # Cancel and re-run.
-            self._task.cancel()
-            self._task = self.bot.loop.create_task(self.dispatch_timers())
+        self.discard_timer(id)
         await ctx.send('Successfully deleted reminder.')
 
 
@@ -16,9 +16,11 @@ from discord.ext import commands
 
 from cogs.utils import db, Plural, human_timedelta, is_mod
 from cogs.utils.converters import FetchedUser, entry_id
+from cogs.utils.executor import Ban
 from cogs.utils.meta_cog import Cog
 from cogs.utils.paginators import CannotPaginate, Pages
 from cogs.utils.punishment import Punishment, ActionType
+from cogs.utils.writer import copy_returning
 
 
 class Arguments(argparse.ArgumentParser):
@@ -69,6 +71,9 @@ class RemovalsTable(db.Table, table_name='removals'):
     # Message id in the punishment channel.
     punish_message_id = db.Column(db.Integer(big=True))
 
+    # Used by the removal stats and paginators.
+    guild_created_at = db.Index('guild_id', 'created_at')
+
 
 class ActionReason(commands.Converter):
     async def convert(self, ctx, argument):
@@ -95,7 +100,9 @@ class RemovalPages(Pages):
                    FROM removals WHERE guild_id = $1
                    ORDER BY created_at DESC"""
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        async with ctx.replica() as con:
+            records = await con.fetch(query, ctx.guild.id)
+
         if not records:
             raise CannotPaginate("This server doesn't have any removals in its database yet.")
 
@@ -387,24 +394,34 @@ class Removals(Cog):
                 return await ctx.send("Please provide at least one valid user ID.")
 
             b_type = RemovalType.BAN
-            keys = ('user_id', 'moderator_id', 'guild_id', 'reason', 'name', 'type')
-            to_insert = ((m.id, mod.id, guild.id, reason, str(m), b_type.value) for m in actual_users)
-
-            query = """
-                    INSERT INTO removals(user_id, moderator_id, guild_id, reason, name, type)
-                    SELECT x.user_id, x.moderator_id, x.guild_id, x.reason, x.name, x.type
-                    FROM jsonb_to_recordset($1::jsonb)
-                    AS x(user_id BIGINT, moderator_id BIGINT, guild_id BIGINT,
-                         reason text, name text, type smallint)
-                    RETURNING user_id, id
-                    """
+            actual_users = list(actual_users)
+            columns = ('user_id', 'moderator_id', 'guild_id', 'reason', 'name', 'type')
+            # Mark them first, so our own ban events don't get logged a second time.
+            self.known_removals.update(user.id for user in actual_users)
+            bans = [Ban(guild, user, reason=reason) for user in actual_users]
+            job = self.bot.moderation.submit(bans, title=f"Cross-banning {Plural(len(bans)):user}", channel=ctx.channel)
+            results = await job.wait()
+
+            banned = [action.user for action, error in results if error is None]
+            failed = [(action.user, error) for action, error in results if error is not None]
+            for user, _ in failed:
+                self.known_removals.discard(user.id)
+
+            if failed:
+                lines = [f"{user} (`{user.id}`): {error or type(error).__name__}" for user, error in failed[:15]]
+                if len(failed) > 15:
+                    lines.append(f"...and {len(failed) - 15} more.")
+                await ctx.send(f"\N{CROSS MARK} Could not ban {Plural(len(failed)):user}:\n" + "\n".join(lines))
+
+            if not banned:
+                return
 
-            records = await ctx.db.fetch(query, [dict(zip(keys, elem)) for elem in to_insert])
-            users = {user_id: e_id for user_id, e_id in records}
-            for user in actual_users:
-                self.known_removals.add(user.id)
+            records = [(m.id, mod.id, guild.id, reason, str(m), b_type.value) for m in banned]
+            ids = await copy_returning(ctx.db, 'removals', columns, records)
+            users = {user.id: e_id for user, e_id in zip(banned, ids)}
+            modlog = await self.get_modlog(guild.id)
+            for user in banned:
                 # Dispatch to log channels.
-                modlog = await self.get_modlog(guild.id)
                 e_id = None
                 if modlog:
                     e_id = users[user.id]
@@ -415,10 +432,9 @@ class Removals(Cog):
 
                 punishment = Punishment(guild, user, mod, ActionType.BAN, reason, id=e_id)
                 self.bot.dispatch("punishment_add", punishment)
-                await guild.ban(user, reason=reason)
 
-            pages = Pages(ctx, entries=[f"{user} - (`{user.id}`)" for user in actual_users])
-            pages.embed.title = f"Cross-banned {Plural(len(actual_users)):user}"
+            pages = Pages(ctx, entries=[f"{user} - (`{user.id}`)" for user in banned])
+            pages.embed.title = f"Cross-banned {Plural(len(banned)):user}"
 
             try:
                 await pages.paginate()
@@ -526,52 +542,53 @@ class Removals(Cog):
         )
 
         embed = discord.Embed(title='Server Removal Stats', colour=discord.Colour.blurple())
-        # Total bans.
-        query = "SELECT COUNT(*), MIN(created_at) FROM removals WHERE guild_id=$1;"
-        count = await ctx.db.fetchrow(query, ctx.guild.id)
+        async with ctx.replica() as con:
+            # Total bans.
+            query = "SELECT COUNT(*), MIN(created_at) FROM removals WHERE guild_id=$1;"
+            count = await con.fetchrow(query, ctx.guild.id)
 
-        query = """SELECT COUNT(*)
-                   FROM removals
-                   WHERE guild_id = $1 AND created_at > (CURRENT_TIMESTAMP - INTERVAL '7 days')"""
+            query = """SELECT COUNT(*)
+                       FROM removals
+                       WHERE guild_id = $1 AND created_at > (CURRENT_TIMESTAMP - INTERVAL '7 days')"""
 
-        this_week = await ctx.db.fetchval(query, ctx.guild.id)
-        embed.description = f'{count[0]} ({this_week} this week) users removed.'
-        embed.set_footer(text='Tracking removals since').timestamp = count[1] or datetime.utcnow()
+            this_week = await con.fetchval(query, ctx.guild.id)
+            embed.description = f'{count[0]} ({this_week} this week) users removed.'
+            embed.set_footer(text='Tracking removals since').timestamp = count[1] or datetime.utcnow()
 
-        query = """
-                SELECT moderator_id, COUNT(*)
-                FROM removals
-                WHERE guild_id=$1
-                AND moderator_id IS NOT NULL 
-                AND type = ANY('{1, 2}')
-                GROUP BY moderator_id
-                ORDER BY 2 DESC
-                LIMIT 5;
-                """
+            query = """
+                    SELECT moderator_id, COUNT(*)
+                    FROM removals
+                    WHERE guild_id=$1
+                    AND moderator_id IS NOT NULL 
+                    AND type = ANY('{1, 2}')
+                    GROUP BY moderator_id
+                    ORDER BY 2 DESC
+                    LIMIT 5;
+                    """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
-        value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({Plural(bans):removal})'
-                          for (index, (author_id, bans)) in enumerate(records)) or 'No removals.'
+            records = await con.fetch(query, ctx.guild.id)
+            value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({Plural(bans):removal})'
+                              for (index, (author_id, bans)) in enumerate(records)) or 'No removals.'
 
-        embed.add_field(name='Top Mods (by removals)', value=value, inline=False)
+            embed.add_field(name='Top Mods (by removals)', value=value, inline=False)
 
-        query = """
-                SELECT moderator_id, COUNT(*)
-                FROM removals
-                WHERE guild_id=$1
-                AND created_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
-                AND moderator_id IS NOT NULL
-                GROUP BY moderator_id
-                ORDER BY 2 DESC
-                LIMIT 5
-                """
+            query = """
+                    SELECT moderator_id, COUNT(*)
+                    FROM removals
+                    WHERE guild_id=$1
+                    AND created_at > (CURRENT_TIMESTAMP - INTERVAL '1 day')
+                    AND moderator_id IS NOT NULL
+                    GROUP BY moderator_id
+                    ORDER BY 2 DESC
+                    LIMIT 5
+                    """
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+            records = await con.fetch(query, ctx.guild.id)
 
-        value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({Plural(bans):removal})'
-                          for (index, (author_id, bans)) in enumerate(records)) or 'No removals today'
+            value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({Plural(bans):removal})'
+                              for (index, (author_id, bans)) in enumerate(records)) or 'No removals today'
 
-        embed.add_field(name='Top Mods Today (by removals)', value=value, inline=False)
+            embed.add_field(name='Top Mods Today (by removals)', value=value, inline=False)
         await ctx.send(embed=embed)
 
     @staticmethod
@@ -584,40 +601,42 @@ class Removals(Cog):
             '\N{SPORTS MEDAL}'
         )
 
-        query = "SELECT COUNT(*), MIN(created_at) FROM removals WHERE moderator_id = $1 AND guild_id = $2"
-        mod_count = await ctx.db.fetchrow(query, member.id, ctx.guild.id)
+        async with ctx.replica() as con:
+            query = "SELECT COUNT(*), MIN(created_at) FROM removals WHERE moderator_id = $1 AND guild_id = $2"
+            mod_count = await con.fetchrow(query, member.id, ctx.guild.id)
 
-        query = """SELECT COUNT(*)
-                           FROM removals
-                           WHERE guild_id = $1 
-                           AND created_at > (CURRENT_TIMESTAMP - INTERVAL '7 days')
-                           AND moderator_id = $2"""
+            query = """SELECT COUNT(*)
+                               FROM removals
+                               WHERE guild_id = $1 
+                               AND created_at > (CURRENT_TIMESTAMP - INTERVAL '7 days')
+                               AND moderator_id = $2"""
 
-        this_week = await ctx.db.fetchval(query, ctx.guild.id, member.id)
+            this_week = await con.fetchval(query, ctx.guild.id, member.id)
 
-        embed = discord.Embed(title=f'Mod Removal Stats for {member}', colour=discord.Colour.blurple())
-        embed.description = f'{mod_count[0]} ({this_week} this week) users removed.'
-        embed.set_footer(text='First recorded removal').timestamp = mod_count[1] or datetime.utcnow()
+            embed = discord.Embed(title=f'Mod Removal Stats for {member}', colour=discord.Colour.blurple())
+            embed.description = f'{mod_count[0]} ({this_week} this week) users removed.'
+            embed.set_footer(text='First recorded removal').timestamp = mod_count[1] or datetime.utcnow()
 
-        query = """
-                SELECT CASE
-                WHEN LOWER(reason) LIKE 'no reason%' THEN 'No reason'
-                        ELSE LOWER(reason)
-                END AS res, COUNT(*)
-                FROM removals
-                WHERE moderator_id = $1 AND guild_id = $2 AND reason != 'None'
-                GROUP BY res ORDER BY 2 DESC
-                LIMIT 5
-                """
+            query = """
+                    SELECT CASE
+                    WHEN LOWER(reason) LIKE 'no reason%' THEN 'No reason'
+                            ELSE LOWER(reason)
+                    END AS res, COUNT(*)
+                    FROM removals
+                    WHERE moderator_id = $1 AND guild_id = $2 AND reason != 'None'
+                    GROUP BY res ORDER BY 2 DESC
+                    LIMIT 5
+                    """
+
+            records = await con.fetch(query, member.id, ctx.guild.id)
 
-        records = await ctx.db.fetch(query, member.id, ctx.guild.id)
+            value = '\n'.join(f'{lookup[index]}: {reason} ({Plural(uses):ban})'
+                              for (index, (reason, uses)) in enumerate(records)) or 'No reasons provided yet'
 
-        value = '\n'.join(f'{lookup[index]}: {reason} ({Plural(uses):ban})'
-                          for (index, (reason, uses)) in enumerate(records)) or 'No reasons provided yet'
+            embed.add_field(name="Common ban reasons", value=value, inline=False)
 
-        embed.add_field(name="Common ban reasons", value=value, inline=False)
+            total = await con.fetchval("SELECT COUNT(*) FROM removals WHERE guild_id = $1", ctx.guild.id)
 
-        total = await ctx.db.fetchval("SELECT COUNT(*) FROM removals WHERE guild_id = $1", ctx.guild.id)
         embed.add_field(name="Removal percentage", value=f'{(mod_count[0] / total) * 100:.2f}%')
         await ctx.send(embed=embed)
 
@@ -808,18 +827,14 @@ class Removals(Cog):
         if not confirm:
             return await ctx.send("Aborting.")
 
-        count = 0
         for member in members:
-            try:
-                # Queue them up.
-                self.removal_information[member.id] = _RemovalEntry(member, ctx.author, reason)
-                await ctx.guild.ban(member, reason=reason)
-            except discord.HTTPException:
-                pass
-            else:
-                count += 1
+            # Queue them up.
+            self.removal_information[member.id] = _RemovalEntry(member, ctx.author, reason)
 
-        await ctx.send(f"Banned {count}/{len(members)}")
+        # The job's status message shows how many got banned.
+        bans = [Ban(ctx.guild, member, reason=reason) for member in members]
+        job = self.bot.moderation.submit(bans, title=f"Banning {Plural(len(bans)):member}", channel=ctx.channel)
+        await job.wait()
 
 
 setup = Removals.setup
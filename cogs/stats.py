@@ -2,15 +2,17 @@ import asyncio
 import datetime
 import io
 import os
+import time
 from collections import Counter
-from typing import Union
+from pathlib import Path
+from typing import Optional, Union
 
 import asyncpg
 import discord
 import psutil
 from discord.ext import commands, tasks
 
-from cogs.utils import human_timedelta, db, Plural, is_maintainer
+from cogs.utils import human_timedelta, db, Plural, is_maintainer, TabularData, metrics, profiling
 from cogs.utils.converters import FetchedUser
 from cogs.utils.meta_cog import Cog
 
@@ -32,6 +34,12 @@ def by_name(arg):
     return func
 
 
+def slow_flag(arg):
+    if arg != '--slow':
+        raise commands.BadArgument('Not a flag.')
+    return True
+
+
 def task_at(pred):
     for o in asyncio.all_tasks():
         if pred(o):
@@ -39,7 +47,7 @@ def task_at(pred):
     return None
 
 
-class Commands(db.Table):
+class Commands(db.Table, partition_by='used'):
     id = db.PrimaryKeyColumn()
     # The guild id.
     guild_id = db.Column(db.Integer(big=True), index=True)
@@ -55,49 +63,150 @@ class Commands(db.Table):
     command = db.Column(db.String, index=True)
     # Whether the invocation succeeded.
     failed = db.Column(db.Boolean, index=True)
+    # Where the time went, in seconds: in total, waiting for a pool connection,
+    # running queries and calling Discord's API, rate limits included.
+    wall_time = db.Column(db.Double)
+    pool_wait = db.Column(db.Double)
+    db_time = db.Column(db.Double)
+    http_time = db.Column(db.Double)
+
+    # Used by the guild and member stats.
+    guild_used = db.Index('guild_id', 'used')
+    guild_author = db.Index('guild_id', 'author_id')
+
+
+class CommandRollups(db.Table, table_name='command_rollups'):
+    # Daily command usage per guild, kept up to date whenever command usage is written.
+    guild_id = db.Column(db.Integer(big=True), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    command = db.Column(db.String, nullable=False)
+    uses = db.Column(db.Integer(big=True), nullable=False, default=0)
+    # The first use within the day.
+    first_used = db.Column(db.Datetime)
+
+    key = db.Index('guild_id', 'day', 'command', unique=True)
+
+
+class AuthorRollups(db.Table, table_name='command_author_rollups'):
+    # Daily command usage per guild and author, broken down by command for the member stats.
+    guild_id = db.Column(db.Integer(big=True), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    author_id = db.Column(db.Integer(big=True), nullable=False)
+    command = db.Column(db.String, nullable=False)
+    uses = db.Column(db.Integer(big=True), nullable=False, default=0)
+    first_used = db.Column(db.Datetime)
+
+    key = db.Index('guild_id', 'author_id', 'day', 'command', unique=True)
+
+
+GATEWAY_EVENTS = metrics.counter('discord_gateway_events_total', 'Gateway events received.', ('type',))
+COMMANDS_USED = metrics.counter('bot_commands_total', 'Commands invoked.', ('command', 'failed'))
+
+# The order of the columns in the rows buffered for the commands table.
+COMMAND_COLUMNS = ('guild_id', 'channel_id', 'author_id', 'used', 'prefix', 'command', 'failed',
+                   'wall_time', 'pool_wait', 'db_time', 'http_time')
+GUILD, _, AUTHOR, USED, _, COMMAND, *_ = range(len(COMMAND_COLUMNS))
+
+
+def merge_top(records, pending, limit=5):
+    """Merges ``(key, uses)`` records with a Counter of uses that aren't in the database yet.
+    The records have to contain at least ``limit + len(pending)`` of the top entries.
+    """
+    totals = Counter(dict(records))
+    totals.update(pending)
+    return totals.most_common(limit)
+
+
+async def update_rollups(con, rows):
+    """Adds a batch of command usage rows to the rollup tables."""
+    commands_used = {}
+    authors = {}
+    for row in rows:
+        guild_id = row[GUILD]
+        if guild_id is None:
+            continue
+
+        used = row[USED]
+        for key, bucket in (((guild_id, used.date(), row[COMMAND]), commands_used),
+                            ((guild_id, used.date(), row[AUTHOR], row[COMMAND]), authors)):
+            uses, first_used = bucket.get(key, (0, used))
+            bucket[key] = (uses + 1, min(first_used, used))
+
+    if not commands_used:
+        return
+
+    query = """INSERT INTO command_rollups (guild_id, day, command, uses, first_used)
+               SELECT * FROM unnest($1::bigint[], $2::date[], $3::text[], $4::bigint[], $5::timestamp[])
+               ON CONFLICT (guild_id, day, command) DO UPDATE
+               SET uses = command_rollups.uses + EXCLUDED.uses,
+                   first_used = LEAST(command_rollups.first_used, EXCLUDED.first_used)
+            """
+
+    await con.execute(query, *zip(*((*key, *value) for key, value in commands_used.items())))
+
+    query = """INSERT INTO command_author_rollups (guild_id, day, author_id, command, uses, first_used)
+               SELECT * FROM unnest($1::bigint[], $2::date[], $3::bigint[], $4::text[], $5::bigint[],
+                                    $6::timestamp[])
+               ON CONFLICT (guild_id, author_id, day, command) DO UPDATE
+               SET uses = command_author_rollups.uses + EXCLUDED.uses,
+                   first_used = LEAST(command_author_rollups.first_used, EXCLUDED.first_used)
+            """
+
+    await con.execute(query, *zip(*((*key, *value) for key, value in authors.items())))
 
 
 class Stats(Cog):
 
     def __init__(self, bot):
         super().__init__(bot)
-        self._batch_lock = asyncio.Lock(loop=bot.loop)
-        self._data_batch = []
-        self.bulk_insert_loop.add_exception_type(asyncpg.PostgresConnectionError)
-        self.bulk_insert_loop.start()
+        # Command usage is spilled to disk while the database is down, so none of it gets lost.
+        bot.writer.register('commands', COMMAND_COLUMNS, interval=10.0, on_flush=update_rollups,
+                            spill=Path('spill') / 'commands.spill')
+        self.partition_loop.start()
         self.command_stats = Counter()
         self.socket_stats = Counter()
         self.process = psutil.Process()
+        metrics.registry.register_collector('process', self.collect_metrics)
 
     async def cog_check(self, ctx):
         return bool(ctx.guild)
 
-    async def bulk_insert(self):
-        query = """INSERT INTO commands (guild_id, channel_id, author_id, used, prefix, command, failed)
-                   SELECT x.guild, x.channel, x.author, x.used, x.prefix, x.command, x.failed
-                   FROM jsonb_to_recordset($1::jsonb) AS
-                   x(guild BIGINT, channel BIGINT, author BIGINT, used TIMESTAMP, prefix TEXT, command TEXT,
-                    failed BOOLEAN)
-                """
+    def collect_metrics(self):
+        with self.process.oneshot():
+            memory = self.process.memory_full_info()
+            cpu = self.process.cpu_times()
+            threads = self.process.num_threads()
 
-        if self._data_batch:
-            await self.bot.pool.execute(query, self._data_batch)
-            total = len(self._data_batch)
-            if total > 1:
-                self.logger.info(f'Registered {len(self._data_batch)} commands to the database.')
-            self._data_batch.clear()
+        yield 'process_resident_memory_bytes', 'gauge', 'Resident memory size.', [({}, memory.rss)]
+        yield 'process_unique_memory_bytes', 'gauge', 'Memory unique to the process.', [({}, memory.uss)]
+        yield 'process_cpu_seconds_total', 'counter', 'User and system CPU time.', [({}, cpu.user + cpu.system)]
+        yield 'process_threads', 'gauge', 'Threads of the process.', [({}, threads)]
 
     def cog_unload(self):
-        self.bulk_insert_loop.stop()
+        metrics.registry.unregister_collector('process')
+        self.partition_loop.cancel()
+        self.bot.loop.create_task(self.bot.writer.flush('commands'))
+
+    @tasks.loop(hours=24.0)
+    async def partition_loop(self):
+        # Keep a couple of months worth of partitions around, so commands never end up in the default one.
+        try:
+            created = await Commands.ensure_partitions()
+        except asyncpg.PostgresError as e:
+            self.logger.warning(f'Could not create partitions for commands, run `db partitions convert`: {e}')
+        else:
+            if created:
+                self.logger.info(f'Created partitions {", ".join(created)}.')
 
-    @tasks.loop(seconds=10.0)
-    async def bulk_insert_loop(self):
-        async with self._batch_lock:
-            await self.bulk_insert()
+    @partition_loop.before_loop
+    async def before_partition_loop(self):
+        # Creating the same partitions from several processes at once would fail in all but one of them.
+        await self.bot.leader.wait()
 
     async def register_command(self, ctx):
         command = ctx.command.qualified_name
         self.command_stats[command] += 1
+        COMMANDS_USED.labels(command, str(ctx.command_failed).lower()).inc()
         message = ctx.message
 
         if ctx.guild is None:
@@ -109,16 +218,10 @@ class Stats(Cog):
 
         self.logger.info(f'{message.created_at}: {message.author} in {destination}: {message.content}')
 
-        async with self._batch_lock:
-            self._data_batch.append({
-                'guild': guild_id,
-                'channel': ctx.channel.id,
-                'author': ctx.author.id,
-                'used': message.created_at.isoformat(),
-                'prefix': ctx.prefix,
-                'command': command,
-                'failed': ctx.command_failed
-            })
+        wall_time = time.perf_counter() - ctx.started
+        row = (guild_id, ctx.channel.id, ctx.author.id, message.created_at, ctx.prefix, command, ctx.command_failed,
+               wall_time, ctx.pool_wait, ctx.db_time, ctx.http_time)
+        await self.bot.writer.put('commands', row)
 
     @Cog.listener()
     async def on_command_completion(self, ctx):
@@ -127,14 +230,21 @@ class Stats(Cog):
     @Cog.listener()
     async def on_socket_response(self, msg):
         self.socket_stats[msg.get('t')] += 1
+        GATEWAY_EVENTS.labels(msg.get('t') or 'NONE').inc()
 
     @commands.command(hidden=True)
     @is_maintainer()
-    async def commandstats(self, ctx, limit=20):
+    async def commandstats(self, ctx, slow: Optional[slow_flag] = False, limit=20, days=7):
         """Shows command stats.
         Use a negative number for bottom instead of top.
         This is only for the current session.
+
+        With `--slow`, commands are ranked by their p95 latency
+        over the last few days instead, e.g. `commandstats --slow 10 30`.
         """
+        if slow:
+            return await self.show_slow_commands(ctx, limit, days)
+
         counter = self.command_stats
         width = len(max(counter, key=len))
 
@@ -147,6 +257,187 @@ class Stats(Cog):
 
         await ctx.send(f'```\n{output}\n```')
 
+    async def show_slow_commands(self, ctx, limit, days):
+        query = """SELECT command,
+                          COUNT(*) AS uses,
+                          percentile_cont(0.5) WITHIN GROUP (ORDER BY wall_time) AS p50,
+                          percentile_cont(0.95) WITHIN GROUP (ORDER BY wall_time) AS p95,
+                          AVG(pool_wait) AS pool_wait,
+                          AVG(db_time) AS db_time,
+                          AVG(http_time) AS http_time
+                   FROM commands
+                   WHERE used > (CURRENT_TIMESTAMP AT TIME ZONE 'UTC') - $1::interval
+                   AND wall_time IS NOT NULL
+                   GROUP BY command
+                   ORDER BY p95 DESC
+                   LIMIT $2;
+                """
+
+        async with ctx.replica() as con:
+            records = await con.fetch(query, datetime.timedelta(days=days), abs(limit))
+
+        if not records:
+            return await ctx.send(f'No command timings recorded in the last {Plural(days):day}.')
+
+        table = TabularData()
+        table.set_columns(['Command', 'Uses', 'p50 (ms)', 'p95 (ms)', 'Avg Pool (ms)', 'Avg DB (ms)', 'Avg HTTP (ms)'])
+        table.add_rows((r['command'], r['uses'], f'{r["p50"] * 1000:.0f}', f'{r["p95"] * 1000:.0f}',
+                        f'{r["pool_wait"] * 1000:.0f}', f'{r["db_time"] * 1000:.0f}', f'{r["http_time"] * 1000:.0f}')
+                       for r in records)
+
+        render = table.render()
+        fmt = f'```\n{render}\n```'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(render.encode('utf-8'))
+            return await ctx.send('Too many results...', file=discord.File(fp, 'slowcommands.txt'))
+
+        await ctx.send(fmt)
+
+    @commands.command(hidden=True)
+    @is_maintainer()
+    async def statementstats(self, ctx):
+        """Shows call counts and timings of the prepared statements.
+        This is only for the current session.
+        """
+        statements = sorted(db.Table.statements(), key=lambda s: s.total_time, reverse=True)
+        if not statements:
+            return await ctx.send('No statements registered.')
+
+        table = TabularData()
+        table.set_columns(['Statement', 'Calls', 'Total (ms)', 'Avg (ms)', 'Max (ms)'])
+        table.add_rows((s.name, s.calls, f'{s.total_time * 1000:.2f}', f'{s.average_time * 1000:.2f}',
+                        f'{s.max_time * 1000:.2f}') for s in statements)
+
+        await ctx.send(f'```\n{table.render()}\n```')
+
+    @commands.command(hidden=True)
+    @is_maintainer()
+    async def querystats(self, ctx, sort='total', limit=10):
+        """Shows the slowest queries of the current session.
+        Sort by either `total` time, `calls` or `p99`.
+        """
+        keys = {
+            'total': lambda q: q.total_time,
+            'calls': lambda q: q.calls,
+            'p99': lambda q: q.percentile(99)
+        }
+
+        try:
+            key = keys[sort]
+        except KeyError:
+            return await ctx.send(f'Can only sort by {", ".join(keys)}.')
+
+        stats = sorted(db.query_stats(), key=key, reverse=True)[:limit]
+        if not stats:
+            return await ctx.send('No queries recorded yet.')
+
+        def shorten(query, width=60):
+            return query if len(query) <= width else query[:width - 3] + '...'
+
+        table = TabularData()
+        table.set_columns(['Query', 'Calls', 'Total (ms)', 'p50 (ms)', 'p99 (ms)', 'Max (ms)'])
+        table.add_rows((shorten(q.query), q.calls, f'{q.total_time * 1000:.2f}', f'{q.percentile(50) * 1000:.2f}',
+                        f'{q.percentile(99) * 1000:.2f}', f'{q.max_time * 1000:.2f}') for q in stats)
+
+        render = table.render()
+        fmt = f'```\n{render}\n```'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(render.encode('utf-8'))
+            return await ctx.send('Too many results...', file=discord.File(fp, 'querystats.txt'))
+
+        await ctx.send(fmt)
+
+    @commands.command(hidden=True)
+    @is_maintainer()
+    async def listenerstats(self, ctx, sort='busy', limit=15):
+        """Shows how long cog listeners took, per guild.
+        Busy is the time spent on the event loop, awaited the time spent waiting for something else.
+        Sort by either `busy`, `wall`, `calls`, `errors` or `p95`.
+        This is only for the current session.
+        """
+        keys = {
+            'busy': lambda s: s.busy.total,
+            'wall': lambda s: s.wall.total,
+            'calls': lambda s: s.calls,
+            'errors': lambda s: s.errors,
+            'p95': lambda s: s.busy.percentile(95)
+        }
+
+        try:
+            key = keys[sort]
+        except KeyError:
+            return await ctx.send(f'Can only sort by {", ".join(keys)}.')
+
+        stats = sorted(profiling.listener_stats(), key=key, reverse=True)[:limit]
+        if not stats:
+            return await ctx.send('No listeners recorded yet.')
+
+        def guild_name(guild_id):
+            if guild_id is None:
+                return '-'
+            guild = self.bot.get_guild(guild_id)
+            return guild.name[:20] if guild else str(guild_id)
+
+        table = TabularData()
+        table.set_columns(['Listener', 'Guild', 'Calls', 'Errors', 'Wall (ms)', 'Awaited (ms)', 'Busy (ms)',
+                           'Busy p95 (ms)'])
+        table.add_rows((f'{s.cog}.{s.event}', guild_name(s.guild_id), s.calls, s.errors, f'{s.wall.total * 1000:.2f}',
+                        f'{s.awaited * 1000:.2f}', f'{s.busy.total * 1000:.2f}',
+                        f'{s.busy.percentile(95) * 1000:.2f}') for s in stats)
+
+        render = table.render()
+        fmt = f'```\n{render}\n```'
+        if len(fmt) > 2000:
+            fp = io.BytesIO(render.encode('utf-8'))
+            return await ctx.send('Too many results...', file=discord.File(fp, 'listenerstats.txt'))
+
+        await ctx.send(fmt)
+
+    @commands.command(hidden=True)
+    @is_maintainer()
+    async def dumpevents(self, ctx):
+        """Dumps the most recent gateway payloads to a file."""
+        recorder = self.bot.flight_recorder
+        if not len(recorder):
+            return await ctx.send('No gateway payloads recorded yet.')
+
+        path = await recorder.save()
+        size = path.stat().st_size
+        message = f'Dumped {Plural(len(recorder)):payload} to `{path}` ({size / 1024:.1f} KiB).'
+        # Discord's upload limit.
+        if size > 8 * 1024 ** 2:
+            return await ctx.send(message)
+
+        await ctx.send(message, file=discord.File(str(path), path.name))
+
+    @commands.command(hidden=True)
+    @is_maintainer()
+    async def backfillstats(self, ctx):
+        """Rebuilds the command stat rollups from the recorded command usage."""
+        # Truncating locks the rollups, so batches written in the meantime wait for us and are added on top.
+        query = """TRUNCATE command_rollups, command_author_rollups;
+
+                   INSERT INTO command_rollups (guild_id, day, command, uses, first_used)
+                   SELECT guild_id, used::date, command, COUNT(*), MIN(used)
+                   FROM commands
+                   WHERE guild_id IS NOT NULL AND used IS NOT NULL AND command IS NOT NULL
+                   GROUP BY guild_id, used::date, command;
+
+                   INSERT INTO command_author_rollups (guild_id, day, author_id, command, uses, first_used)
+                   SELECT guild_id, used::date, author_id, command, COUNT(*), MIN(used)
+                   FROM commands
+                   WHERE guild_id IS NOT NULL AND used IS NOT NULL AND author_id IS NOT NULL AND command IS NOT NULL
+                   GROUP BY guild_id, used::date, author_id, command;
+                """
+
+        async with ctx.typing():
+            async with ctx.db.transaction():
+                await ctx.db.execute(query, timeout=600.0)
+
+            rollups = await ctx.db.fetchval('SELECT COUNT(*) FROM command_rollups;')
+
+        await ctx.send(f'Rebuilt the command stats, {Plural(rollups):daily rollup} in total.')
+
     @commands.command()
     async def info(self, ctx, *, user: Union[discord.Member, FetchedUser] = None):
         """Shows info about a user."""
@@ -204,6 +495,13 @@ class Stats(Cog):
         if isinstance(error, commands.BadUnionArgument):
             await ctx.send("Couldn't find that user...")
 
+    @staticmethod
+    def pending_usage(ctx, *, author_id=None):
+        """Returns the guild's command usage which wasn't written yet as a list of ``(author_id, command, used)``."""
+        guild_id = ctx.guild.id
+        return [(row[AUTHOR], row[COMMAND], row[USED]) for row in ctx.bot.writer.buffered('commands')
+                if row[GUILD] == guild_id and (author_id is None or row[AUTHOR] == author_id)]
+
     @staticmethod
     async def show_guild_stats(ctx):
         lookup = (
@@ -216,78 +514,91 @@ class Stats(Cog):
 
         embed = discord.Embed(title='Server Command Stats', colour=discord.Colour.blurple())
 
-        # Total command uses.
-        query = "SELECT COUNT(*), MIN(used) FROM commands WHERE guild_id=$1;"
-        count = await ctx.db.fetchrow(query, ctx.guild.id)
-
-        embed.description = f'{count[0]} commands used.'
-        embed.set_footer(text='Tracking command usage since').timestamp = count[1] or datetime.datetime.utcnow()
-
-        query = """SELECT command,
-                          COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE guild_id=$1
-                   GROUP BY command
-                   ORDER BY "uses" DESC
-                   LIMIT 5;
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id)
-
-        value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
-                          for (index, (command, uses)) in enumerate(records)) or 'No Commands'
-
-        embed.add_field(name='Top Commands', value=value, inline=True)
-
-        query = """SELECT command,
-                          COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE guild_id=$1
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
-                   GROUP BY command
-                   ORDER BY "uses" DESC
-                   LIMIT 5;
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id)
-
-        value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
-                          for (index, (command, uses)) in enumerate(records)) or 'No Commands.'
-        embed.add_field(name='Top Commands Today', value=value, inline=True)
-        embed.add_field(name='\u200b', value='\u200b', inline=True)
-
-        query = """SELECT author_id,
-                          COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE guild_id=$1
-                   GROUP BY author_id
-                   ORDER BY "uses" DESC
-                   LIMIT 5;
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id)
-
-        value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({uses} bot {"uses" if uses > 1 else "use"})'
-                          for (index, (author_id, uses)) in enumerate(records)) or 'No bot users.'
-
-        embed.add_field(name='Top Command Users', value=value, inline=False)
-
-        query = """SELECT author_id,
-                          COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE guild_id=$1
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
-                   GROUP BY author_id
-                   ORDER BY "uses" DESC
-                   LIMIT 5;
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id)
-
-        value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({uses} bot {"uses" if uses > 1 else "use"})'
-                          for (index, (author_id, uses)) in enumerate(records)) or 'No command users.'
-
-        embed.add_field(name='Top Command Users Today', value=value, inline=True)
+        today = datetime.datetime.utcnow().date()
+        pending = Stats.pending_usage(ctx)
+        pending_commands = Counter(command for _, command, _ in pending)
+        pending_authors = Counter(author_id for author_id, _, _ in pending)
+        pending_commands_today = Counter(command for _, command, used in pending if used.date() == today)
+        pending_authors_today = Counter(author_id for author_id, _, used in pending if used.date() == today)
+
+        async with ctx.replica() as con:
+            # Total command uses.
+            query = "SELECT SUM(uses)::bigint, MIN(first_used) FROM command_rollups WHERE guild_id=$1;"
+            count = await con.fetchrow(query, ctx.guild.id)
+
+            total = (count[0] or 0) + len(pending)
+            first_used = min(filter(None, (count[1], *(used for _, _, used in pending))), default=None)
+            embed.description = f'{total} commands used.'
+            embed.set_footer(text='Tracking command usage since').timestamp = first_used or datetime.datetime.utcnow()
+
+            query = """SELECT command,
+                              SUM(uses)::bigint AS "uses"
+                       FROM command_rollups
+                       WHERE guild_id=$1
+                       GROUP BY command
+                       ORDER BY "uses" DESC
+                       LIMIT $2;
+                    """
+
+            records = await con.fetch(query, ctx.guild.id, 5 + len(pending_commands))
+            records = merge_top(records, pending_commands)
+
+            value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
+                              for (index, (command, uses)) in enumerate(records)) or 'No Commands'
+
+            embed.add_field(name='Top Commands', value=value, inline=True)
+
+            query = """SELECT command,
+                              uses
+                       FROM command_rollups
+                       WHERE guild_id=$1
+                       AND day=$2
+                       ORDER BY uses DESC
+                       LIMIT $3;
+                    """
+
+            records = await con.fetch(query, ctx.guild.id, today, 5 + len(pending_commands_today))
+            records = merge_top(records, pending_commands_today)
+
+            value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
+                              for (index, (command, uses)) in enumerate(records)) or 'No Commands.'
+            embed.add_field(name='Top Commands Today', value=value, inline=True)
+            embed.add_field(name='\u200b', value='\u200b', inline=True)
+
+            query = """SELECT author_id,
+                              SUM(uses)::bigint AS "uses"
+                       FROM command_author_rollups
+                       WHERE guild_id=$1
+                       GROUP BY author_id
+                       ORDER BY "uses" DESC
+                       LIMIT $2;
+                    """
+
+            records = await con.fetch(query, ctx.guild.id, 5 + len(pending_authors))
+            records = merge_top(records, pending_authors)
+
+            value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({uses} bot {"uses" if uses > 1 else "use"})'
+                              for (index, (author_id, uses)) in enumerate(records)) or 'No bot users.'
+
+            embed.add_field(name='Top Command Users', value=value, inline=False)
+
+            query = """SELECT author_id,
+                              SUM(uses)::bigint AS "uses"
+                       FROM command_author_rollups
+                       WHERE guild_id=$1
+                       AND day=$2
+                       GROUP BY author_id
+                       ORDER BY "uses" DESC
+                       LIMIT $3;
+                    """
+
+            records = await con.fetch(query, ctx.guild.id, today, 5 + len(pending_authors_today))
+            records = merge_top(records, pending_authors_today)
+
+            value = '\n'.join(f'{lookup[index]}: <@!{author_id}> ({uses} bot {"uses" if uses > 1 else "use"})'
+                              for (index, (author_id, uses)) in enumerate(records)) or 'No command users.'
+
+            embed.add_field(name='Top Command Users Today', value=value, inline=True)
         await ctx.send(embed=embed)
 
     @staticmethod
@@ -303,46 +614,58 @@ class Stats(Cog):
         embed = discord.Embed(title='Command Stats', colour=discord.Colour.blurple())
         embed.set_author(name=str(member), icon_url=member.avatar_url)
 
-        # total command uses
-        query = "SELECT COUNT(*), MIN(used) FROM commands WHERE guild_id=$1 AND author_id=$2;"
-        count = await ctx.db.fetchrow(query, ctx.guild.id, member.id)
-
-        embed.description = f'{count[0]} commands used.'
-        embed.set_footer(text='First command used').timestamp = count[1] or datetime.datetime.utcnow()
-
-        query = """SELECT command,
-                          COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE guild_id=$1 AND author_id=$2
-                   GROUP BY command
-                   ORDER BY "uses" DESC
-                   LIMIT 5;
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
-
-        value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
-                          for (index, (command, uses)) in enumerate(records)) or 'No Commands'
-
-        embed.add_field(name='Most Used Commands', value=value, inline=False)
-
-        query = """SELECT command,
-                          COUNT(*) AS "uses"
-                   FROM commands
-                   WHERE guild_id=$1
-                   AND author_id=$2
-                   AND used > (CURRENT_TIMESTAMP - INTERVAL '1 day')
-                   GROUP BY command
-                   ORDER BY "uses" DESC
-                   LIMIT 5;
-                """
-
-        records = await ctx.db.fetch(query, ctx.guild.id, member.id)
-
-        value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
-                          for (index, (command, uses)) in enumerate(records)) or 'No Commands'
-
-        embed.add_field(name='Most Used Commands Today', value=value, inline=False)
+        today = datetime.datetime.utcnow().date()
+        pending = Stats.pending_usage(ctx, author_id=member.id)
+        pending_commands = Counter(command for _, command, _ in pending)
+        pending_commands_today = Counter(command for _, command, used in pending if used.date() == today)
+
+        async with ctx.replica() as con:
+            # total command uses
+            query = """SELECT SUM(uses)::bigint, MIN(first_used)
+                       FROM command_author_rollups
+                       WHERE guild_id=$1 AND author_id=$2;
+                    """
+            count = await con.fetchrow(query, ctx.guild.id, member.id)
+
+            total = (count[0] or 0) + len(pending)
+            first_used = min(filter(None, (count[1], *(used for _, _, used in pending))), default=None)
+            embed.description = f'{total} commands used.'
+            embed.set_footer(text='First command used').timestamp = first_used or datetime.datetime.utcnow()
+
+            query = """SELECT command,
+                              SUM(uses)::bigint AS "uses"
+                       FROM command_author_rollups
+                       WHERE guild_id=$1 AND author_id=$2
+                       GROUP BY command
+                       ORDER BY "uses" DESC
+                       LIMIT $3;
+                    """
+
+            records = await con.fetch(query, ctx.guild.id, member.id, 5 + len(pending_commands))
+            records = merge_top(records, pending_commands)
+
+            value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
+                              for (index, (command, uses)) in enumerate(records)) or 'No Commands'
+
+            embed.add_field(name='Most Used Commands', value=value, inline=False)
+
+            query = """SELECT command,
+                              uses
+                       FROM command_author_rollups
+                       WHERE guild_id=$1
+                       AND author_id=$2
+                       AND day=$3
+                       ORDER BY uses DESC
+                       LIMIT $4;
+                    """
+
+            records = await con.fetch(query, ctx.guild.id, member.id, today, 5 + len(pending_commands_today))
+            records = merge_top(records, pending_commands_today)
+
+            value = '\n'.join(f'{lookup[index]}: {command} ({Plural(uses):use})'
+                              for (index, (command, uses)) in enumerate(records)) or 'No Commands'
+
+            embed.add_field(name='Most Used Commands Today', value=value, inline=False)
         await ctx.send(embed=embed)
 
     @commands.command()
@@ -369,18 +692,28 @@ class Stats(Cog):
 
         # Check the connection pool health.
         pool = self.bot.pool
-        total_waiting = len(pool._queue._getters)
+        telemetry = pool.telemetry
+        total_waiting = pool.waiters
         current_generation = pool._generation
 
         description = [
             f'Total `Pool.acquire` Waiters: {total_waiting}',
             f'Current Pool Generation: {current_generation}',
-            f'Connections In Use: {len(pool._holders) - pool._queue.qsize()}'
+            f'Connections In Use: {len(pool.checkouts())}/{pool.size} (max {pool.max_size})',
+            f'Acquire p95 (last minute): {telemetry.recent_acquire_p95() * 1000:.2f}ms',
+            f'Oldest Connection: {pool.oldest_connection():.0f}s'
         ]
 
+        if pool.replicas.replicas:
+            lags = ', '.join('down' if lag is None else f'{lag:.1f}s' for lag in pool.replicas.lag.values())
+            description.append(f'Read Replicas: {len(pool.replicas.healthy())}/{len(pool.replicas.replicas)} ({lags})')
+
         questionable_connections = 0
         connection_value = []
         for index, holder in enumerate(pool._holders, start=1):
+            if holder in pool._parked:
+                continue
+
             generation = holder._generation
             in_use = holder._in_use is not None
             is_closed = holder._con is None or holder._con.is_closed()
@@ -393,7 +726,29 @@ class Stats(Cog):
 
         description.append(f'Questionable Connections: {questionable_connections}')
 
-        total_warnings += questionable_connections
+        total_warnings += questionable_connections + bool(total_waiting)
+
+        slow_acquires = []
+        for entry in reversed(list(telemetry.slow_acquires)[-3:]):
+            when = datetime.datetime.utcfromtimestamp(entry.timestamp)
+            holders = ', '.join(f'{label} ({held:.1f}s)' for label, held in entry.holders[:3]) or 'nobody'
+            slow_acquires.append(f'{when:%H:%M:%S}: {entry.waited * 1000:.0f}ms for {entry.waiter}, held by {holders}')
+
+        if slow_acquires:
+            embed.add_field(name='Recent Slow Acquires', value='\n'.join(slow_acquires)[:1024], inline=False)
+
+        monitor = self.bot.loop_monitor
+        description.append(f'Event Loop Lag: {monitor.lag * 1000:.2f}ms')
+
+        stalls = []
+        for stall in list(monitor.stalls)[-5:]:
+            when = datetime.datetime.utcfromtimestamp(stall.timestamp)
+            where = stall.stack[-1].strip().splitlines()[0] if stall.stack else 'unknown'
+            stalls.append(f'{when:%H:%M:%S}: {stall.duration * 1000:.0f}ms in {stall.task}\n`{where}`')
+
+        if stalls:
+            total_warnings += 1
+            embed.add_field(name='Recent Loop Stalls', value='\n'.join(stalls)[:1024], inline=False)
 
         all_tasks = asyncio.all_tasks(loop=self.bot.loop)
 
@@ -415,9 +770,15 @@ class Stats(Cog):
         embed.add_field(name='Inner Tasks', value=f'Total: {len(inner_tasks)}\nFailed: {bad_inner_tasks or "None"}')
         embed.add_field(name='Events Waiting', value=f'Total: {len(event_tasks)}', inline=False)
 
-        command_waiters = len(self._data_batch)
-        is_locked = self._batch_lock.locked()
-        description.append(f'Commands Waiting: {command_waiters}, Batch Locked: {is_locked}')
+        writer_stats = self.bot.writer.stats()
+        writes = ', '.join(f'{s.table} {s.pending}/{s.capacity}' for s in writer_stats)
+        description.append(f'Writes Waiting: {writes or "None"}')
+
+        for s in writer_stats:
+            if s.spilled:
+                total_warnings += 1
+                description.append(f'Spilled {s.table} Rows: {s.spilled / 1024:.1f} KiB, '
+                                   f'{s.replayed / s.spilled:.0%} replayed')
 
         memory_usage = self.process.memory_full_info().uss / 1024 ** 2
         cpu_usage = self.process.cpu_percent() / psutil.cpu_count()
@@ -426,7 +787,7 @@ class Stats(Cog):
         global_rate_limit = not self.bot.http._global_over.is_set()
         description.append(f'Global Rate Limit: {global_rate_limit}')
 
-        if command_waiters >= 8:
+        if any(s.pending >= s.capacity for s in writer_stats):
             total_warnings += 1
             embed.colour = WARNING
 
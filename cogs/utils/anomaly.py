@@ -0,0 +1,277 @@
+"""
+Anomaly detection for raids.
+
+Everything in here keeps a fixed amount of state and does a constant amount
+of work per event, so it can run for every guild all the time.
+"""
+
+import math
+import re
+from collections import Counter, deque, namedtuple
+
+# score: How unusual the recent joins are, 1.0 being the point where raid mode is warranted.
+# joins: Joins within the window.
+# velocity: How much faster than usual members joined.
+# new_accounts, no_avatar, similar_names: The fraction of joins within the window which look suspicious.
+JoinSummary = namedtuple('JoinSummary', 'score joins velocity new_accounts no_avatar similar_names')
+
+_DIGITS = re.compile(r'\d+')
+_SYMBOLS = re.compile(r'[\W_]+')
+
+
+def name_key(name):
+    """Reduces a name to its shape, so ``raider123`` and ``Raider_987`` end up the same."""
+    return _DIGITS.sub('0', _SYMBOLS.sub('', name.casefold()))
+
+
+class _DecayingCount:
+    """An event count which decays exponentially, ``tau`` being the time constant in seconds."""
+
+    __slots__ = ('tau', 'value', 'updated')
+
+    def __init__(self, tau):
+        self.tau = tau
+        self.value = 0.0
+        self.updated = None
+
+    def at(self, now):
+        if self.updated is None:
+            return 0.0
+        return self.value * math.exp(-max(0.0, now - self.updated) / self.tau)
+
+    def add(self, now, amount=1.0):
+        self.value = self.at(now) + amount
+        self.updated = now
+
+    def rate(self, now):
+        """The events per second."""
+        return self.at(now) / self.tau
+
+
+class JoinAnalyzer:
+    """Scores a guild's recent joins.
+
+    The join rate within the window is compared with the long term rate,
+    which is scaled by ``surge``. Members joining at least that much faster
+    than usual and ``min_joins`` within the window give a velocity of 1.0.
+    The velocity is scaled by how suspicious the joins look, between 0.5
+    for ordinary accounts and 1.5 for new ones without an avatar and
+    similar names. Rough thresholds for the score are 1.0 for raid mode and
+    2.0 for strict raid mode.
+
+    Parameters
+    -----------
+    window: float
+        How many seconds of joins are looked at.
+    min_joins: int
+        How many joins within the window are never unusual.
+    surge: float
+        How many times the long term join rate counts as unusual.
+    history: float
+        The time constant of the long term join rate, in seconds.
+    max_joins: int
+        How many joins are kept at most, to bound memory during big raids.
+    new_account_age: float
+        Accounts younger than this many days count as new.
+    """
+
+    def __init__(self, *, window=60.0, min_joins=6, surge=5.0, history=86400.0, max_joins=256,
+                 new_account_age=7.0):
+        self.window = window
+        self.min_joins = min_joins
+        self.surge = surge
+        self.new_account_age = new_account_age * 86400.0
+        self.long_term = _DecayingCount(history)
+        # (timestamp, is_new, no_avatar, name key)
+        self._joins = deque(maxlen=max_joins)
+        self._names = Counter()
+        self._new = 0
+        self._no_avatar = 0
+        # Joins whose name's shape is shared by another join in the window.
+        self._similar = 0
+        self.last_alarm = None
+
+    def _forget(self, join):
+        _, is_new, no_avatar, key = join
+        self._new -= is_new
+        self._no_avatar -= no_avatar
+        count = self._names[key]
+        if count == 2:
+            self._similar -= 2
+        elif count > 2:
+            self._similar -= 1
+
+        if count == 1:
+            del self._names[key]
+        else:
+            self._names[key] = count - 1
+
+    def _expire(self, now):
+        joins = self._joins
+        while joins and now - joins[0][0] > self.window:
+            self._forget(joins.popleft())
+
+    def add(self, now, *, created_at, name, has_avatar):
+        """Records a join and returns the :class:`JoinSummary` of the window.
+        ``now`` and ``created_at`` are POSIX timestamps.
+        """
+        self._expire(now)
+        if len(self._joins) == self._joins.maxlen:
+            self._forget(self._joins[0])
+
+        is_new = now - created_at < self.new_account_age
+        no_avatar = not has_avatar
+        key = name_key(name)
+        count = self._names[key]
+        if count == 1:
+            self._similar += 2
+        elif count > 1:
+            self._similar += 1
+        self._names[key] = count + 1
+        self._new += is_new
+        self._no_avatar += no_avatar
+        self._joins.append((now, is_new, no_avatar, key))
+
+        summary = self.summary(now)
+        # Only joins count towards the long term rate, raids shouldn't become the norm.
+        if summary.score < 1.0:
+            self.long_term.add(now)
+        else:
+            self.last_alarm = now
+        return summary
+
+    def summary(self, now):
+        self._expire(now)
+        joins = len(self._joins)
+        if not joins:
+            return JoinSummary(0.0, 0, 0.0, 0.0, 0.0, 0.0)
+
+        expected = max(self.min_joins / self.window, self.surge * self.long_term.rate(now))
+        velocity = joins / self.window / expected
+        new_accounts = self._new / joins
+        no_avatar = self._no_avatar / joins
+        similar_names = self._similar / joins
+        suspicion = (new_accounts + no_avatar + similar_names) / 3
+        return JoinSummary(velocity * (0.5 + suspicion), joins, velocity, new_accounts, no_avatar, similar_names)
+
+    def quiet_for(self, now):
+        """How many seconds ago the score last reached 1.0, ``None`` if it never did."""
+        return None if self.last_alarm is None else now - self.last_alarm
+
+
+# rate_z, authors_z: How many standard deviations above the baseline the current interval is.
+# messages, authors: Messages and (roughly) unique authors within the current interval.
+# rate_mean, authors_mean: What's usual for the interval.
+ChannelSpike = namedtuple('ChannelSpike', 'rate_z authors_z messages authors rate_mean authors_mean')
+
+# The persisted part of a baseline, see ChannelBaseline.state.
+BaselineState = namedtuple('BaselineState', 'rate_mean rate_var authors_mean authors_var samples')
+
+
+def _ewm_update(mean, var, value, alpha):
+    diff = value - mean
+    increment = alpha * diff
+    return mean + increment, (1 - alpha) * (var + diff * increment)
+
+
+class ChannelBaseline:
+    """Exponentially weighted mean and variance of a channel's messages and unique
+    authors per interval, and how far the current interval is off from them.
+
+    Unique authors are counted in a 64 bit bitmap, which is accurate enough for
+    telling a handful of people apart from a crowd.
+
+    Parameters
+    -----------
+    interval: float
+        The length of an interval, in seconds.
+    half_life: float
+        How many seconds it takes for an interval to count half as much towards the baseline.
+    threshold: float
+        How many standard deviations above the baseline count as a spike.
+    min_messages: int
+        How many messages an interval needs at least to count as a spike.
+    min_samples: int
+        How many intervals have to be seen before anything counts as a spike.
+    """
+
+    __slots__ = ('interval', 'alpha', 'threshold', 'min_messages', 'min_samples', 'bucket', 'messages',
+                 '_authors', 'rate_mean', 'rate_var', 'authors_mean', 'authors_var', 'samples', 'last_alert', 'dirty')
+
+    def __init__(self, *, interval=10.0, half_life=3600.0, threshold=4.0, min_messages=15, min_samples=360,
+                 state=None):
+        self.interval = interval
+        self.alpha = 1 - 0.5 ** (interval / half_life)
+        self.threshold = threshold
+        self.min_messages = min_messages
+        self.min_samples = min_samples
+        self.bucket = None
+        self.messages = 0
+        self._authors = 0
+        self.rate_mean = self.rate_var = self.authors_mean = self.authors_var = 0.0
+        self.samples = 0
+        self.last_alert = None
+        # Whether anything changed since the state was last saved.
+        self.dirty = False
+        if state is not None:
+            self.restore(state)
+
+    @property
+    def state(self):
+        return BaselineState(self.rate_mean, self.rate_var, self.authors_mean, self.authors_var, self.samples)
+
+    def restore(self, state):
+        self.rate_mean, self.rate_var, self.authors_mean, self.authors_var, self.samples = state
+
+    @property
+    def authors(self):
+        zeros = 64 - bin(self._authors).count('1')
+        # Linear counting, which saturates once every bit is set.
+        return 64 * math.log(64 / max(zeros, 0.5))
+
+    def _close(self, elapsed):
+        alpha = self.alpha
+        self.rate_mean, self.rate_var = _ewm_update(self.rate_mean, self.rate_var, self.messages, alpha)
+        self.authors_mean, self.authors_var = _ewm_update(self.authors_mean, self.authors_var, self.authors, alpha)
+
+        # The intervals in between had no messages at all, which has a closed form.
+        empty = elapsed - 1
+        if empty > 0:
+            decay = (1 - alpha) ** empty
+            self.rate_var = decay * (self.rate_var + self.rate_mean ** 2 * (1 - decay))
+            self.rate_mean *= decay
+            self.authors_var = decay * (self.authors_var + self.authors_mean ** 2 * (1 - decay))
+            self.authors_mean *= decay
+
+        self.samples += elapsed
+        self.messages = 0
+        self._authors = 0
+        self.dirty = True
+
+    def _z(self, value, mean, var):
+        # Quiet channels have next to no variance, which Poisson noise makes up for.
+        deviation = max(math.sqrt(var), math.sqrt(mean), 1.0)
+        return (value - mean) / deviation
+
+    def add(self, now, author_id):
+        """Records a message and returns a :class:`ChannelSpike` if the current interval is one."""
+        bucket = int(now // self.interval)
+        if self.bucket is None:
+            self.bucket = bucket
+        elif bucket > self.bucket:
+            self._close(bucket - self.bucket)
+            self.bucket = bucket
+
+        self.messages += 1
+        self._authors |= 1 << (hash(author_id) & 63)
+
+        if self.samples < self.min_samples or self.messages < self.min_messages:
+            return None
+
+        rate_z = self._z(self.messages, self.rate_mean, self.rate_var)
+        authors = self.authors
+        authors_z = self._z(authors, self.authors_mean, self.authors_var)
+        if max(rate_z, authors_z) < self.threshold:
+            return None
+
+        return ChannelSpike(rate_z, authors_z, self.messages, authors, self.rate_mean, self.authors_mean)
@@ -6,7 +6,10 @@ import time
 from functools import wraps
 
 
-__all__ = ("Strategy", "cache", "ExpiringCache")
+__all__ = ("Strategy", "cache", "ExpiringCache", "all_caches")
+
+# Every cached function, by qualified name.
+_caches = {}
 
 
 def _wrap_and_store_coroutine(cache, key, coro):
@@ -55,6 +58,10 @@ class ExpiringCache(dict):
             return None
 
 
+def all_caches():
+    return dict(_caches)
+
+
 class Strategy(enum.Enum):
     lru = 1
     raw = 2
@@ -135,6 +142,7 @@ def cache(maxsize=128, strategy=Strategy.lru, ignore_kwargs=False):
         wrapper.invalidate = _invalidate
         wrapper.get_stats = _stats
         wrapper.invalidate_containing = _invalidate_containing
+        _caches[f'{func.__module__}.{func.__qualname__}'] = wrapper
         return wrapper
 
     return decorator
@@ -1,5 +1,6 @@
 import asyncio
 import io
+import time
 
 import discord
 from discord.ext import commands
@@ -28,11 +29,25 @@ class Context(commands.Context):
         super().__init__(**kwargs)
         self.pool = self.bot.pool
         self.db = None
+        # When processing the message started, for the command's wall time.
+        self.started = time.perf_counter()
+        # Filled in by cogs.utils.tracing while the command runs.
+        self.db_time = 0.0
+        self.db_calls = 0
+        self.pool_wait = 0.0
+        self.http_time = 0.0
+        self.http_calls = 0
 
     def __repr__(self):
         # Needed to consistently cache Context objects.
         return "<Context>"
 
+    @property
+    def label(self):
+        # Used by cogs.utils.tracing to tell owners apart.
+        name = self.command.qualified_name if self.command else self.invoked_with
+        return f'command {name}'
+
     async def prompt(self, message, *, timeout=60.0, delete_after=True, author_id=None):
         """An interactive reaction confirmation dialog.
         Parameters
@@ -96,6 +111,13 @@ class Context(commands.Context):
         finally:
             return confirm
 
+    def replica(self, *, timeout=None):
+        """Acquires a connection for heavy read-only queries, preferably from a read replica.
+        Falls back to the already acquired :attr:`db` connection.
+        Results might lag behind recent writes slightly.
+        """
+        return self.pool.replicas.acquire(fallback=self.db, timeout=timeout)
+
     async def _acquire(self, timeout):
         if self.db is None:
             self.db = await self.pool.acquire(timeout=timeout)
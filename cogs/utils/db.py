@@ -21,18 +21,31 @@ DEALINGS IN THE SOFTWARE.
 import asyncio
 import datetime
 import decimal
+import gzip
 import inspect
 import json
 import logging
 import pydoc
+import re
+import time
 import uuid
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from functools import lru_cache
 from pathlib import Path
 
 import asyncpg
 
+from cogs.utils import jsonb, tracing
+from cogs.utils.pool import create_pool, ReplicaSet
+
 log = logging.getLogger(__name__)
 
+# Queries that take longer than this many seconds get logged, None disables it.
+_slow_query_threshold = None
+# Every distinct query gets its own stats entry, this caps how many are kept.
+MAX_TRACKED_QUERIES = 500
+_query_stats = {}
+
 
 class SchemaError(Exception):
     pass
@@ -300,11 +313,15 @@ class Array(SQLType):
 
 
 class Column:
+    """A table column.
+    ``backfill`` is an SQL expression the column is filled with when it's added by a migration.
+    """
+
     __slots__ = ('column_type', 'index', 'primary_key', 'nullable',
-                 'default', 'unique', 'name', 'index_name')
+                 'default', 'unique', 'name', 'index_name', 'backfill')
 
     def __init__(self, column_type, *, index=False, primary_key=False,
-                 nullable=True, unique=False, default=None, name=None):
+                 nullable=True, unique=False, default=None, name=None, backfill=None):
 
         if inspect.isclass(column_type):
             column_type = column_type()
@@ -320,6 +337,7 @@ class Column:
         self.default = default
         self.name = name
         self.index_name = None  # to be filled later
+        self.backfill = backfill
 
         if sum(map(bool, (unique, primary_key, default is not None))) > 1:
             raise SchemaError("'unique', 'primary_key', and 'default' are mutually exclusive.")
@@ -391,6 +409,49 @@ class DiscordIDColumn(Column):
         super().__init__(Integer(big=True), index=index, nullable=nullable, unique=unique, default=default)
 
 
+class Index:
+    """A table-level index.
+    Every expression is either a column name or a parenthesised SQL expression,
+    e.g. ``Index('guild_id', 'used')`` or ``Index("(extra #>> '{args,2}')", where="event = 'punish'")``.
+    """
+
+    __slots__ = ('expressions', 'name', 'where', 'unique')
+
+    def __init__(self, *expressions, name=None, where=None, unique=False):
+        if not expressions:
+            raise SchemaError('An index needs at least one column or expression.')
+
+        self.expressions = list(expressions)
+        self.name = name
+        self.where = where
+        self.unique = unique
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(*data['expressions'], name=data['name'], where=data['where'], unique=data['unique'])
+
+    def _to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.__slots__}
+
+    def _create_index(self, table_name, *, concurrently=False):
+        builder = ['CREATE']
+        if self.unique:
+            builder.append('UNIQUE')
+        builder.append('INDEX')
+        if concurrently:
+            builder.append('CONCURRENTLY')
+        builder.append(f'IF NOT EXISTS {self.name} ON {table_name} ({", ".join(self.expressions)})')
+        if self.where is not None:
+            builder.append(f'WHERE {self.where}')
+
+        return ' '.join(builder) + ';'
+
+    def _drop_index(self, *, concurrently=False):
+        if concurrently:
+            return f'DROP INDEX CONCURRENTLY IF EXISTS {self.name};'
+        return f'DROP INDEX IF EXISTS {self.name};'
+
+
 class SchemaDiff:
     __slots__ = ('table', 'upgrade', 'downgrade')
 
@@ -405,7 +466,7 @@ class SchemaDiff:
     def is_empty(self):
         return len(self.upgrade) == 0 and len(self.downgrade) == 0
 
-    def to_sql(self, *, downgrade=False):
+    def to_sql(self, *, downgrade=False, table_indexes=True):
         statements = []
         base = f'ALTER TABLE {self.table.__tablename__} '
         path = self.upgrade if not downgrade else self.downgrade
@@ -454,16 +515,59 @@ class SchemaDiff:
         if sub_statements:
             statements.append(base + ', '.join(sub_statements) + ';')
 
+        # Arbitrary statements, e.g. filling added columns, before any index is built.
+        statements.extend(path.get('execute', []))
+
         # handle the index creation bits
         for dropped in path.get('drop_index', []):
             statements.append(f'DROP INDEX IF EXISTS {dropped["index"]};')
 
         for added in path.get('add_index', []):
-            fmt = 'CREATE INDEX IF NOT EXISTS {0[INDEX]} ON {1.__tablename__} ({0[NAME]});'
+            fmt = 'CREATE INDEX IF NOT EXISTS {0[index]} ON {1.__tablename__} ({0[name]});'
             statements.append(fmt.format(added, self.table))
 
+        if table_indexes:
+            statements.extend(self.index_statements(downgrade=downgrade))
+
         return '\n'.join(statements)
 
+    def index_statements(self, *, downgrade=False, concurrently=False):
+        """Returns the table-level index changes as separate statements.
+        ``CREATE INDEX CONCURRENTLY`` can neither run inside a transaction nor
+        alongside other statements, so these have to be executed one by one.
+        """
+        return [statement for statement, _ in self.index_statements_with_cleanup(downgrade=downgrade,
+                                                                                 concurrently=concurrently)]
+
+    def index_statements_with_cleanup(self, *, downgrade=False, concurrently=False):
+        """Like :meth:`index_statements`, but returns ``(statement, cleanup)`` pairs.
+        A concurrent index build that fails leaves an invalid index behind, which
+        ``cleanup`` drops. It's ``None`` for statements which leave nothing behind.
+        """
+        statements = []
+        path = self.upgrade if not downgrade else self.downgrade
+        # Indexes on partitioned tables can't be built concurrently.
+        concurrently = concurrently and self.table.__partition_key__ is None
+
+        for dropped in path.get('drop_table_indexes', []):
+            statements.append((Index.from_dict(dropped)._drop_index(concurrently=concurrently), None))
+
+        for added in path.get('add_table_indexes', []):
+            index = Index.from_dict(added)
+            cleanup = index._drop_index(concurrently=True) if concurrently else None
+            statements.append((index._create_index(self.table.__tablename__, concurrently=concurrently), cleanup))
+
+        return statements
+
+
+def _month_start(value):
+    return datetime.date(value.year, value.month, 1)
+
+
+def _add_months(day, months):
+    month = day.month - 1 + months
+    return datetime.date(day.year + month // 12, month % 12 + 1, 1)
+
 
 class MaybeAcquire:
     def __init__(self, connection, *, pool):
@@ -483,6 +587,199 @@ class MaybeAcquire:
             await self.pool.release(self._connection)
 
 
+@lru_cache(maxsize=2048)
+def normalise_query(query):
+    """Collapses all whitespace, so the same query written differently maps to the same key."""
+    return ' '.join(query.split())
+
+
+class QueryStats:
+    __slots__ = ('query', 'calls', 'total_time', 'max_time', '_samples')
+
+    def __init__(self, query, *, samples=512):
+        self.query = query
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        # Only the most recent timings are kept around for percentiles.
+        self._samples = deque(maxlen=samples)
+
+    def add(self, elapsed):
+        self.calls += 1
+        self.total_time += elapsed
+        self.max_time = max(self.max_time, elapsed)
+        self._samples.append(elapsed)
+
+    def percentile(self, percent):
+        if not self._samples:
+            return 0.0
+
+        samples = sorted(self._samples)
+        index = min(len(samples) - 1, round(percent / 100 * (len(samples) - 1)))
+        return samples[index]
+
+
+def query_stats():
+    """Returns the :class:`QueryStats` of every query run since start-up."""
+    return list(_query_stats.values())
+
+
+def record_query(query, args, elapsed):
+    key = normalise_query(query)
+    try:
+        stats = _query_stats[key]
+    except KeyError:
+        if len(_query_stats) >= MAX_TRACKED_QUERIES:
+            key = '<other>'
+        stats = _query_stats.setdefault(key, QueryStats(key))
+
+    stats.add(elapsed)
+    tracing.add_db_time(elapsed)
+
+    if _slow_query_threshold is not None and elapsed >= _slow_query_threshold:
+        # Parameters can contain user content, so only their types are logged.
+        params = ', '.join(type(arg).__name__ for arg in args)
+        log.warning(f'Slow query ({elapsed * 1000:.2f}ms): {key} [{params}]')
+
+
+class Statement:
+    """A named query that is prepared once per connection.
+    Statements declared as attributes of a :class:`Table` are named
+    ``<table name>.<attribute name>``, other statements need an explicit name.
+    Every statement keeps track of how often it was called and how long it took.
+    """
+
+    __slots__ = ('query', 'name', 'calls', 'total_time', 'max_time')
+
+    def __init__(self, query, *, name=None):
+        self.query = query
+        self.name = name
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+        if name is not None:
+            Table.register_statement(self)
+
+    def __repr__(self):
+        return f'<Statement name={self.name!r} calls={self.calls} total_time={self.total_time:.3f}>'
+
+    @property
+    def average_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+    async def _call(self, method, args, connection):
+        async with MaybeAcquire(connection, pool=Table._pool) as con:
+            start = time.perf_counter()
+            get_prepared = getattr(con, 'get_prepared', None)
+            try:
+                if get_prepared is None:
+                    # Not one of our connections, let asyncpg's statement cache deal with it.
+                    return await getattr(con, method)(self.query, *args)
+
+                prepared = await get_prepared(self)
+                try:
+                    return await self._run_prepared(prepared, method, args)
+                except asyncpg.InvalidCachedStatementError:
+                    # The schema changed under us, e.g. by a migration.
+                    # This can only be retried outside of a transaction.
+                    con.forget_prepared(self)
+                    if con.is_in_transaction():
+                        raise
+                    prepared = await get_prepared(self)
+                    return await self._run_prepared(prepared, method, args)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.calls += 1
+                self.total_time += elapsed
+                self.max_time = max(self.max_time, elapsed)
+                if get_prepared is not None:
+                    # Our connections record their own queries, prepared statements bypass them.
+                    record_query(self.query, args, elapsed)
+
+    @staticmethod
+    async def _run_prepared(prepared, method, args):
+        if method == 'execute':
+            # Prepared statements have no execute, so emulate it.
+            await prepared.fetch(*args)
+            return prepared.get_statusmsg()
+        return await getattr(prepared, method)(*args)
+
+    async def execute(self, *args, connection=None):
+        return await self._call('execute', args, connection)
+
+    async def fetch(self, *args, connection=None):
+        return await self._call('fetch', args, connection)
+
+    async def fetchrow(self, *args, connection=None):
+        return await self._call('fetchrow', args, connection)
+
+    async def fetchval(self, *args, connection=None):
+        return await self._call('fetchval', args, connection)
+
+
+class Connection(asyncpg.Connection):
+    """A connection that keeps the registered statements prepared and times every query."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._prepared = {}
+        self.connected_at = time.monotonic()
+
+    async def execute(self, query, *args, timeout=None):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, *args, timeout=timeout)
+        finally:
+            record_query(query, args, time.perf_counter() - start)
+
+    async def fetch(self, query, *args, timeout=None):
+        start = time.perf_counter()
+        try:
+            return await super().fetch(query, *args, timeout=timeout)
+        finally:
+            record_query(query, args, time.perf_counter() - start)
+
+    async def fetchrow(self, query, *args, timeout=None):
+        start = time.perf_counter()
+        try:
+            return await super().fetchrow(query, *args, timeout=timeout)
+        finally:
+            record_query(query, args, time.perf_counter() - start)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        start = time.perf_counter()
+        try:
+            return await super().fetchval(query, *args, column=column, timeout=timeout)
+        finally:
+            record_query(query, args, time.perf_counter() - start)
+
+    async def get_prepared(self, statement):
+        try:
+            query, prepared = self._prepared[statement.name]
+        except KeyError:
+            pass
+        else:
+            # A reloaded cog might have changed the query.
+            if query == statement.query:
+                return prepared
+
+        prepared = await self.prepare(statement.query)
+        self._prepared[statement.name] = (statement.query, prepared)
+        return prepared
+
+    def forget_prepared(self, statement):
+        self._prepared.pop(statement.name, None)
+
+    async def prepare_statements(self):
+        for statement in Table.statements():
+            try:
+                await self.get_prepared(statement)
+            except asyncpg.PostgresError as e:
+                # Most likely the table does not exist yet, it'll be prepared lazily instead.
+                log.debug(f'Could not prepare statement {statement.name}: {e}')
+
+
 class TableMeta(type):
     @classmethod
     def __prepare__(mcs, name, bases, **kwargs):
@@ -490,6 +787,8 @@ class TableMeta(type):
 
     def __new__(mcs, name, parents, dct, **kwargs):
         columns = []
+        indexes = []
+        statements = []
 
         try:
             table_name = kwargs['table_name']
@@ -497,6 +796,8 @@ class TableMeta(type):
             table_name = name.lower()
 
         dct['__tablename__'] = table_name
+        # The column the table is range partitioned by, one partition per month.
+        dct['__partition_key__'] = kwargs.get('partition_by')
 
         for elem, value in dct.items():
             if isinstance(value, Column):
@@ -507,17 +808,38 @@ class TableMeta(type):
                     value.index_name = f'{table_name}_{value.name}_idx'
 
                 columns.append(value)
+            elif isinstance(value, Index):
+                if value.name is None:
+                    value.name = f'{table_name}_{elem}_idx'
+
+                indexes.append(value)
+            elif isinstance(value, Statement):
+                if value.name is None:
+                    value.name = f'{table_name}.{elem}'
+
+                statements.append(value)
 
         dct['columns'] = columns
-        return super().__new__(mcs, name, parents, dct)
+        dct['indexes'] = indexes
+        # Generated INSERT queries, keyed by their column names.
+        dct['_insert_queries'] = {}
+        cls = super().__new__(mcs, name, parents, dct)
+
+        for statement in statements:
+            cls.register_statement(statement)
+
+        return cls
 
     def __init__(cls, name, parents, dct, **kwargs):
         super().__init__(name, parents, dct)
 
 
 class Table(metaclass=TableMeta):
+    _statements = OrderedDict()
+
     @classmethod
-    async def create_pool(cls, uri, **kwargs):
+    async def create_pool(cls, uri, *, replicas=(), max_replica_lag=30.0, slow_query_threshold=None, json_backend=None,
+                          **kwargs):
         """Sets up and returns the PostgreSQL connection pool that is used.
         .. note::
             This must be called at least once before doing anything with the tables.
@@ -526,27 +848,59 @@ class Table(metaclass=TableMeta):
         -----------
         uri: str
             The PostgreSQL URI to connect to.
+        replicas: Iterable[str]
+            The URIs of read-only replicas. These are available as ``pool.replicas``,
+            a :class:`cogs.utils.pool.ReplicaSet`, which falls back to the primary.
+        max_replica_lag: float
+            How many seconds a replica may lag behind before it's skipped.
+        slow_query_threshold: Optional[float]
+            Queries taking longer than this many seconds are logged.
+        json_backend: Optional[str]
+            The JSON library used for jsonb values, see :func:`cogs.utils.jsonb.get_backend`.
+            Defaults to the fastest one that's installed.
         **kwargs
-            The arguments to forward to asyncpg.create_pool.
+            The arguments to forward to :func:`cogs.utils.pool.create_pool`.
         """
 
-        def _encode_jsonb(value):
-            return json.dumps(value)
+        codec = jsonb.JSONBCodec(jsonb.get_backend(json_backend))
+        log.info(f'Using {codec.backend.name} for jsonb values.')
 
-        def _decode_jsonb(value):
-            return json.loads(value)
+        global _slow_query_threshold
+        _slow_query_threshold = slow_query_threshold
 
         old_init = kwargs.pop('init', None)
+        kwargs.setdefault('connection_class', Connection)
 
         async def init(con):
-            await con.set_type_codec('jsonb', schema='pg_catalog', encoder=_encode_jsonb, decoder=_decode_jsonb,
-                                     format='text')
+            await codec.register(con)
+            if isinstance(con, Connection):
+                await con.prepare_statements()
             if old_init is not None:
                 await old_init(con)
 
-        cls._pool = pool = await asyncpg.create_pool(uri, init=init, **kwargs)
+        cls._pool = pool = await create_pool(uri, init=init, **kwargs)
+
+        # Replicas connect lazily, so an unreachable one doesn't keep us from starting.
+        replica_kwargs = {**kwargs, 'min_size': 0}
+        replica_pools = [await create_pool(replica, init=init, **replica_kwargs) for replica in replicas]
+        pool.replicas = ReplicaSet(pool, replica_pools, max_lag=max_replica_lag)
         return pool
 
+    @classmethod
+    def register_statement(cls, statement):
+        """Registers a named :class:`Statement` so it gets prepared on every new connection."""
+        if statement.name is None:
+            raise TypeError('Cannot register a statement without a name.')
+        Table._statements[statement.name] = statement
+
+    @classmethod
+    def get_statement(cls, name):
+        return Table._statements[name]
+
+    @classmethod
+    def statements(cls):
+        return list(Table._statements.values())
+
     @classmethod
     def acquire_connection(cls, connection):
         return MaybeAcquire(connection, pool=cls._pool)
@@ -607,7 +961,8 @@ class Table(metaclass=TableMeta):
         return False
 
     @classmethod
-    async def migrate(cls, *, directory='migrations', index=-1, downgrade=False, verbose=False, connection=None):
+    async def migrate(cls, *, directory='migrations', index=-1, downgrade=False, verbose=False, connection=None,
+                      deferred=None):
         """Actually run the latest migration pointed by the data file.
         Parameters
         -----------
@@ -622,6 +977,16 @@ class Table(metaclass=TableMeta):
         connection: Optional[asyncpg.Connection]
             The connection to use, if not provided will acquire one from
             the internal pool.
+        deferred: Optional[list]
+            If provided, table-level index changes are appended to this list as
+            ``(statement, cleanup)`` pairs of ``CONCURRENTLY`` statements instead of
+            being executed, see :meth:`SchemaDiff.index_statements_with_cleanup`.
+            The caller has to run them one by one outside of a transaction and to
+            call :meth:`write_current` once the migration is committed.
+        Returns
+        --------
+        bool
+            Whether the migration was run.
         """
 
         directory = Path(directory) / cls.__tablename__
@@ -643,12 +1008,22 @@ class Table(metaclass=TableMeta):
             return False
 
         async with MaybeAcquire(connection, pool=cls._pool) as con:
-            sql = diff.to_sql(downgrade=downgrade)
+            sql = diff.to_sql(downgrade=downgrade, table_indexes=deferred is None)
             if verbose:
                 print(sql)
-            await con.execute(sql)
+            if sql:
+                await con.execute(sql)
 
-        current = directory.with_name('current-' + p.name)
+        if deferred is not None:
+            deferred.extend(diff.index_statements_with_cleanup(downgrade=downgrade, concurrently=True))
+        else:
+            cls.write_current(directory=directory.parent)
+        return True
+
+    @classmethod
+    def write_current(cls, *, directory='migrations'):
+        """Records the table's current schema as the one in the database."""
+        current = Path(directory) / f'current-{cls.__tablename__}.json'
         with current.open('w', encoding='utf-8') as fp:
             json.dump(cls.to_dict(), fp, indent=4, ensure_ascii=True)
 
@@ -691,6 +1066,9 @@ class Table(metaclass=TableMeta):
                     print(sql)
                 await con.execute(sql)
 
+                if cls.__partition_key__ is not None:
+                    await cls.ensure_partitions(verbose=verbose, connection=con)
+
             # since that step passed, let's go ahead and make the migration
             with p.open('w', encoding='utf-8') as fp:
                 data = {'table': table_data, 'migrations': []}
@@ -796,17 +1174,31 @@ class Table(metaclass=TableMeta):
             if col.primary_key:
                 primary_keys.append(col.name)
 
+        partition_key = cls.__partition_key__
         if primary_keys:
+            # The primary key of a partitioned table has to include the partition key.
+            if partition_key is not None and partition_key not in primary_keys:
+                primary_keys.append(partition_key)
             column_creations.append(f'PRIMARY KEY ({", ".join(primary_keys)})')
         builder.append(f'({", ".join(column_creations)})')
+        if partition_key is not None:
+            builder.append(f'PARTITION BY RANGE ({partition_key})')
         statements.append(' '.join(builder) + ';')
 
+        if partition_key is not None:
+            # Catches rows no monthly partition exists for yet.
+            statements.append(f'CREATE TABLE IF NOT EXISTS {cls.__tablename__}_default '
+                              f'PARTITION OF {cls.__tablename__} DEFAULT;')
+
         # handle the index creations
         for column in cls.columns:
             if column.index:
                 fmt = f'CREATE INDEX IF NOT EXISTS {column.index_name} ON {cls.__tablename__} ({column.name});'
                 statements.append(fmt)
 
+        for index in cls.indexes:
+            statements.append(index._create_index(cls.__tablename__))
+
         return '\n'.join(statements)
 
     @classmethod
@@ -830,12 +1222,167 @@ class Table(metaclass=TableMeta):
 
             verified[column.name] = value
 
-        sql = 'INSERT INTO {0} ({1}) VALUES ({2});'.format(cls.__tablename__, ', '.join(verified),
-                                                           ', '.join('$' + str(i) for i, _ in enumerate(verified, 1)))
+        key = tuple(verified)
+        try:
+            sql = cls._insert_queries[key]
+        except KeyError:
+            sql = 'INSERT INTO {0} ({1}) VALUES ({2});'.format(cls.__tablename__, ', '.join(key),
+                                                               ', '.join('$' + str(i) for i, _ in enumerate(key, 1)))
+            cls._insert_queries[key] = sql
 
         async with MaybeAcquire(connection, pool=cls._pool) as con:
             await con.execute(sql, *verified.values())
 
+    @classmethod
+    def partition_name(cls, month):
+        return f'{cls.__tablename__}_y{month.year}m{month.month:02}'
+
+    @classmethod
+    async def partitions(cls, *, connection=None):
+        """Returns the monthly partitions as a sorted list of ``(name, first day of the month)``."""
+        query = """SELECT c.relname
+                   FROM pg_inherits i
+                   INNER JOIN pg_class c ON c.oid = i.inhrelid
+                   WHERE i.inhparent = to_regclass($1)
+                """
+
+        pattern = re.compile(rf'{re.escape(cls.__tablename__)}_y(\d{{4}})m(\d{{2}})')
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            records = await con.fetch(query, cls.__tablename__)
+
+        result = []
+        for name, in records:
+            match = pattern.fullmatch(name)
+            if match is not None:
+                result.append((name, datetime.date(int(match[1]), int(match[2]), 1)))
+
+        result.sort(key=lambda t: t[1])
+        return result
+
+    @classmethod
+    async def ensure_partitions(cls, *, start=None, ahead=2, verbose=False, connection=None):
+        """Creates the monthly partitions from ``start`` up to ``ahead`` months from now.
+        Returns the names of the partitions which were created.
+        """
+        if cls.__partition_key__ is None:
+            raise RuntimeError(f'{cls.__tablename__} is not partitioned.')
+
+        current = _month_start(datetime.datetime.utcnow())
+        month = _month_start(start) if start is not None else current
+        end = _add_months(current, ahead)
+
+        created = []
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            existing = {name for name, _ in await cls.partitions(connection=con)}
+            while month <= end:
+                name = cls.partition_name(month)
+                if name not in existing:
+                    sql = f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {cls.__tablename__} " \
+                          f"FOR VALUES FROM ('{month}') TO ('{_add_months(month, 1)}');"
+                    if verbose:
+                        print(sql)
+                    await con.execute(sql)
+                    created.append(name)
+                month = _add_months(month, 1)
+
+        return created
+
+    @classmethod
+    async def detach_partitions(cls, *, keep=12, archive=None, verbose=False, connection=None):
+        """Removes the partitions older than ``keep`` months.
+        If ``archive`` is given, every partition is exported to a gzipped CSV file in
+        that directory first and only removed once the export succeeded.
+        Returns a list of ``(name, path)`` with ``path`` being ``None`` if nothing was exported.
+        """
+        cutoff = _add_months(_month_start(datetime.datetime.utcnow()), -keep)
+        table = cls.__tablename__
+        removed = []
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            for name, month in await cls.partitions(connection=con):
+                if month >= cutoff:
+                    break
+
+                path = None
+                if archive is not None:
+                    directory = Path(archive)
+                    directory.mkdir(parents=True, exist_ok=True)
+                    path = directory / f'{name}.csv.gz'
+                    temp_file = path.with_name(f'{uuid.uuid4()}-{path.name}.tmp')
+                    with gzip.open(temp_file, 'wb') as fp:
+                        await con.copy_from_table(name, output=fp, format='csv', header=True)
+                    temp_file.replace(path)
+
+                sql = f'ALTER TABLE {table} DETACH PARTITION {name};\nDROP TABLE {name};'
+                if verbose:
+                    print(sql)
+                async with con.transaction():
+                    await con.execute(sql)
+
+                removed.append((name, path))
+
+        return removed
+
+    @classmethod
+    async def convert_to_partitioned(cls, *, ahead=2, verbose=False, connection=None):
+        """Moves an existing, unpartitioned table's rows into a freshly created partitioned one.
+        This locks the table while it's running, so it's meant to be done while the bot is offline.
+        Returns ``False`` if the table was already partitioned.
+        """
+        if cls.__partition_key__ is None:
+            raise RuntimeError(f'{cls.__tablename__} is not declared as partitioned.')
+
+        table = cls.__tablename__
+        legacy = f'{table}_unpartitioned'
+        key = cls.__partition_key__
+        columns = ', '.join(column.name for column in cls.columns)
+        serials = [column.name for column in cls.columns
+                   if isinstance(column.column_type, Integer) and column.column_type.auto_increment]
+
+        async with MaybeAcquire(connection, pool=cls._pool) as con:
+            query = "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass($1)"
+            partitioned = await con.fetchval(query, table)
+            if partitioned is None:
+                raise RuntimeError(f'{table} does not exist.')
+            if partitioned:
+                return False
+
+            async with con.transaction():
+                # Move the old table out of the way, the new one re-uses the names of its indexes and sequences.
+                statements = [f'ALTER TABLE {table} RENAME TO {legacy};',
+                              f'ALTER TABLE {legacy} DROP CONSTRAINT IF EXISTS {table}_pkey;']
+
+                query = "SELECT indexname FROM pg_indexes WHERE tablename = $1 AND indexname <> $2"
+                for index, in await con.fetch(query, table, f'{table}_pkey'):
+                    statements.append(f'DROP INDEX IF EXISTS {index};')
+
+                for column in serials:
+                    sequence = await con.fetchval('SELECT pg_get_serial_sequence($1, $2)', table, column)
+                    if sequence is not None:
+                        statements.append(f'ALTER SEQUENCE {sequence} RENAME TO {legacy}_{column}_seq;')
+
+                statements.append(cls.create_table(exists_ok=False))
+                sql = '\n'.join(statements)
+                if verbose:
+                    print(sql)
+                await con.execute(sql)
+
+                start = await con.fetchval(f'SELECT min({key}) FROM {legacy}')
+                await cls.ensure_partitions(start=start, ahead=ahead, verbose=verbose, connection=con)
+
+                statements = [f'INSERT INTO {table} ({columns}) SELECT {columns} FROM {legacy};']
+                for column in serials:
+                    statements.append(f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'), max({column})) "
+                                      f"FROM {legacy} HAVING max({column}) IS NOT NULL;")
+                statements.append(f'DROP TABLE {legacy};')
+
+                sql = '\n'.join(statements)
+                if verbose:
+                    print(sql)
+                await con.execute(sql)
+
+        return True
+
     @classmethod
     def to_dict(cls):
         return {
@@ -843,7 +1390,9 @@ class Table(metaclass=TableMeta):
             '__meta__': cls.__module__ + '.' + cls.__qualname__,
             # nb: columns is ordered due to the ordered dict usage
             #     this is used to help detect renames
-            'columns': [col._to_dict() for col in cls.columns]
+            'columns': [col._to_dict() for col in cls.columns],
+            'indexes': [index._to_dict() for index in cls.indexes],
+            'partition_by': cls.__partition_key__
         }
 
     @classmethod
@@ -858,6 +1407,9 @@ class Table(metaclass=TableMeta):
         self = cls()
         self.__tablename__ = data['name']
         self.columns = [Column.from_dict(a) for a in data['columns']]
+        # Older data files don't know about table-level indexes.
+        self.indexes = [Index.from_dict(a) for a in data.get('indexes', [])]
+        self.__partition_key__ = data.get('partition_by')
         return self
 
     @classmethod
@@ -889,6 +1441,12 @@ class Table(metaclass=TableMeta):
         add_index:
             name: str [The column name]
             index: str [The index name]
+        drop_table_indexes:
+            index: object
+        add_table_indexes:
+            index: object
+        execute:
+            str [An SQL statement to run after the columns changed]
         changed_constraints:
             name: str [The column name]
             before:
@@ -991,6 +1549,10 @@ class Table(metaclass=TableMeta):
                     upgrade.setdefault('add_index', []).append({'name': column.name, 'index': column.index_name})
                     downgrade.setdefault('drop_index', []).append({'name': column.name, 'index': column.index_name})
 
+            backfill = [f'{column.name} = {column.backfill}' for column in new_columns if column.backfill is not None]
+            if backfill:
+                upgrade.setdefault('execute', []).append(f'UPDATE {self.__tablename__} SET {", ".join(backfill)};')
+
         elif len(self.columns) < len(before.columns):
             # check if we have fewer columns
             # this one is a little bit more complicated
@@ -1010,6 +1572,20 @@ class Table(metaclass=TableMeta):
             upgrade.setdefault('remove_columns', []).extend(removed)
             downgrade.setdefault('add_columns', []).extend(removed)
 
+        # Table-level indexes are matched by name, a changed definition means drop and re-create.
+        before_indexes = {index.name: index._to_dict() for index in before.indexes}
+        after_indexes = {index.name: index._to_dict() for index in self.indexes}
+
+        for name, as_dict in before_indexes.items():
+            if after_indexes.get(name) != as_dict:
+                upgrade.setdefault('drop_table_indexes', []).append(as_dict)
+                downgrade.setdefault('add_table_indexes', []).append(as_dict)
+
+        for name, as_dict in after_indexes.items():
+            if before_indexes.get(name) != as_dict:
+                upgrade.setdefault('add_table_indexes', []).append(as_dict)
+                downgrade.setdefault('drop_table_indexes', []).append(as_dict)
+
         return SchemaDiff(self, upgrade, downgrade)
 
 
@@ -0,0 +1,288 @@
+"""
+Runs bulk moderation actions, like banning everyone who took part in a raid.
+
+Actions are queued on the bot rather than a cog, so jobs keep running through
+cog reloads. How many actions run at once adapts to Discord's rate limits:
+it grows slowly while requests go through and halves whenever discord.py
+logs that it was rate limited. The same action requested twice, e.g. a
+spammer being banned for every message they sent, only runs once.
+"""
+
+import asyncio
+import logging
+import time
+
+import discord
+
+from cogs.utils.metrics import rate_limits
+
+log = logging.getLogger(__name__)
+
+
+class Action:
+    """Something to do to a single target. Actions with the same key are the same."""
+
+    __slots__ = ('guild_id', 'target_id')
+    kind = None
+
+    def __init__(self, guild_id, target_id):
+        self.guild_id = guild_id
+        self.target_id = target_id
+
+    @property
+    def key(self):
+        return self.kind, self.guild_id, self.target_id
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} guild_id={self.guild_id} target_id={self.target_id}>'
+
+    async def run(self):
+        raise NotImplementedError
+
+
+class Ban(Action):
+    __slots__ = ('guild', 'user', 'reason', 'delete_message_days')
+    kind = 'ban'
+
+    def __init__(self, guild, user, *, reason=None, delete_message_days=1):
+        super().__init__(guild.id, user.id)
+        self.guild = guild
+        self.user = user
+        self.reason = reason
+        self.delete_message_days = delete_message_days
+
+    async def run(self):
+        await self.guild.ban(self.user, reason=self.reason, delete_message_days=self.delete_message_days)
+
+
+class Kick(Action):
+    __slots__ = ('guild', 'user', 'reason')
+    kind = 'kick'
+
+    def __init__(self, guild, user, *, reason=None):
+        super().__init__(guild.id, user.id)
+        self.guild = guild
+        self.user = user
+        self.reason = reason
+
+    async def run(self):
+        await self.guild.kick(self.user, reason=self.reason)
+
+
+class EditRoles(Action):
+    __slots__ = ('member', 'add', 'remove', 'reason')
+    kind = 'roles'
+
+    def __init__(self, member, *, add=(), remove=(), reason=None):
+        super().__init__(member.guild.id, member.id)
+        self.member = member
+        self.add = tuple(add)
+        self.remove = tuple(remove)
+        self.reason = reason
+
+    @property
+    def key(self):
+        # Different role changes for the same member are different actions.
+        return (self.kind, self.guild_id, self.target_id, frozenset(r.id for r in self.add),
+                frozenset(r.id for r in self.remove))
+
+    async def run(self):
+        roles = [r for r in self.member.roles if r not in self.remove and not r.is_default()]
+        roles.extend(r for r in self.add if r not in roles)
+        await self.member.edit(roles=roles, reason=self.reason)
+
+
+class ClearReactions(Action):
+    __slots__ = ('message',)
+    kind = 'reactions'
+
+    def __init__(self, message):
+        super().__init__(getattr(message.guild, 'id', None), message.id)
+        self.message = message
+
+    async def run(self):
+        await self.message.clear_reactions()
+
+
+def _error(future):
+    # Actions cancelled by ModerationExecutor.close() count as failed.
+    if future.cancelled():
+        return asyncio.CancelledError()
+    return future.result()
+
+
+class Job:
+    """A batch of actions, with a status message that's kept up to date while it runs."""
+
+    def __init__(self, executor, title, futures, *, channel=None, update_every=3.0):
+        self.executor = executor
+        self.title = title
+        self.futures = futures
+        self.channel = channel
+        self.update_every = update_every
+        self.started = time.monotonic()
+        self.message = None
+        self._reporter = executor.loop.create_task(self._report()) if channel is not None else None
+
+    @property
+    def total(self):
+        return len(self.futures)
+
+    @property
+    def done(self):
+        return sum(f.done() for f in self.futures)
+
+    @property
+    def failed(self):
+        return sum(f.done() and _error(f) is not None for f in self.futures)
+
+    @property
+    def succeeded(self):
+        return self.done - self.failed
+
+    def status(self):
+        elapsed = time.monotonic() - self.started
+        fmt = f'**{self.title}**: {self.succeeded}/{self.total} done'
+        if self.failed:
+            fmt = f'{fmt}, {self.failed} failed'
+        if self.done < self.total:
+            return f'{fmt} ({elapsed:.0f}s, {self.executor.limit} at a time)...'
+        return f'{fmt} in {elapsed:.1f}s.'
+
+    async def _report(self):
+        try:
+            self.message = await self.channel.send(self.status())
+        except discord.HTTPException:
+            return
+
+        pending = set(self.futures)
+        while pending:
+            _, pending = await asyncio.wait(pending, timeout=self.update_every)
+            try:
+                await self.message.edit(content=self.status())
+            except discord.HTTPException:
+                return
+
+    async def wait(self):
+        """Waits until every action ran. Returns ``(action, error)`` pairs, the error being ``None`` on success.
+        Actions which were cancelled because the executor closed have a :exc:`asyncio.CancelledError`.
+        """
+        if self.futures:
+            await asyncio.wait(self.futures)
+        if self._reporter is not None:
+            await self._reporter
+        return [(f.action, _error(f)) for f in self.futures]
+
+
+class ModerationExecutor:
+    """Runs :class:`Action` objects with a concurrency that adapts to rate limits.
+
+    Parameters
+    -----------
+    initial: int
+        How many actions run at once to begin with.
+    minimum: int
+        How many actions run at once after being rate limited repeatedly.
+    maximum: int
+        How many actions run at once at most.
+    """
+
+    def __init__(self, *, loop=None, initial=4, minimum=1, maximum=16):
+        self.loop = loop or asyncio.get_event_loop()
+        self.minimum = minimum
+        self.maximum = maximum
+        self._limit = float(initial)
+        self._active = 0
+        self._slots = asyncio.Condition(loop=self.loop)
+        self._queue = asyncio.Queue(loop=self.loop)
+        # Action key -> future of the queued or running action.
+        self._pending = {}
+        self._workers = []
+        self.rate_limits = 0
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def __contains__(self, action):
+        return action.key in self._pending
+
+    def on_rate_limit(self, scope=None):
+        self.rate_limits += 1
+        self._limit = max(self.minimum, self._limit / 2)
+        log.info(f'Rate limited, running {self.limit} moderation actions at a time.')
+
+    def _on_success(self):
+        # Grows by one for every limit's worth of successful actions.
+        self._limit = min(self.maximum, self._limit + 1 / self._limit)
+
+    def _start(self):
+        if self._workers:
+            return
+
+        rate_limits.subscribe(self.on_rate_limit)
+        self._workers = [self.loop.create_task(self._work()) for _ in range(self.maximum)]
+
+    async def _work(self):
+        while True:
+            action, future = await self._queue.get()
+            async with self._slots:
+                await self._slots.wait_for(lambda: self._active < self.limit)
+                self._active += 1
+
+            try:
+                await action.run()
+            except discord.HTTPException as e:
+                future.set_result(e)
+            except Exception as e:
+                log.exception(f'Moderation action {action!r} failed.')
+                future.set_result(e)
+            else:
+                self._on_success()
+                future.set_result(None)
+            finally:
+                self._pending.pop(action.key, None)
+                self._queue.task_done()
+                async with self._slots:
+                    self._active -= 1
+                    self._slots.notify_all()
+
+    def _enqueue(self, action):
+        try:
+            return self._pending[action.key]
+        except KeyError:
+            pass
+
+        future = self.loop.create_future()
+        future.action = action
+        self._pending[action.key] = future
+        self._queue.put_nowait((action, future))
+        return future
+
+    def submit(self, actions, *, title=None, channel=None):
+        """Queues actions and returns their :class:`Job`.
+        If a channel is given, the job's progress is shown in a message there.
+        Actions which are already queued aren't queued again, the job waits for them instead.
+        """
+        self._start()
+        futures = [self._enqueue(action) for action in actions]
+        return Job(self, title or f'{len(futures)} moderation actions', futures, channel=channel)
+
+    async def run(self, action):
+        """Queues a single action and waits for it. Returns the error if it failed."""
+        (_, error), = await self.submit([action]).wait()
+        return error
+
+    async def close(self):
+        rate_limits.unsubscribe(self.on_rate_limit)
+        for worker in self._workers:
+            worker.cancel()
+        self._workers = []
+
+        for future in self._pending.values():
+            future.cancel()
+        self._pending.clear()
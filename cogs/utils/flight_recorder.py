@@ -0,0 +1,102 @@
+"""
+Keeps the most recent gateway payloads around for post-mortem debugging.
+
+Payloads are serialized as soon as they're received, so the recorder holds
+compact bytes instead of references to dicts discord.py might still mutate.
+Memory is bounded by both the number of payloads and their total size.
+Dumps are gzipped newline-delimited JSON, one ``{"ts": ..., "payload": ...}`` per line.
+"""
+
+import asyncio
+import datetime
+import gzip
+import logging
+import time
+from collections import deque
+from pathlib import Path
+
+from cogs.utils.jsonb import get_backend
+
+log = logging.getLogger(__name__)
+
+
+class FlightRecorder:
+    """A ring buffer of serialized gateway payloads.
+
+    Parameters
+    -----------
+    max_events: int
+        How many payloads are kept.
+    max_bytes: int
+        How many bytes of serialized payloads are kept.
+    max_payload: int
+        Payloads larger than this, e.g. GUILD_CREATE, are only kept as a summary.
+    directory: str
+        Where dumps are written to.
+    json_backend: Optional[str]
+        The JSON library payloads are serialized with, see :func:`cogs.utils.jsonb.get_backend`.
+    """
+
+    def __init__(self, *, max_events=5000, max_bytes=8 * 1024 ** 2, max_payload=64 * 1024,
+                 directory='flight_recorder', json_backend=None):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.max_payload = max_payload
+        self.directory = Path(directory)
+        self.size = 0
+        self._events = deque()
+        self._dumps = get_backend(json_backend).dumps
+
+    def __len__(self):
+        return len(self._events)
+
+    def _summary(self, payload, **extra):
+        return self._dumps({'op': payload.get('op'), 't': payload.get('t'), 's': payload.get('s'), **extra})
+
+    def record(self, payload):
+        try:
+            data = self._dumps(payload)
+        except Exception:
+            data = self._summary(payload, unserializable=True)
+
+        if len(data) > self.max_payload:
+            data = self._summary(payload, truncated=len(data))
+
+        events = self._events
+        events.append((time.time(), data))
+        self.size += len(data)
+        while self.size > self.max_bytes or len(events) > self.max_events:
+            self.size -= len(events.popleft()[1])
+
+    def clear(self):
+        self._events.clear()
+        self.size = 0
+
+    def _path(self, reason):
+        now = datetime.datetime.utcnow()
+        return self.directory / f'events-{now:%Y%m%d-%H%M%S}-{reason}.ndjson.gz'
+
+    @staticmethod
+    def _write(path, events):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(path, 'wb', compresslevel=6) as fp:
+            for timestamp, data in events:
+                fp.write(b'{"ts":%.6f,"payload":%s}\n' % (timestamp, data))
+
+    def dump(self, reason='manual'):
+        """Writes the recorded payloads to a new file and returns its path.
+        This blocks, use :meth:`save` while the event loop is running.
+        """
+        path = self._path(reason)
+        self._write(path, list(self._events))
+        log.info(f'Dumped {len(self._events)} gateway payloads to {path}.')
+        return path
+
+    async def save(self, reason='manual'):
+        """Like :meth:`dump`, but the file is written in a thread."""
+        # Copying the references is quick, the payloads themselves are immutable.
+        events = list(self._events)
+        path = self._path(reason)
+        await asyncio.get_event_loop().run_in_executor(None, self._write, path, events)
+        log.info(f'Dumped {len(events)} gateway payloads to {path}.')
+        return path
@@ -0,0 +1,101 @@
+"""
+Encoding and decoding of jsonb values for asyncpg.
+
+The fastest JSON library that's installed is used, the standard library is the fallback.
+Values are sent in jsonb's binary format, which is the JSON text prefixed with a version byte.
+"""
+
+import json
+from collections import namedtuple
+
+JSONB_VERSION = 1
+_VERSION_PREFIX = bytes((JSONB_VERSION,))
+
+Backend = namedtuple('Backend', 'name dumps loads')
+
+
+def _stdlib():
+    def dumps(value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    return Backend('json', dumps, json.loads)
+
+
+def _orjson():
+    import orjson
+    # orjson already produces compact UTF-8.
+    return Backend('orjson', orjson.dumps, orjson.loads)
+
+
+def _ujson():
+    import ujson
+
+    def dumps(value):
+        return ujson.dumps(value).encode('utf-8')
+
+    return Backend('ujson', dumps, ujson.loads)
+
+
+# In order of preference.
+_factories = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'json': _stdlib,
+}
+
+
+def register_backend(name, dumps, loads):
+    """Makes a JSON library available to :func:`get_backend`.
+    ``dumps`` has to return UTF-8 encoded bytes.
+    """
+    backend = Backend(name, dumps, loads)
+    _factories[name] = lambda: backend
+
+
+def get_backend(name=None):
+    """Returns the backend called ``name``, or the first installed one if no name is given."""
+    if name is not None:
+        try:
+            return _factories[name]()
+        except KeyError:
+            raise ValueError(f'Unknown JSON backend {name!r}.') from None
+
+    for factory in _factories.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+    return _stdlib()
+
+
+class JSONBCodec:
+    """The encoder and decoder passed to :meth:`asyncpg.Connection.set_type_codec`."""
+
+    __slots__ = ('backend', 'format')
+
+    def __init__(self, backend=None, *, binary=True):
+        self.backend = backend or get_backend()
+        self.format = 'binary' if binary else 'text'
+
+    def __repr__(self):
+        return f'<JSONBCodec backend={self.backend.name!r} format={self.format!r}>'
+
+    def encode(self, value):
+        data = self.backend.dumps(value)
+        if self.format == 'binary':
+            return _VERSION_PREFIX + data
+        return data.decode('utf-8')
+
+    def decode(self, data):
+        if self.format == 'text':
+            return self.backend.loads(data)
+
+        if data[0] != JSONB_VERSION:
+            raise ValueError(f'Unsupported jsonb version {data[0]}.')
+
+        return self.backend.loads(data[1:])
+
+    async def register(self, con):
+        await con.set_type_codec('jsonb', schema='pg_catalog', encoder=self.encode, decoder=self.decode,
+                                 format=self.format)
@@ -0,0 +1,104 @@
+"""
+Leader election between bot processes, using a PostgreSQL advisory lock.
+
+Background jobs which must only run once, no matter how many bot processes
+are running, e.g. during a rolling deploy, only run in the leader. The lock
+is held by a dedicated connection. Other processes block on it, so one of
+them takes over as soon as the leader's session ends.
+"""
+
+import asyncio
+import hashlib
+import logging
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# Errors after which the connection is given up and a new one is made.
+CONNECTION_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError,
+                     asyncpg.InterfaceError)
+
+# Lets the server notice a leader which vanished without closing its connection within half a minute,
+# which ends its session and hands the lock to the next process.
+KEEPALIVE_SETTINGS = {
+    'tcp_keepalives_idle': '10',
+    'tcp_keepalives_interval': '5',
+    'tcp_keepalives_count': '3',
+}
+
+
+def lock_key(name):
+    """Returns the 64 bit advisory lock key for a name."""
+    return int.from_bytes(hashlib.blake2b(name.encode(), digest_size=8).digest(), 'big', signed=True)
+
+
+class LeaderElection:
+    """Keeps trying to become the leader, and stays it for as long as its connection lives.
+
+    Parameters
+    -----------
+    name: str
+        What the lock is called. Processes using the same name elect one leader.
+    check_interval: float
+        How often the leader makes sure its connection is still alive, in seconds.
+    retry: float
+        How long to wait before connecting again after the connection failed.
+    """
+
+    def __init__(self, name, *, loop=None, check_interval=5.0, retry=5.0):
+        self.name = name
+        self.key = lock_key(name)
+        self.loop = loop or asyncio.get_event_loop()
+        self.check_interval = check_interval
+        self.retry = retry
+        self._elected = asyncio.Event(loop=self.loop)
+        self._task = None
+
+    @property
+    def is_leader(self):
+        return self._elected.is_set()
+
+    async def wait(self):
+        """Waits until this process is the leader."""
+        await self._elected.wait()
+
+    def start(self, dsn, **connect_kwargs):
+        if self._task is None:
+            self._task = self.loop.create_task(self._run(dsn, connect_kwargs))
+
+    async def _run(self, dsn, connect_kwargs):
+        settings = {**KEEPALIVE_SETTINGS, **connect_kwargs.pop('server_settings', {})}
+        while True:
+            try:
+                con = await asyncpg.connect(dsn, server_settings=settings, **connect_kwargs)
+            except CONNECTION_ERRORS as e:
+                log.warning(f'Could not connect for leader election of {self.name!r}: {e}')
+                await asyncio.sleep(self.retry)
+                continue
+
+            try:
+                # Blocks until whoever is the leader right now goes away.
+                await con.execute('SELECT pg_advisory_lock($1);', self.key)
+                self._elected.set()
+                log.info(f'Became the leader for {self.name!r}.')
+
+                while True:
+                    await asyncio.sleep(self.check_interval)
+                    await asyncio.wait_for(con.fetchval('SELECT 1;'), timeout=self.check_interval)
+            except CONNECTION_ERRORS as e:
+                log.warning(f'Lost the connection for leader election of {self.name!r}: {e}')
+            finally:
+                if self.is_leader:
+                    self._elected.clear()
+                    log.info(f'Stopped being the leader for {self.name!r}.')
+                # Ends the session, which releases the lock if we held it.
+                con.terminate()
+
+            await asyncio.sleep(self.retry)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._elected.clear()
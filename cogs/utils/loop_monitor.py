@@ -0,0 +1,130 @@
+"""
+Detects when the event loop is blocked.
+
+A heartbeat task measures how late the loop runs it. A watchdog thread
+notices when the heartbeat stops and samples the loop thread's stack while
+it's still stuck, so the blocking code shows up in the report. This only
+relies on threads and ``sys._current_frames``, so it works with uvloop too.
+"""
+
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque, namedtuple
+
+from cogs.utils import metrics
+
+log = logging.getLogger(__name__)
+
+LOOP_STALLS = metrics.counter('bot_event_loop_stalls_total', 'Times the event loop was blocked for too long.')
+LOOP_LAG_SECONDS = metrics.histogram('bot_event_loop_lag_distribution_seconds', 'How late the heartbeat ran.',
+                                     buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+# timestamp: When the stall was detected.
+# duration: How long the loop was blocked, as far as the heartbeat could tell.
+# task: What was running, e.g. the event and listener.
+# stack: The loop thread's stack, innermost frame last.
+Stall = namedtuple('Stall', 'timestamp duration task stack')
+
+
+def describe_task(task):
+    if task is None:
+        return 'a callback outside of any task'
+
+    # discord.py's _ClientEventTask knows the listener it's running.
+    event = getattr(task, '_ClientEventTask__event_name', None)
+    coro = getattr(task, '_ClientEventTask__original_coro', None) or task.get_coro()
+    name = getattr(coro, '__qualname__', repr(coro))
+    if event is not None:
+        return f'{name} ({event})'
+    return name
+
+
+class LoopMonitor:
+    """Keeps track of event-loop lag and remembers recent stalls.
+
+    Parameters
+    -----------
+    interval: float
+        How often the heartbeat runs, in seconds.
+    threshold: float
+        How long the loop has to be blocked for to count as a stall.
+    history: int
+        How many stalls are kept.
+    """
+
+    def __init__(self, loop, *, interval=0.1, threshold=0.25, history=50, stack_depth=12):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.stack_depth = stack_depth
+        self.stalls = deque(maxlen=history)
+        self.lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread = None
+        # A stall the watchdog saw, which the heartbeat completes once the loop runs again.
+        self._pending = None
+        self._heartbeat = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    async def _beat(self):
+        self._loop_thread = threading.get_ident()
+        while True:
+            before = time.monotonic()
+            self._last_beat = before
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+
+            self.lag = max(0.0, now - before - self.interval)
+            metrics.LOOP_LAG.set(self.lag)
+            LOOP_LAG_SECONDS.observe(self.lag)
+
+            pending, self._pending = self._pending, None
+            if pending is not None:
+                stall = pending._replace(duration=self.lag)
+                self.stalls.append(stall)
+                LOOP_STALLS.inc()
+                where = stall.stack[-1].strip().splitlines()[0] if stall.stack else 'unknown'
+                log.warning(f'Event loop was blocked for {stall.duration:.3f}s by {stall.task} at {where}')
+
+    def _sample(self):
+        frame = sys._current_frames().get(self._loop_thread)
+        stack = traceback.format_stack(frame, limit=self.stack_depth) if frame is not None else []
+        try:
+            task = asyncio.current_task(self.loop)
+        except RuntimeError:
+            task = None
+        return Stall(time.time(), None, describe_task(task), stack)
+
+    def _watch(self):
+        check_every = self.threshold / 2
+        while not self._stopped.wait(check_every):
+            if self._pending is not None or self._loop_thread is None:
+                continue
+
+            if time.monotonic() - self._last_beat - self.interval >= self.threshold:
+                try:
+                    self._pending = self._sample()
+                except Exception:
+                    log.exception('Failed to sample the blocked event loop.')
+
+    def start(self):
+        if self._heartbeat is not None:
+            return
+
+        self._stopped.clear()
+        self._heartbeat = self.loop.create_task(self._beat())
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            self._heartbeat = None
+        self._watchdog = None
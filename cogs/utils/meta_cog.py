@@ -1,6 +1,9 @@
+import inspect
+
 from discord.ext import commands
 
 from bot import FiresideBot
+from cogs.utils import profiling
 
 
 class Cog(commands.Cog):
@@ -15,6 +18,21 @@ class Cog(commands.Cog):
         """
         return self._bot
 
+    @classmethod
+    def listener(cls, name=None):
+        """Like :meth:`commands.Cog.listener`, but the listener's timings are
+        recorded per guild, see :mod:`cogs.utils.profiling`.
+        """
+        register = super().listener(name)
+
+        def decorator(func):
+            # Let discord.py complain about anything that isn't a plain coroutine function.
+            if inspect.iscoroutinefunction(func):
+                func = profiling.timed_listener(func, name or func.__name__)
+            return register(func)
+
+        return decorator
+
     @classmethod
     def setup(cls, bot: FiresideBot):
         bot.add_cog(cls(bot))
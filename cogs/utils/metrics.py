@@ -0,0 +1,299 @@
+"""
+Metrics in the Prometheus text format, served over HTTP on localhost.
+
+Cogs create metrics through :func:`counter`, :func:`gauge` and :func:`histogram`,
+which return the already existing metric when called again, e.g. after a reload.
+Values which are cheaper to read when scraped are provided through collectors,
+see :meth:`Registry.register_collector`.
+"""
+
+import bisect
+import logging
+import math
+
+from aiohttp import web
+
+log = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labels)
+        self._children = {}
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects the labels {self.labelnames}.')
+
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self._children[values] = self._new_child()
+            return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self):
+        """Yields ``(suffix, labels, value)`` for every sample."""
+        for values, child in self._children.items():
+            yield '', tuple(zip(self.labelnames, values)), child.value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self._samples():
+            lines.append(f'{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}')
+        return lines
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def dec(self, amount=1):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), *, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in self._children.items():
+            labels = tuple(zip(self.labelnames, values))
+            cumulative = 0
+            for bound, count in zip((*self.buckets, math.inf), child.counts):
+                cumulative += count
+                yield '_bucket', labels + (('le', _format_value(bound)),), cumulative
+            yield '_sum', labels, child.sum
+            yield '_count', labels, child.count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}
+
+    def _get_or_create(self, cls, name, documentation, labels, **kwargs):
+        try:
+            metric = self._metrics[name]
+        except KeyError:
+            metric = self._metrics[name] = cls(name, documentation, labels, **kwargs)
+            return metric
+
+        if type(metric) is not cls or metric.labelnames != tuple(labels):
+            raise ValueError(f'{name} is already registered as a different metric.')
+        return metric
+
+    def register_collector(self, name, collector):
+        """Registers a callable which is called on every scrape.
+        It returns an iterable of ``(name, type, documentation, samples)`` with
+        samples being a list of ``(labels dict, value)``.
+        Registering another collector under the same name replaces it.
+        """
+        self._collectors[name] = collector
+
+    def unregister_collector(self, name):
+        self._collectors.pop(name, None)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+
+        for collector_name, collector in list(self._collectors.items()):
+            try:
+                families = list(collector())
+            except Exception:
+                log.exception(f'Metrics collector {collector_name} failed.')
+                continue
+
+            for name, type_, documentation, samples in families:
+                lines.append(f'# HELP {name} {_escape(documentation)}')
+                lines.append(f'# TYPE {name} {type_}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(tuple(labels.items()))} {_format_value(value)}')
+
+        lines.append('')
+        return '\n'.join(lines)
+
+
+registry = Registry()
+
+
+def counter(name, documentation, labels=()):
+    return registry._get_or_create(Counter, name, documentation, labels)
+
+
+def gauge(name, documentation, labels=()):
+    return registry._get_or_create(Gauge, name, documentation, labels)
+
+
+def histogram(name, documentation, labels=(), *, buckets=DEFAULT_BUCKETS):
+    return registry._get_or_create(Histogram, name, documentation, labels, buckets=buckets)
+
+
+RATE_LIMITS = counter('discord_http_rate_limits_total', 'Rate limits hit by the HTTP client.', ('scope',))
+# Set by the loop monitor.
+LOOP_LAG = gauge('bot_event_loop_lag_seconds', 'How late the event loop ran a scheduled callback.')
+
+
+class RateLimitHandler(logging.Handler):
+    """Tells its subscribers about the rate limits discord.py's HTTP client logs.
+    discord.py has no other way of finding out about them. Use :data:`rate_limits`,
+    it's attached to the ``discord.http`` logger while anyone is subscribed.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self._subscribers = []
+
+    def subscribe(self, callback):
+        """Calls ``callback(scope)`` for every rate limit, the scope being ``'global'`` or ``'bucket'``."""
+        if not self._subscribers:
+            logging.getLogger('discord.http').addHandler(self)
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        try:
+            self._subscribers.remove(callback)
+        except ValueError:
+            return
+
+        if not self._subscribers:
+            logging.getLogger('discord.http').removeHandler(self)
+
+    def emit(self, record):
+        message = record.msg
+        if not isinstance(message, str):
+            return
+
+        if message.startswith('Global rate limit'):
+            scope = 'global'
+        elif message.startswith('We are being rate limited'):
+            scope = 'bucket'
+        else:
+            return
+
+        for callback in list(self._subscribers):
+            callback(scope)
+
+
+rate_limits = RateLimitHandler()
+
+
+def _count_rate_limit(scope):
+    RATE_LIMITS.labels(scope).inc()
+
+
+class MetricsServer:
+    """Serves ``/metrics`` on the bot's event loop."""
+
+    def __init__(self, *, host='127.0.0.1', port, registry=registry):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._runner = None
+
+    async def handle_metrics(self, request):
+        return web.Response(body=self.registry.render().encode('utf-8'), headers={'Content-Type': CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+        rate_limits.subscribe(_count_rate_limit)
+        log.info(f'Serving metrics on http://{self.host}:{self.port}/metrics.')
+
+    async def close(self):
+        rate_limits.unsubscribe(_count_rate_limit)
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
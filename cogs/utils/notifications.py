@@ -0,0 +1,121 @@
+"""
+Receives PostgreSQL notifications on a dedicated connection.
+
+Callbacks are registered per channel and called with the payload of every
+notification sent to it, by any process. Notifications sent while the
+connection is down are lost, so whenever the connection is (re)established
+every callback is called with ``None`` instead, telling it to reload whatever
+it keeps in memory.
+"""
+
+import asyncio
+import logging
+from collections import defaultdict
+
+import asyncpg
+
+from cogs.utils.leader import CONNECTION_ERRORS, KEEPALIVE_SETTINGS
+
+log = logging.getLogger(__name__)
+
+
+class Notifications:
+    """Keeps a connection LISTENing to every channel which has callbacks, reconnecting when it's lost.
+
+    Parameters
+    -----------
+    check_interval: float
+        How often the connection is checked to still be alive, in seconds.
+    retry: float
+        How long to wait before connecting again after the connection failed.
+    """
+
+    def __init__(self, *, loop=None, check_interval=30.0, retry=5.0):
+        self.loop = loop or asyncio.get_event_loop()
+        self.check_interval = check_interval
+        self.retry = retry
+        # Channel -> callbacks.
+        self._callbacks = defaultdict(list)
+        self._connection = None
+        self._task = None
+
+    @property
+    def connected(self):
+        return self._connection is not None
+
+    def _notify(self, channel, payload):
+        for callback in self._callbacks.get(channel, ()):
+            try:
+                callback(payload)
+            except Exception:
+                log.exception(f'Notification callback for {channel!r} failed.')
+
+    def _on_notification(self, connection, pid, channel, payload):
+        self._notify(channel, payload)
+
+    async def listen(self, channel, callback):
+        """Calls ``callback(payload)`` for every notification sent to ``channel``."""
+        callbacks = self._callbacks[channel]
+        callbacks.append(callback)
+        if len(callbacks) == 1 and self._connection is not None:
+            try:
+                await self._connection.add_listener(channel, self._on_notification)
+            except CONNECTION_ERRORS:
+                # Picked up once the connection is back.
+                pass
+
+    async def unlisten(self, channel, callback):
+        callbacks = self._callbacks.get(channel, [])
+        try:
+            callbacks.remove(callback)
+        except ValueError:
+            return
+
+        if callbacks:
+            return
+
+        del self._callbacks[channel]
+        if self._connection is not None:
+            try:
+                await self._connection.remove_listener(channel, self._on_notification)
+            except CONNECTION_ERRORS:
+                pass
+
+    def start(self, dsn, **connect_kwargs):
+        if self._task is None:
+            self._task = self.loop.create_task(self._run(dsn, connect_kwargs))
+
+    async def _run(self, dsn, connect_kwargs):
+        settings = {**KEEPALIVE_SETTINGS, **connect_kwargs.pop('server_settings', {})}
+        while True:
+            try:
+                con = await asyncpg.connect(dsn, server_settings=settings, **connect_kwargs)
+            except CONNECTION_ERRORS as e:
+                log.warning(f'Could not connect to listen for notifications: {e}')
+                await asyncio.sleep(self.retry)
+                continue
+
+            try:
+                for channel in list(self._callbacks):
+                    await con.add_listener(channel, self._on_notification)
+                self._connection = con
+
+                # Anything sent before now was missed.
+                for channel in list(self._callbacks):
+                    self._notify(channel, None)
+
+                while True:
+                    await asyncio.sleep(self.check_interval)
+                    await asyncio.wait_for(con.fetchval('SELECT 1;'), timeout=self.check_interval)
+            except CONNECTION_ERRORS as e:
+                log.warning(f'Lost the connection listening for notifications: {e}')
+            finally:
+                self._connection = None
+                con.terminate()
+
+            await asyncio.sleep(self.retry)
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
@@ -22,7 +22,9 @@ class WarningPaginator(Pages):
                    WHERE guild_id = $1
                    ORDER BY created DESC"""
 
-        records = await ctx.db.fetch(query, ctx.guild.id)
+        async with ctx.replica() as con:
+            records = await con.fetch(query, ctx.guild.id)
+
         if not records:
             raise CannotPaginate("No warnings or notes found.")
 
@@ -73,21 +75,22 @@ class WarningPaginator(Pages):
                    {'LIMIT 4' if short_view else ''}"""
 
         guild = ctx.guild
-        records = await ctx.db.fetch(query, guild.id, member.id)
-        if not records:
-            raise CannotPaginate(f"No warnings or notes found for {member}.")
+        async with ctx.replica() as con:
+            records = await con.fetch(query, guild.id, member.id)
+            if not records:
+                raise CannotPaginate(f"No warnings or notes found for {member}.")
 
-        # Sort by type actual warning > note.
-        info = sorted(records, key=lambda r: not r["warning"])
+            # Get number of warnings and notes on this member.
+            query = """SELECT count(*) FILTER (WHERE NOT warning) AS note,
+                              count(*) FILTER (WHERE warning)     AS warned
+                       FROM warning_entries
+                       WHERE guild_id = $1
+                       AND member_id = $2"""
 
-        # Get number of warnings and notes on this member.
-        query = """SELECT count(*) FILTER (WHERE NOT warning) AS note,
-                          count(*) FILTER (WHERE warning)     AS warned
-                   FROM warning_entries
-                   WHERE guild_id = $1
-                   AND member_id = $2"""
+            notes, warnings = await con.fetchrow(query, guild.id, member.id)
 
-        notes, warnings = await ctx.db.fetchrow(query, guild.id, member.id)
+        # Sort by type actual warning > note.
+        info = sorted(records, key=lambda r: not r["warning"])
         self = cls(ctx, [r[0:4] + (getattr(guild.get_member(r[4]), 'name', 'Mod left'),) for r in info])
         self.title = f'Overview for {member}'
         self.should_redact = should_redact
@@ -0,0 +1,372 @@
+"""
+A connection pool that keeps track of its own health.
+
+asyncpg doesn't expose any of this, so some of the pool's internals are used here.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque, namedtuple
+
+import asyncpg
+
+from cogs.utils import tracing
+
+log = logging.getLogger(__name__)
+
+PoolSample = namedtuple('PoolSample', 'timestamp size checked_out waiters oldest_connection acquires acquire_p95')
+SlowAcquire = namedtuple('SlowAcquire', 'timestamp waited waiter holders')
+
+
+def _percentile(values, percent):
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+    return values[min(len(values) - 1, round(percent / 100 * (len(values) - 1)))]
+
+
+class PoolTelemetry:
+    """Keeps a rolling history of pool samples and slow acquires."""
+
+    def __init__(self, *, history=600, slow_history=50):
+        self.samples = deque(maxlen=history)
+        self.slow_acquires = deque(maxlen=slow_history)
+        self.total_acquires = 0
+        self.total_wait = 0.0
+        # Acquire waits since the last sample.
+        self._window = []
+
+    def record_acquire(self, waited):
+        self.total_acquires += 1
+        self.total_wait += waited
+        self._window.append(waited)
+
+    def take_sample(self, *, size, checked_out, waiters, oldest_connection):
+        window, self._window = self._window, []
+        sample = PoolSample(time.time(), size, checked_out, waiters, oldest_connection,
+                            len(window), _percentile(window, 95))
+        self.samples.append(sample)
+        return sample
+
+    def recent_acquire_p95(self, seconds=60):
+        """The highest per-sample p95 acquire wait within the last ``seconds``."""
+        cutoff = time.time() - seconds
+        return max((s.acquire_p95 for s in self.samples if s.timestamp >= cutoff), default=0.0)
+
+
+class AdaptiveSizing:
+    """Grows the pool when acquiring connections is slow for a while and shrinks it when it's mostly idle.
+    Parameters
+    -----------
+    min_size: int
+        The smallest size the pool shrinks to.
+    max_size: int
+        The largest size the pool grows to.
+    grow_above: float
+        The p95 acquire wait, in seconds, which counts as slow.
+    shrink_below: float
+        The p95 acquire wait, in seconds, which counts as idle.
+    grow_after: int
+        How many slow samples in a row it takes to grow.
+    shrink_after: int
+        How many idle samples in a row it takes to shrink.
+    """
+
+    def __init__(self, min_size, max_size, *, grow_above=0.05, shrink_below=0.005, grow_after=5, shrink_after=120):
+        if min_size > max_size:
+            raise ValueError('min_size is greater than max_size')
+
+        self.min_size = min_size
+        self.max_size = max_size
+        self.grow_above = grow_above
+        self.shrink_below = shrink_below
+        self.grow_after = grow_after
+        self.shrink_after = shrink_after
+        self._slow = 0
+        self._idle = 0
+
+    def __call__(self, sample):
+        """Returns the size the pool should have after ``sample``."""
+        if sample.waiters or sample.acquire_p95 >= self.grow_above:
+            self._slow += 1
+            self._idle = 0
+        elif sample.acquire_p95 <= self.shrink_below and sample.checked_out <= sample.size // 2:
+            self._idle += 1
+            self._slow = 0
+        else:
+            self._slow = self._idle = 0
+
+        if self._slow >= self.grow_after and sample.size < self.max_size:
+            self._slow = 0
+            return min(self.max_size, sample.size + max(1, sample.size // 4))
+
+        if self._idle >= self.shrink_after and sample.size > self.min_size:
+            self._idle = 0
+            return sample.size - 1
+
+        return max(self.min_size, min(self.max_size, sample.size))
+
+
+class Pool(asyncpg.pool.Pool):
+    """An :class:`asyncpg.pool.Pool` which samples its health and can be resized at runtime.
+    The pool is created with ``max_size`` connection holders, shrinking it parks idle
+    holders so they can't be acquired anymore, growing it puts them back.
+    """
+
+    def __init__(self, *args, slow_acquire_threshold=0.1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.telemetry = PoolTelemetry()
+        self.slow_acquire_threshold = slow_acquire_threshold
+        self._parked = []
+        # holder -> (label, monotonic time of the acquire)
+        self._checkouts = {}
+        self._waiting = 0
+        self._monitor = None
+        self._policy = None
+
+    @property
+    def size(self):
+        return len(self._holders) - len(self._parked)
+
+    @property
+    def max_size(self):
+        return self._maxsize
+
+    @property
+    def waiters(self):
+        return self._waiting
+
+    def checkouts(self):
+        """Returns who is currently holding connections as a list of ``(label, held_for)``, longest first."""
+        now = time.monotonic()
+        result = []
+        for holder, (label, acquired_at) in list(self._checkouts.items()):
+            if holder._in_use is None:
+                # Released without going through us, e.g. the connection was terminated.
+                del self._checkouts[holder]
+                continue
+            result.append((label, now - acquired_at))
+
+        result.sort(key=lambda t: t[1], reverse=True)
+        return result
+
+    def oldest_connection(self):
+        now = time.monotonic()
+        ages = [now - getattr(h._con, 'connected_at', now) for h in self._holders if h._con is not None]
+        return max(ages, default=0.0)
+
+    async def _acquire(self, timeout):
+        self._waiting += 1
+        start = time.perf_counter()
+        try:
+            proxy = await super()._acquire(timeout)
+        finally:
+            self._waiting -= 1
+
+        waited = time.perf_counter() - start
+        label = tracing.label_of(tracing.current_owner())
+        self.telemetry.record_acquire(waited)
+        tracing.add_pool_wait(waited)
+
+        if waited >= self.slow_acquire_threshold:
+            # Record who was hogging the connections while we waited.
+            slow = SlowAcquire(time.time(), waited, label, self.checkouts())
+            self.telemetry.slow_acquires.append(slow)
+            log.info(f'Waited {waited * 1000:.2f}ms to acquire a connection for {label}.')
+
+        self._checkouts[proxy._holder] = (label, time.monotonic())
+        return proxy
+
+    async def release(self, connection, *, timeout=None):
+        holder = getattr(connection, '_holder', None)
+        if holder is not None:
+            self._checkouts.pop(holder, None)
+        return await super().release(connection, timeout=timeout)
+
+    def resize(self, size):
+        """Changes how many connections can be checked out at once.
+        Only idle connections can be parked, so shrinking might take more than one call.
+        """
+        size = max(1, min(size, self._maxsize))
+
+        while self.size < size and self._parked:
+            self._queue.put_nowait(self._parked.pop())
+
+        if self.size <= size:
+            return
+
+        # This runs without yielding to the loop, so nobody can grab these in between.
+        idle = []
+        while not self._queue.empty():
+            idle.append(self._queue.get_nowait())
+
+        # Prefer parking holders without a connection.
+        excess = self.size - size
+        to_park = sorted(idle, key=lambda h: h._con is not None)[:excess]
+        for holder in to_park:
+            if holder._con is not None:
+                holder._deactivate_inactive_connection()
+            self._parked.append(holder)
+
+        # Put the rest back in their original LIFO order.
+        for holder in reversed(idle):
+            if holder not in to_park:
+                self._queue.put_nowait(holder)
+
+    def sample(self):
+        return self.telemetry.take_sample(size=self.size, checked_out=len(self.checkouts()), waiters=self.waiters,
+                                          oldest_connection=self.oldest_connection())
+
+    async def _run_monitor(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                sample = self.sample()
+                if self._policy is not None:
+                    size = self._policy(sample)
+                    if size != sample.size:
+                        log.info(f'Resizing connection pool from {sample.size} to {size}.')
+                        self.resize(size)
+            except Exception:
+                log.exception('Failed to sample the connection pool.')
+
+    def start_monitoring(self, *, interval=1.0, policy=None):
+        """Starts sampling the pool every ``interval`` seconds, optionally resizing it according to ``policy``."""
+        self._policy = policy
+        if policy is not None:
+            self.resize(policy.min_size)
+
+        if self._monitor is None:
+            self._monitor = self._loop.create_task(self._run_monitor(interval))
+
+    def _stop_monitoring(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+
+    async def close(self):
+        self._stop_monitoring()
+        await super().close()
+
+    def terminate(self):
+        self._stop_monitoring()
+        super().terminate()
+
+
+def create_pool(dsn=None, *, min_size=10, max_size=10, max_queries=50000, max_inactive_connection_lifetime=300.0,
+                setup=None, init=None, loop=None, connection_class=asyncpg.Connection, **connect_kwargs):
+    """Same as :func:`asyncpg.create_pool`, except that it creates a :class:`Pool`."""
+    return Pool(dsn, min_size=min_size, max_size=max_size, max_queries=max_queries,
+                max_inactive_connection_lifetime=max_inactive_connection_lifetime, setup=setup, init=init,
+                loop=loop, connection_class=connection_class, **connect_kwargs)
+
+
+class _ReadOnlyAcquire:
+    __slots__ = ('replicas', 'fallback', 'timeout', '_pool', '_con')
+
+    def __init__(self, replicas, fallback, timeout):
+        self.replicas = replicas
+        self.fallback = fallback
+        self.timeout = timeout
+        self._pool = None
+        self._con = None
+
+    async def __aenter__(self):
+        for pool in self.replicas.candidates():
+            try:
+                self._con = await pool.acquire(timeout=self.timeout)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                # E.g. unreachable, out of connections or shutting down, the primary can still serve the read.
+                self.replicas.mark_down(pool, e)
+            else:
+                self._pool = pool
+                return self._con
+
+        if self.fallback is not None:
+            return self.fallback
+
+        self._pool = self.replicas.primary
+        self._con = await self._pool.acquire(timeout=self.timeout)
+        return self._con
+
+    async def __aexit__(self, *args):
+        if self._pool is not None:
+            await self._pool.release(self._con)
+
+
+class ReplicaSet:
+    """Routes explicitly read-only queries to read replicas.
+    Replicas which are unreachable or lag behind the primary by more than
+    ``max_lag`` seconds are skipped, the primary is used when none are left.
+    """
+
+    # Zero when the replica replayed everything it received or when it isn't a replica at all.
+    LAG_QUERY = """SELECT CASE
+                       WHEN NOT pg_is_in_recovery() THEN 0
+                       WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                       ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                   END"""
+
+    def __init__(self, primary, replicas=(), *, max_lag=30.0):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.max_lag = max_lag
+        # pool -> lag in seconds, None if it's down or wasn't checked yet.
+        self.lag = {replica: None for replica in self.replicas}
+        self._next = 0
+        self._monitor = None
+
+    def healthy(self):
+        return [r for r in self.replicas if self.lag[r] is not None and self.lag[r] <= self.max_lag]
+
+    def candidates(self):
+        """Returns the usable replicas, rotated so the load gets spread evenly."""
+        healthy = self.healthy()
+        if not healthy:
+            return []
+
+        self._next = (self._next + 1) % len(healthy)
+        return healthy[self._next:] + healthy[:self._next]
+
+    def mark_down(self, replica, error=None):
+        if self.lag.get(replica) is not None:
+            log.warning(f'Read replica went down, falling back: {error}')
+        self.lag[replica] = None
+
+    def acquire(self, *, fallback=None, timeout=None):
+        """Acquires a connection for read-only queries.
+        If no replica is usable, ``fallback`` is returned instead, if given,
+        otherwise a connection from the primary pool.
+        """
+        return _ReadOnlyAcquire(self, fallback, timeout)
+
+    async def check(self):
+        for replica in self.replicas:
+            try:
+                lag = await replica.fetchval(self.LAG_QUERY, timeout=5.0)
+            except (OSError, asyncio.TimeoutError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                self.mark_down(replica, e)
+            else:
+                previous = self.lag[replica]
+                if lag > self.max_lag and (previous is None or previous <= self.max_lag):
+                    log.info(f'Read replica is lagging behind by {lag:.2f}s, skipping it.')
+                self.lag[replica] = float(lag)
+
+    async def _run_monitor(self, interval):
+        while True:
+            await self.check()
+            await asyncio.sleep(interval)
+
+    def start_monitoring(self, *, interval=10.0):
+        if self.replicas and self._monitor is None:
+            self._monitor = self.primary._loop.create_task(self._run_monitor(interval))
+
+    async def close(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+
+        for replica in self.replicas:
+            await replica.close()
@@ -0,0 +1,165 @@
+"""
+Timing of cog listeners, per cog, event and guild.
+
+Listeners registered through :meth:`cogs.utils.meta_cog.Cog.listener` are wrapped
+by :func:`timed_listener`. Besides the wall time, the wrapper measures how long
+the listener actually ran on the event loop, by timing every step of its
+coroutine. The rest of the wall time was spent awaiting something else,
+e.g. the database or Discord.
+"""
+
+import bisect
+import functools
+import time
+
+import discord
+
+# Upper bounds in seconds, anything slower ends up in the last bucket.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_clock = time.perf_counter
+_stats = {}
+
+
+class FixedHistogram:
+    __slots__ = ('counts', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Returns the upper bound of the bucket the percentile falls into."""
+        count = sum(self.counts)
+        if not count:
+            return 0.0
+
+        rank = percent / 100 * count
+        seen = 0
+        for bound, bucket in zip(BUCKETS, self.counts):
+            seen += bucket
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class ListenerStats:
+    __slots__ = ('cog', 'event', 'guild_id', 'calls', 'errors', 'wall', 'busy')
+
+    def __init__(self, cog, event, guild_id):
+        self.cog = cog
+        self.event = event
+        self.guild_id = guild_id
+        self.calls = 0
+        self.errors = 0
+        # Time from start to finish.
+        self.wall = FixedHistogram()
+        # Time spent running on the event loop.
+        self.busy = FixedHistogram()
+
+    @property
+    def awaited(self):
+        return max(0.0, self.wall.total - self.busy.total)
+
+
+def listener_stats():
+    """Returns the :class:`ListenerStats` of every cog, event and guild seen since start-up."""
+    return list(_stats.values())
+
+
+def reset():
+    _stats.clear()
+
+
+def record(cog, event, guild_id, wall, busy, failed=False):
+    key = (cog, event, guild_id)
+    try:
+        stats = _stats[key]
+    except KeyError:
+        stats = _stats[key] = ListenerStats(cog, event, guild_id)
+
+    stats.calls += 1
+    stats.errors += failed
+    stats.wall.observe(wall)
+    stats.busy.observe(busy)
+
+
+def guild_id_of(obj):
+    """Finds the guild an event's first argument belongs to, if any."""
+    if isinstance(obj, discord.Guild):
+        return obj.id
+
+    guild = getattr(obj, 'guild', None)
+    if guild is None:
+        # Reactions only know their message.
+        guild = getattr(getattr(obj, 'message', None), 'guild', None)
+    if guild is not None:
+        return guild.id
+
+    # Raw event payloads.
+    return getattr(obj, 'guild_id', None)
+
+
+class _Timed:
+    """Awaits a coroutine and adds up the time each of its steps took."""
+
+    __slots__ = ('coro', 'busy')
+
+    def __init__(self, coro):
+        self.coro = coro
+        self.busy = 0.0
+
+    def __await__(self):
+        coro = self.coro
+        value = error = None
+        while True:
+            start = _clock()
+            try:
+                if error is None:
+                    future = coro.send(value)
+                else:
+                    future = coro.throw(error)
+            except StopIteration as e:
+                self.busy += _clock() - start
+                return e.value
+            except BaseException:
+                self.busy += _clock() - start
+                raise
+            self.busy += _clock() - start
+
+            try:
+                value = yield future
+            except GeneratorExit:
+                coro.close()
+                raise
+            except BaseException as e:
+                value, error = None, e
+            else:
+                error = None
+
+
+def timed_listener(func, event):
+    """Wraps a cog listener, so its timings are recorded under ``event``."""
+
+    @functools.wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        timed = _Timed(func(self, *args, **kwargs))
+        start = _clock()
+        failed = False
+        try:
+            return await timed
+        except Exception:
+            failed = True
+            raise
+        finally:
+            guild_id = guild_id_of(args[0]) if args else None
+            record(self.qualified_name, event, guild_id, _clock() - start, timed.busy, failed)
+
+    return wrapper
@@ -0,0 +1,241 @@
+"""
+Rate limits for spam detection, in fixed memory.
+
+discord.py's cooldowns keep a bucket per key, so keying on message content
+creates one bucket per unique message during a raid. The counters in here
+are count-min sketches instead: a handful of fixed-size arrays which every
+key is hashed into, so memory doesn't depend on how many keys there are.
+"""
+
+from array import array
+
+# Counters are 32 bit, which is plenty for a window of a few seconds.
+_TYPECODE = 'I'
+
+
+class SlidingWindowCounter:
+    """Approximately counts events per key over the last ``per`` seconds.
+
+    The window is split into ``slots`` sub-windows, each of them a count-min
+    sketch of ``depth`` rows with ``width`` counters. Sub-windows are cleared as
+    they fall out of the window, so the window slides in steps of ``per / slots``.
+
+    Hash collisions can only make counts larger, never smaller. How likely that
+    is depends on how many keys are seen within one window compared to ``width``.
+
+    Parameters
+    -----------
+    rate: int
+        How many events are allowed within the window.
+    per: float
+        The length of the window, in seconds.
+    """
+
+    __slots__ = ('rate', 'per', 'width', 'depth', 'slots', '_slot_length', '_counters', '_slot_ids', '_zeros')
+
+    def __init__(self, rate, per, *, width=1024, depth=4, slots=6):
+        self.rate = rate
+        self.per = per
+        self.width = width
+        self.depth = depth
+        self.slots = slots
+        self._slot_length = per / slots
+        self._zeros = array(_TYPECODE, bytes(array(_TYPECODE).itemsize * width * depth))
+        self._counters = [array(_TYPECODE, self._zeros) for _ in range(slots)]
+        # The absolute number of the sub-window each entry of the ring holds.
+        self._slot_ids = [None] * slots
+
+    @property
+    def memory(self):
+        """The size of the counters, in bytes."""
+        return sum(c.itemsize * len(c) for c in self._counters)
+
+    def _positions(self, key):
+        # Double hashing, so one hash is enough for every row.
+        h = hash(key)
+        step = (h >> 17) | 1
+        width = self.width
+        return [row * width + (h + row * step) % width for row in range(self.depth)]
+
+    def _advance(self, now):
+        slot = int(now // self._slot_length)
+        index = slot % self.slots
+        if self._slot_ids[index] != slot:
+            # Whatever this entry held has left the window.
+            self._counters[index][:] = self._zeros
+            self._slot_ids[index] = slot
+        return slot, index
+
+    def _estimate(self, slot, positions):
+        live = [c for c, slot_id in zip(self._counters, self._slot_ids)
+                if slot_id is not None and slot - slot_id < self.slots]
+        return min(sum(c[pos] for c in live) for pos in positions)
+
+    def count(self, key, now):
+        """Returns roughly how many events ``key`` had within the window."""
+        slot, _ = self._advance(now)
+        return self._estimate(slot, self._positions(key))
+
+    def update(self, key, now):
+        """Records an event for ``key`` and returns whether it's over the rate."""
+        slot, index = self._advance(now)
+        positions = self._positions(key)
+        counters = self._counters[index]
+        for pos in positions:
+            counters[pos] += 1
+        return self._estimate(slot, positions) > self.rate
+
+    def clear(self):
+        for counters in self._counters:
+            counters[:] = self._zeros
+        self._slot_ids = [None] * self.slots
+
+
+_BITS = 64
+_MASK = (1 << _BITS) - 1
+
+
+def _popcount(value):
+    return bin(value).count('1')
+
+
+def normalise(text):
+    """Lowercases the text and collapses whitespace, which raiders like to vary."""
+    return ' '.join(text.casefold().split())
+
+
+def simhash(text, *, shingle=4):
+    """Returns a 64 bit fingerprint of the text's character shingles.
+    Similar texts have fingerprints which differ in only a few bits.
+    """
+    if len(text) <= shingle:
+        pieces = (text,)
+    else:
+        pieces = (text[i:i + shingle] for i in range(len(text) - shingle + 1))
+
+    # Every bit's count is kept bit-sliced, planes[j] holding bit j of all 64 counts,
+    # so adding a hash is a few integer operations instead of a loop over its bits.
+    planes = []
+    total = 0
+    for piece in pieces:
+        total += 1
+        carry = hash(piece) & _MASK
+        for j, plane in enumerate(planes):
+            if not carry:
+                break
+            planes[j] = plane ^ carry
+            carry &= plane
+        else:
+            if carry:
+                planes.append(carry)
+
+    # Keep the bits which are set in more than half of the hashes, comparing all counts at once.
+    half = total // 2
+    greater, equal = 0, _MASK
+    for j in reversed(range(max(len(planes), half.bit_length()))):
+        plane = planes[j] if j < len(planes) else 0
+        if (half >> j) & 1:
+            equal &= plane
+        else:
+            greater |= equal & plane
+            equal &= ~plane
+    return greater
+
+
+class NearDuplicateDetector:
+    """Notices when several users post nearly the same message.
+
+    The fingerprints of the last ``capacity`` messages are kept in a ring.
+    They're indexed by ``max_distance + 1`` bands of bits, as two fingerprints
+    within ``max_distance`` bits of each other must have at least one band in common.
+
+    Parameters
+    -----------
+    threshold: int
+        How many other users have to have posted a near-duplicate.
+    window: float
+        How many seconds back near-duplicates count.
+    capacity: int
+        How many fingerprints are kept.
+    max_distance: int
+        How many bits fingerprints can differ by to count as near-duplicates.
+    min_length: int
+        Shorter messages are ignored, everyone says "hi" at some point.
+    """
+
+    def __init__(self, *, threshold=5, window=30.0, capacity=1024, max_distance=8, min_length=16):
+        self.threshold = threshold
+        self.window = window
+        self.capacity = capacity
+        self.max_distance = max_distance
+        self.min_length = min_length
+
+        bands = max_distance + 1
+        self._band_bits = _BITS // bands
+        self._band_mask = (1 << self._band_bits) - 1
+        self._bands = [{} for _ in range(bands)]
+        self._timestamps = [None] * capacity
+        self._fingerprints = [0] * capacity
+        self._authors = [None] * capacity
+        self._next = 0
+
+    def _keys(self, fingerprint):
+        bits, mask = self._band_bits, self._band_mask
+        return [(fingerprint >> (i * bits)) & mask for i in range(len(self._bands))]
+
+    def _add(self, author_id, fingerprint, keys, now):
+        slot = self._next
+        self._next = (slot + 1) % self.capacity
+
+        if self._timestamps[slot] is not None:
+            # Evict whatever was in the slot from the index.
+            for band, key in zip(self._bands, self._keys(self._fingerprints[slot])):
+                slots = band[key]
+                slots.discard(slot)
+                if not slots:
+                    del band[key]
+
+        self._timestamps[slot] = now
+        self._fingerprints[slot] = fingerprint
+        self._authors[slot] = author_id
+        for band, key in zip(self._bands, keys):
+            band.setdefault(key, set()).add(slot)
+
+    def near_duplicates(self, author_id, fingerprint, keys, now):
+        """Returns the other users who posted a near-duplicate within the window, up to the threshold."""
+        authors = set()
+        seen = set()
+        for band, key in zip(self._bands, keys):
+            for slot in band.get(key, ()):
+                if slot in seen:
+                    continue
+                seen.add(slot)
+
+                other = self._authors[slot]
+                if other == author_id or other in authors or now - self._timestamps[slot] > self.window:
+                    continue
+
+                if _popcount(fingerprint ^ self._fingerprints[slot]) <= self.max_distance:
+                    authors.add(other)
+                    if len(authors) >= self.threshold:
+                        return authors
+        return authors
+
+    def check(self, author_id, content, now):
+        """Records a message and returns whether enough other users posted nearly the same thing."""
+        text = normalise(content)
+        if len(text) < self.min_length:
+            return False
+
+        fingerprint = simhash(text)
+        keys = self._keys(fingerprint)
+        flagged = len(self.near_duplicates(author_id, fingerprint, keys, now)) >= self.threshold
+        self._add(author_id, fingerprint, keys, now)
+        return flagged
+
+    def clear(self):
+        for band in self._bands:
+            band.clear()
+        self._timestamps = [None] * self.capacity
+        self._authors = [None] * self.capacity
+        self._next = 0
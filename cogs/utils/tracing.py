@@ -0,0 +1,66 @@
+"""
+Attributes work done inside a task to whoever started it.
+
+The owner is usually a command's :class:`Context` or a :class:`Trace` for
+event listeners. It is stored in a context variable, so every task spawned
+while handling the command or event inherits it.
+Owners are expected to provide the same attributes as :class:`Trace`.
+"""
+
+import contextvars
+
+_owner = contextvars.ContextVar('tracing_owner', default=None)
+
+
+class Trace:
+    """A generic owner, used for everything that isn't a command."""
+
+    __slots__ = ('label', 'db_time', 'db_calls', 'pool_wait', 'http_time', 'http_calls')
+
+    def __init__(self, label):
+        self.label = label
+        self.db_time = 0.0
+        self.db_calls = 0
+        self.pool_wait = 0.0
+        self.http_time = 0.0
+        self.http_calls = 0
+
+    def __repr__(self):
+        return f'<Trace label={self.label!r}>'
+
+
+def current_owner():
+    return _owner.get()
+
+
+def label_of(owner):
+    return 'unknown' if owner is None else owner.label
+
+
+def set_owner(owner):
+    """Sets the owner for the current context and returns a token for :func:`reset_owner`."""
+    return _owner.set(owner)
+
+
+def reset_owner(token):
+    _owner.reset(token)
+
+
+def add_db_time(elapsed):
+    owner = _owner.get()
+    if owner is not None:
+        owner.db_time += elapsed
+        owner.db_calls += 1
+
+
+def add_pool_wait(elapsed):
+    owner = _owner.get()
+    if owner is not None:
+        owner.pool_wait += elapsed
+
+
+def add_http_time(elapsed):
+    owner = _owner.get()
+    if owner is not None:
+        owner.http_time += elapsed
+        owner.http_calls += 1
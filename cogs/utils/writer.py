@@ -0,0 +1,446 @@
+"""
+Buffers rows in memory and writes them in bulk using COPY.
+
+Meant for high volume, low value writes such as command usage, where nobody
+is waiting for the row to show up in the database right away.
+Tables can be given a spill file, which buffered rows are moved to while the
+database is unreachable, so memory usage stays flat during outages.
+"""
+
+import asyncio
+import inspect
+import logging
+import os
+import pickle
+import struct
+import time
+import uuid
+from collections import namedtuple
+from pathlib import Path
+
+import asyncpg
+
+log = logging.getLogger(__name__)
+
+# COPY has no RETURNING clause, so ids are taken from the table's sequence up front.
+ALLOCATE_IDS = "SELECT nextval(pg_get_serial_sequence($1, $2)) FROM generate_series(1, $3)"
+
+# Errors which leave the buffered rows intact, so they can be written later on.
+RETRYABLE_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError, asyncpg.CannotConnectNowError,
+                    asyncpg.InterfaceError)
+
+
+async def copy_returning(con, table, columns, records, *, id_column='id'):
+    """Copies ``records`` into ``table`` and returns the ids they were given, in order."""
+    records = list(records)
+    if not records:
+        return []
+
+    ids = [r[0] for r in await con.fetch(ALLOCATE_IDS, table, id_column, len(records))]
+    await con.copy_records_to_table(table, columns=(id_column, *columns),
+                                    records=[(id_, *record) for id_, record in zip(ids, records)])
+    return ids
+
+
+WriterStats = namedtuple('WriterStats', 'table pending capacity written spilled replayed')
+
+
+class SpillFile:
+    """An append-only file of pickled batches of rows, each prefixed with its length.
+    How far it was replayed is kept in a separate file, so replaying can resume after a restart.
+    """
+
+    HEADER = struct.Struct('>I')
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.offset_path = self.path.with_name(self.path.name + '.offset')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.size = self.path.stat().st_size if self.path.exists() else 0
+        self.offset = int(self.offset_path.read_text()) if self.offset_path.exists() else 0
+
+    @property
+    def pending(self):
+        """How many bytes weren't replayed yet."""
+        return self.size - self.offset
+
+    def append(self, rows):
+        data = pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.path.open('ab') as fp:
+            fp.write(self.HEADER.pack(len(data)) + data)
+            fp.flush()
+            os.fsync(fp.fileno())
+        self.size += self.HEADER.size + len(data)
+
+    def read(self, offset):
+        """Returns the batch at ``offset`` and the offset of the next one.
+        Returns ``None`` at the end of the file, a torn write at the end counts as such.
+        """
+        with self.path.open('rb') as fp:
+            fp.seek(offset)
+            header = fp.read(self.HEADER.size)
+            if len(header) < self.HEADER.size:
+                return None
+
+            length, = self.HEADER.unpack(header)
+            data = fp.read(length)
+            if len(data) < length:
+                return None
+
+        return pickle.loads(data), offset + self.HEADER.size + length
+
+    def advance(self, offset):
+        temp_file = self.offset_path.with_name(f'{uuid.uuid4()}-{self.offset_path.name}.tmp')
+        temp_file.write_text(str(offset))
+        temp_file.replace(self.offset_path)
+        self.offset = offset
+
+    def clear(self):
+        for path in (self.path, self.offset_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+        self.size = self.offset = 0
+
+
+class _Buffer:
+    __slots__ = ('table', 'columns', 'max_rows', 'capacity', 'interval', 'returning', 'on_flush', 'spill',
+                 'rows', 'callbacks', 'flushing', 'since', 'failing', 'lock', 'room', 'written')
+
+    def __init__(self, table, columns, *, max_rows, capacity, interval, returning, on_flush, spill, loop):
+        self.table = table
+        self.columns = tuple(columns)
+        self.max_rows = max_rows
+        self.capacity = capacity
+        self.interval = interval
+        self.returning = returning
+        self.on_flush = on_flush
+        self.spill = spill
+        self.rows = []
+        self.callbacks = []
+        # The rows which are being written right now.
+        self.flushing = []
+        # When the oldest buffered row was put, or when writing last failed.
+        self.since = None
+        # Whether the last write failed because the database is unreachable.
+        self.failing = False
+        self.lock = asyncio.Lock(loop=loop)
+        self.room = asyncio.Event(loop=loop)
+        self.room.set()
+        self.written = 0
+
+    def has_work(self):
+        return bool(self.rows) or (self.spill is not None and self.spill.pending > 0)
+
+    def is_due(self, now):
+        return len(self.rows) >= self.max_rows or (self.has_work() and now - self.since >= self.interval)
+
+
+class WriteBehind:
+    """Buffers rows per table and flushes them with ``COPY`` once enough of them
+    piled up or the buffer is old enough, whatever comes first.
+
+    Callers are suspended by :meth:`put` while a table's buffer is at capacity,
+    unless the database is unreachable and the table has a spill file.
+    Anything left over is written, or spilled, by :meth:`close`.
+    """
+
+    def __init__(self, *, loop=None):
+        self.loop = loop or asyncio.get_event_loop()
+        self.pool = None
+        self._buffers = {}
+        self._wakeup = asyncio.Event(loop=self.loop)
+        self._task = None
+        self._closed = False
+
+    def register(self, table, columns, *, max_rows=1000, capacity=None, interval=10.0, returning=None,
+                 on_flush=None, spill=None):
+        """Registers a table rows can be buffered for.
+        Registering it again, e.g. on a cog reload, updates its settings. Its columns,
+        ``returning`` and ``spill`` can't change until a restart, they raise :exc:`ValueError`.
+
+        Parameters
+        -----------
+        table: str
+            The table to copy the rows into.
+        columns: Sequence[str]
+            The columns every row provides, in order.
+        max_rows: int
+            How many rows trigger a flush.
+        capacity: Optional[int]
+            How many rows can be buffered before :meth:`put` starts waiting.
+            Defaults to four times ``max_rows``.
+        interval: float
+            How many seconds rows are buffered for at most.
+        returning: Optional[str]
+            The serial column to hand to the callbacks given to :meth:`put`.
+        on_flush: Optional[Callable[[asyncpg.Connection, List[tuple]], Awaitable]]
+            Called with the connection and the rows after every write, within the
+            same transaction. If it fails, the rows are still written.
+        spill: Optional[Union[str, os.PathLike]]
+            The file rows are spilled to while the database is unreachable.
+            They are replayed in order, before anything else, once it's back.
+            Doesn't work together with ``returning``.
+        """
+        if spill is not None and returning is not None:
+            raise ValueError('Rows with callbacks cannot be spilled.')
+
+        capacity = capacity or max_rows * 4
+        if table in self._buffers:
+            # Cogs register their tables on load, so this happens on every reload.
+            self._update(self._buffers[table], columns, max_rows=max_rows, capacity=capacity, interval=interval,
+                         returning=returning, on_flush=on_flush, spill=spill)
+            return
+
+        spill = SpillFile(spill) if spill is not None else None
+        buffer = _Buffer(table, columns, max_rows=max_rows, capacity=capacity, interval=interval,
+                         returning=returning, on_flush=on_flush, spill=spill, loop=self.loop)
+        if spill is not None and spill.pending:
+            log.info(f'Found {spill.pending} bytes of spilled rows for {table}, replaying them.')
+            buffer.since = time.monotonic() - interval
+            self._wakeup.set()
+
+        self._buffers[table] = buffer
+
+    @staticmethod
+    def _update(buffer, columns, *, max_rows, capacity, interval, returning, on_flush, spill):
+        spill_path = Path(spill) if spill is not None else None
+        if (tuple(columns) != buffer.columns or returning != buffer.returning
+                or spill_path != (buffer.spill and buffer.spill.path)):
+            # Rows which are already buffered or spilled have the old shape.
+            raise ValueError(f'The rows of {buffer.table} changed shape, restart to register it again.')
+
+        buffer.max_rows = max_rows
+        buffer.capacity = capacity
+        buffer.interval = interval
+        buffer.on_flush = on_flush
+        if len(buffer.rows) < capacity:
+            buffer.room.set()
+        else:
+            buffer.room.clear()
+
+    def pending(self, table=None):
+        if table is not None:
+            return len(self._buffers[table].rows)
+        return sum(len(b.rows) for b in self._buffers.values())
+
+    def buffered(self, table):
+        """Returns the rows for ``table`` which aren't in the database yet."""
+        buffer = self._buffers[table]
+        return buffer.flushing + buffer.rows
+
+    def stats(self):
+        """Returns a :class:`WriterStats` for every registered table.
+        ``spilled`` is the size of the spill file in bytes and ``replayed`` how much of it was replayed.
+        """
+        return [WriterStats(b.table, len(b.rows), b.capacity, b.written,
+                            b.spill.size if b.spill else 0, b.spill.offset if b.spill else 0)
+                for b in self._buffers.values()]
+
+    async def put(self, table, row, *, callback=None):
+        """Buffers a row for ``table``, waiting for room if the buffer is full.
+
+        ``callback`` is called with the row's id once it got written, if the
+        table was registered with ``returning``. It can be a coroutine function.
+        """
+        if self._closed:
+            raise RuntimeError('The writer is closed.')
+
+        buffer = self._buffers[table]
+        if callback is not None and buffer.returning is None:
+            raise ValueError(f'{table} was registered without a returning column.')
+
+        while len(buffer.rows) >= buffer.capacity:
+            if buffer.failing and buffer.spill is not None:
+                await self._spill(buffer)
+                continue
+
+            buffer.room.clear()
+            self._wakeup.set()
+            await buffer.room.wait()
+
+        if not buffer.rows:
+            buffer.since = time.monotonic()
+            # Let the flusher know about the new deadline.
+            self._wakeup.set()
+
+        buffer.rows.append(tuple(row))
+        buffer.callbacks.append(callback)
+        if len(buffer.rows) >= buffer.max_rows:
+            self._wakeup.set()
+
+    def start(self, pool):
+        """Starts flushing buffered rows to ``pool`` in the background."""
+        self.pool = pool
+        if self._task is None:
+            self._task = self.loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            now = time.monotonic()
+            timeout = min((b.since + b.interval - now for b in self._buffers.values() if b.has_work()),
+                          default=None)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), max(timeout, 0) if timeout is not None else None)
+            except asyncio.TimeoutError:
+                pass
+
+            self._wakeup.clear()
+            try:
+                await self.flush(force=False)
+            except Exception:
+                log.exception('Failed to flush buffered rows.')
+
+    async def flush(self, table=None, *, force=True):
+        """Writes buffered rows now. Without ``force`` only buffers which are due get written."""
+        buffers = [self._buffers[table]] if table is not None else list(self._buffers.values())
+        now = time.monotonic()
+        for buffer in buffers:
+            if buffer.has_work() and (force or buffer.is_due(now)):
+                await self._flush_buffer(buffer)
+
+    async def _write(self, buffer, con, rows):
+        async with con.transaction():
+            if buffer.returning is not None:
+                ids = await copy_returning(con, buffer.table, buffer.columns, rows, id_column=buffer.returning)
+            else:
+                ids = None
+                await con.copy_records_to_table(buffer.table, columns=buffer.columns, records=rows)
+
+            if buffer.on_flush is not None:
+                await self._run_on_flush(buffer, con, rows)
+
+        return ids
+
+    @staticmethod
+    def _retry_later(buffer, error):
+        buffer.since = time.monotonic()
+        if not buffer.failing:
+            log.warning(f'Could not write rows to {buffer.table}, retrying later: {error}')
+        buffer.failing = True
+        if buffer.spill is not None:
+            # Let waiting callers spill instead.
+            buffer.room.set()
+
+    async def _replay(self, buffer):
+        """Writes the spilled rows, in order. Returns whether everything was replayed."""
+        spill = buffer.spill
+        read = self.loop.run_in_executor
+        try:
+            async with self.pool.acquire() as con:
+                while (batch := await read(None, spill.read, spill.offset)) is not None:
+                    rows, offset = batch
+                    # Rows spilled before columns were added to the end of the table lack them.
+                    width = len(buffer.columns)
+                    rows = [(*row, *(None,) * (width - len(row))) if len(row) < width else row for row in rows]
+                    try:
+                        await self._write(buffer, con, rows)
+                    except RETRYABLE_ERRORS:
+                        raise
+                    except Exception:
+                        log.exception(f'Dropped {len(rows)} spilled rows for {buffer.table}.')
+                    else:
+                        buffer.written += len(rows)
+
+                    await read(None, spill.advance, offset)
+        except RETRYABLE_ERRORS as e:
+            self._retry_later(buffer, e)
+            return False
+
+        log.info(f'Replayed {spill.size} bytes of spilled rows for {buffer.table}.')
+        await read(None, spill.clear)
+        return True
+
+    async def _spill(self, buffer):
+        async with buffer.lock:
+            rows = buffer.rows
+            buffer.rows, buffer.callbacks = [], []
+            if rows:
+                await self.loop.run_in_executor(None, buffer.spill.append, rows)
+                log.warning(f'Spilled {len(rows)} rows for {buffer.table} to {buffer.spill.path}.')
+            buffer.room.set()
+
+    async def _flush_buffer(self, buffer):
+        async with buffer.lock:
+            if buffer.spill is not None and buffer.spill.pending:
+                # Spilled rows are older than anything in memory, so they go first.
+                if not await self._replay(buffer):
+                    return
+
+            rows, callbacks = buffer.rows, buffer.callbacks
+            buffer.rows, buffer.callbacks = [], []
+            if not rows:
+                return
+
+            buffer.flushing = rows
+            try:
+                async with self.pool.acquire() as con:
+                    ids = await self._write(buffer, con, rows)
+            except RETRYABLE_ERRORS as e:
+                # Put them back in front of whatever got buffered in the meantime.
+                # They're retried once the interval passed again.
+                buffer.rows[:0] = rows
+                buffer.callbacks[:0] = callbacks
+                self._retry_later(buffer, e)
+                return
+            except Exception:
+                log.exception(f'Dropped {len(rows)} rows for {buffer.table}.')
+                return
+            finally:
+                buffer.flushing = []
+                if len(buffer.rows) < buffer.capacity:
+                    buffer.room.set()
+
+            if buffer.failing:
+                log.info(f'Writing rows to {buffer.table} works again.')
+            buffer.failing = False
+            buffer.written += len(rows)
+            log.debug(f'Wrote {len(rows)} rows to {buffer.table}.')
+
+        if ids is not None:
+            self._run_callbacks(buffer.table, callbacks, ids)
+
+    @staticmethod
+    async def _run_on_flush(buffer, con, rows):
+        try:
+            # A savepoint, so a failing hook doesn't take the rows down with it.
+            async with con.transaction():
+                await buffer.on_flush(con, rows)
+        except RETRYABLE_ERRORS:
+            # The connection is gone, the rows can't have been written either.
+            raise
+        except Exception:
+            # Including bugs in the hook, which mustn't lose the rows.
+            log.exception(f'Flush hook for {buffer.table} failed.')
+
+    def _run_callbacks(self, table, callbacks, ids):
+        for callback, id_ in zip(callbacks, ids):
+            if callback is None:
+                continue
+
+            try:
+                result = callback(id_)
+                if inspect.isawaitable(result):
+                    self.loop.create_task(result)
+            except Exception:
+                log.exception(f'Callback for a row in {table} failed.')
+
+    async def close(self):
+        """Stops the background flushing and writes everything which is still buffered."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self.pool is None:
+            return
+
+        await self.flush()
+        for buffer in self._buffers.values():
+            if buffer.rows and buffer.spill is not None:
+                await self._spill(buffer)
+
+        if lost := self.pending():
+            log.error(f'Lost {lost} buffered rows on shutdown.')
@@ -27,6 +27,9 @@ class WarningEntry(db.Table, table_name="warning_entries"):
     # When the warning was created.
     created = db.Column(db.Datetime, default="now() at time zone 'utc'", index=True)
 
+    # Used by the paginators.
+    guild_member_created = db.Index('guild_id', 'member_id', 'created')
+
 
 ActionInformation = namedtuple("ActionInformation", "member text is_warning")
 
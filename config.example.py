@@ -18,6 +18,36 @@ dev_prefix = "!"
 # The default postgresql driver connection string.
 postgresql = "postgresql://localhost:5432/firesidebot"
 
+# Connection strings of read-only replicas, used for heavy read-only queries like stats.
+postgresql_replicas = []
+
+# Replicas lagging behind the primary by more than this many seconds are skipped.
+max_replica_lag = 30.0
+
+# Queries that take longer than this many seconds are logged, with their parameters redacted.
+# Set this to None to disable the slow query log.
+slow_query_threshold = 0.5
+
+# Bounds for the database connection pool.
+# The pool grows towards the maximum while acquiring connections is slow and shrinks back when idle.
+pool_min_size = 10
+pool_max_size = 20
+
+# The JSON library used for jsonb columns: "orjson", "ujson" or "json".
+# Set this to None to use the fastest one that's installed.
+json_backend = None
+
+# Serve Prometheus metrics on http://127.0.0.1:<port>/metrics. Set this to None to disable it.
+metrics_port = None
+
+# The event loop being blocked for longer than this many seconds is logged, along with what blocked it.
+loop_stall_threshold = 0.25
+
+# How many of the most recent gateway payloads, and how many bytes of them, are kept for debugging.
+# They're dumped to flight_recorder/ on crashes, on SIGUSR1 and through the dumpevents command.
+flight_recorder_events = 5000
+flight_recorder_bytes = 8 * 1024 ** 2
+
 # The DSN used by sentry.io's error handler.
 sentry_dsn = ""
 
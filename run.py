@@ -4,11 +4,13 @@ import sys
 import traceback
 import warnings
 
+import asyncpg
 import click
 
 import config
 from bot import FiresideBot
 from cogs.utils.db import Table
+from cogs.utils.pool import AdaptiveSizing
 
 # Asyncpg still explicitly passes `loop`, which is deprecated since python 3.8.
 # We suppress this here because it's just unwanted noise.
@@ -31,14 +33,30 @@ def run_bot():
             # Asyncpg still explicitly passes `loop`, which is deprecated since python 3.8.
             # We suppress this here because it's just unwanted noise.
             warnings.simplefilter("ignore")
-            pool = loop.run_until_complete(Table.create_pool(config.postgresql, command_timeout=60))
+            threshold = getattr(config, "slow_query_threshold", None)
+            min_size = getattr(config, "pool_min_size", 10)
+            max_size = getattr(config, "pool_max_size", min_size)
+            replicas = getattr(config, "postgresql_replicas", [])
+            max_lag = getattr(config, "max_replica_lag", 30.0)
+            json_backend = getattr(config, "json_backend", None)
+            pool = loop.run_until_complete(Table.create_pool(config.postgresql, command_timeout=60,
+                                                             replicas=replicas, max_replica_lag=max_lag,
+                                                             slow_query_threshold=threshold,
+                                                             json_backend=json_backend,
+                                                             min_size=min_size, max_size=max_size))
     except Exception as e:
         print(f"Could not load PostgreSQL ({e}). Exiting.")
         return
 
+    pool.start_monitoring(policy=AdaptiveSizing(min_size, max_size))
+    pool.replicas.start_monitoring()
+
     bot = FiresideBot(command_prefix=".", owner_id=config.owner)
     # Assign our bot pool properly
     bot.pool = pool
+    bot.writer.start(pool)
+    bot.leader.start(config.postgresql)
+    bot.notifications.start(config.postgresql)
     bot.run()
 
 
@@ -146,19 +164,150 @@ async def apply_migration(cog, quiet, index, *, downgrade=False):
         click.echo(f"Could not load {cog}.\n{traceback.format_exc()}", err=True)
         return
 
+    # Index changes are built with CONCURRENTLY so they don't lock the tables,
+    # which means they have to run on their own after the transaction.
+    deferred = []
+    migrated = []
     async with pool.acquire() as con:
         tr = con.transaction()
         await tr.start()
         for table in Table.all_tables():
             try:
-                await table.migrate(index=index, downgrade=downgrade, verbose=not quiet, connection=con)
+                if await table.migrate(index=index, downgrade=downgrade, verbose=not quiet, connection=con,
+                                       deferred=deferred):
+                    migrated.append(table)
             except RuntimeError as e:
                 click.echo(f"Could not migrate {table.__tablename__}: {e}", err=True)
                 await tr.rollback()
-                break
+                return
         else:
             await tr.commit()
 
+        # The schema changes are in, re-running the migration would fail on them.
+        for table in migrated:
+            table.write_current()
+
+        for i, (statement, cleanup) in enumerate(deferred):
+            if not quiet:
+                click.echo(statement)
+            try:
+                await con.execute(statement)
+            except asyncpg.PostgresError as e:
+                click.echo(f"Could not run {statement!r}: {e}", err=True)
+                if cleanup is not None:
+                    # A failed concurrent build leaves an invalid index behind, which IF NOT EXISTS would skip.
+                    await con.execute(cleanup)
+                click.echo("The rest of the migration was applied. Run these once the cause is fixed:", err=True)
+                for remaining, _ in deferred[i:]:
+                    click.echo(remaining, err=True)
+                sys.exit(1)
+
+
+async def _load_partitioned_tables(cogs):
+    try:
+        await Table.create_pool(config.postgresql)
+    except Exception:
+        click.echo(f"Could not create PostgreSQL connection pool.\n{traceback.format_exc()}", err=True)
+        return None
+
+    cogs = [f"cogs.{e}" if not e.startswith("cogs.") else e for e in cogs or config.autoload]
+    for ext in cogs:
+        try:
+            importlib.import_module(ext)
+        except Exception:
+            click.echo(f"Could not load {ext}.\n{traceback.format_exc()}", err=True)
+            return None
+
+    return [table for table in Table.all_tables() if table.__partition_key__ is not None]
+
+
+@db.group(short_help="manages partitioned tables", options_metavar="[options]")
+def partitions():
+    """Creates, converts and archives the monthly partitions of partitioned tables."""
+    pass
+
+
+@partitions.command(short_help="converts existing tables to partitioned ones")
+@click.argument("cogs", nargs=-1, metavar="[cogs]")
+@click.option("--ahead", help="how many months of partitions to create in advance", default=2)
+@click.option("-q", "--quiet", help="less verbose output", is_flag=True)
+def convert(cogs, ahead, quiet):
+    """Moves the rows of tables declared as partitioned into monthly partitions.
+    This locks the tables while running, so stop the bot first.
+    """
+
+    async def work():
+        tables = await _load_partitioned_tables(cogs)
+        for table in tables or ():
+            try:
+                converted = await table.convert_to_partitioned(ahead=ahead, verbose=not quiet)
+            except (RuntimeError, asyncpg.PostgresError) as e:
+                click.echo(f"Could not convert {table.__tablename__}: {e}", err=True)
+            else:
+                if converted:
+                    click.echo(f"Converted {table.__tablename__}.")
+                else:
+                    click.echo(f"{table.__tablename__} is already partitioned.")
+
+    asyncio.get_event_loop().run_until_complete(work())
+
+
+@partitions.command(short_help="creates upcoming partitions")
+@click.argument("cogs", nargs=-1, metavar="[cogs]")
+@click.option("--ahead", help="how many months of partitions to create in advance", default=2)
+@click.option("-q", "--quiet", help="less verbose output", is_flag=True)
+def ensure(cogs, ahead, quiet):
+    """Creates the partitions up to a few months from now. The bot does this daily."""
+
+    async def work():
+        tables = await _load_partitioned_tables(cogs)
+        for table in tables or ():
+            try:
+                created = await table.ensure_partitions(ahead=ahead, verbose=not quiet)
+            except (RuntimeError, asyncpg.PostgresError) as e:
+                click.echo(f"Could not create partitions for {table.__tablename__}: {e}", err=True)
+            else:
+                click.echo(f"Created {len(created)} partitions for {table.__tablename__}.")
+
+    asyncio.get_event_loop().run_until_complete(work())
+
+
+@partitions.command(short_help="archives and removes old partitions")
+@click.argument("cogs", nargs=-1, metavar="[cogs]")
+@click.option("--keep", help="how many months of history to keep", default=12)
+@click.option("--archive", help="the directory to export removed partitions to", default="archive",
+              type=click.Path(file_okay=False))
+@click.option("--no-archive", help="remove old partitions without exporting them", is_flag=True)
+@click.option("-q", "--quiet", help="less verbose output", is_flag=True)
+def retain(cogs, keep, archive, no_archive, quiet):
+    """Detaches partitions older than the retention period.
+    Unless told otherwise, they are exported as gzipped CSV files first.
+    """
+
+    if no_archive:
+        click.confirm("old partitions will be deleted for good, continue?", abort=True)
+        archive = None
+
+    async def work():
+        tables = await _load_partitioned_tables(cogs)
+        for table in tables or ():
+            try:
+                removed = await table.detach_partitions(keep=keep, archive=archive, verbose=not quiet)
+            except (OSError, RuntimeError, asyncpg.PostgresError) as e:
+                click.echo(f"Could not remove partitions of {table.__tablename__}: {e}", err=True)
+                continue
+
+            for name, path in removed:
+                if path is not None:
+                    click.echo(f"Archived {name} to {path}.")
+                else:
+                    click.echo(f"Removed {name}.")
+
+            if not removed:
+                click.echo(f"No partitions of {table.__tablename__} are older than {keep} months.")
+
+    asyncio.get_event_loop().run_until_complete(work())
+
 
 @db.command(short_help="upgrades from a migration")
 @click.argument("cog", nargs=1, metavar="[cog]")